@@ -1,22 +1,34 @@
 from tqdm.auto import tqdm
-from data.utils import DATA_FOLDER
+from pathlib import Path
 import csv
+import itertools
+import numpy as np
 import matplotlib.pyplot as plt
+from typing import Optional
+from dbpedia_enhance import catalog
 
+# up to this number of languages the counts of all combinations are computed at once
+MAX_DENSE_LANGS = 20
 
-def get_prop_distribution(properties: set, lang: str) -> list:
 
-    path_name = DATA_FOLDER / lang
-
-    size = len(properties)
+def get_prop_distribution(properties: set, prop_dir: Path) -> list:
+    """plots the number of entities per property, prop_dir is the folder returned by extract_properties"""
 
     prop_lengths = []
 
-    with tqdm(total=size) as pbar:
+    # the statistics catalog of the extraction already holds the entity counts, older extractions are counted here
+    prop_catalog = catalog.get_catalog(prop_dir)
+
+    if prop_catalog is not None:
+        prop_lengths = [prop_catalog["properties"][prop]["rows"]
+                        for prop in properties if prop in prop_catalog["properties"]]
+        properties = set()
+
+    with tqdm(total=len(properties)) as pbar:
         for prop in properties:
             pbar.update(1)
             try:
-                with open(path_name / f"{prop}.csv", "r", newline="", encoding="utf-8") as csv_trg_file:
+                with open(prop_dir / f"{prop}.csv", "r", newline="", encoding="utf-8") as csv_trg_file:
                     csv_reader = csv.reader(csv_trg_file)
 
                     # skip header row
@@ -37,71 +49,56 @@ def get_prop_distribution(properties: set, lang: str) -> list:
     fig.savefig("prop_dist.png", dpi=300, bbox_inches="tight")
 
 
-def get_lang_overlap(translations: set, lang_codes: list) -> dict:
-    """get the overlap between the three languages"""
-    de_len = 0
-    en_len = 0
-    nl_len = 0
+def get_lang_overlap(translations: set, lang_codes: list, languages: Optional[list] = None, max_size: Optional[int] = None) -> dict:
+    """
+    get the number of translations present in every combination of languages. The keys are the language codes joined
+    by "_", the combination of all languages is called "all". languages defaults to all columns of the translations,
+    max_size limits the size of the combinations for many languages
+    """
+    languages = lang_codes if languages is None else languages
+    num_langs = len(languages)
 
-    de_nl_len = 0
-    de_en_len = 0
-    nl_en_len = 0
+    if max_size is None:
+        max_size = num_langs if num_langs <= MAX_DENSE_LANGS else 3
 
-    de_nl_en_len = 0
+    masks, counts = np.unique(encode_lang_masks(translations, lang_codes, languages), return_counts=True)
 
-    de_id = lang_codes.index("de")
-    nl_id = lang_codes.index("nl")
-    en_id = lang_codes.index("en")
+    if num_langs <= MAX_DENSE_LANGS:
+        # number of translations per exact set of languages, summed over all supersets of every set
+        totals = np.bincount(masks.astype(np.int64), weights=counts, minlength=1 << num_langs).astype(np.int64)
+        for bit in range(num_langs):
+            view = totals.reshape(-1, 2, 1 << bit)
+            view[:, 0, :] += view[:, 1, :]
 
-    with tqdm(total=len(translations)) as pbar:
-        for translation in translations:
+        def count(subset_mask: int) -> int:
+            return int(totals[subset_mask])
+    else:
+        def count(subset_mask: int) -> int:
+            subset_mask = np.uint64(subset_mask)
+            return int(counts[(masks & subset_mask) == subset_mask].sum())
 
-            pbar.update(1)
-            if translation[de_id] != "" and translation[nl_id] != "" and translation[en_id] != "":
-                de_len += 1
-                nl_len += 1
-                en_len += 1
-                de_nl_len += 1
-                de_en_len += 1
-                nl_en_len += 1
-                de_nl_en_len += 1
-                continue
+    overlap = {}
 
-            if translation[de_id] != "" and translation[nl_id] != "":
-                de_len += 1
-                nl_len += 1
-                de_nl_len += 1
-                continue
+    for size in range(1, max_size + 1):
+        for subset in itertools.combinations(range(num_langs), size):
+            name = "all" if size == num_langs else "_".join(languages[idx] for idx in subset)
+            overlap[name] = count(sum(1 << idx for idx in subset))
 
-            if translation[de_id] != "" and translation[en_id] != "":
-                de_len += 1
-                en_len += 1
-                de_en_len += 1
-                continue
+    return overlap
 
-            if translation[nl_id] != "" and translation[en_id] != "":
-                nl_len += 1
-                en_len += 1
-                nl_en_len += 1
-                continue
 
-            if translation[nl_id] != "":
-                nl_len += 1
-                continue
+def encode_lang_masks(translations: set, lang_codes: list, languages: Optional[list] = None) -> np.ndarray:
+    """encodes the languages a translation is present in as a bitmask, bit i stands for languages[i]"""
+    languages = lang_codes if languages is None else languages
 
-            if translation[en_id] != "":
-                en_len += 1
-                continue
+    if len(languages) > 64:
+        raise ValueError("at most 64 languages can be encoded")
+
+    columns = np.array(list(translations), dtype=object).reshape(len(translations), len(lang_codes))
+
+    masks = np.zeros(len(translations), dtype=np.uint64)
+    for bit, lang in enumerate(languages):
+        present = columns[:, lang_codes.index(lang)] != ""
+        masks |= present.astype(np.uint64) << np.uint64(bit)
 
-            if translation[de_id] != "":
-                de_len += 1
-
-    return {
-        "de": de_len,
-        "nl": nl_len,
-        "en": en_len,
-        "de_nl": de_nl_len,
-        "de_en": de_en_len,
-        "nl_en": nl_en_len,
-        "all": de_nl_en_len
-    }
\ No newline at end of file
+    return masks
@@ -0,0 +1,81 @@
+import argparse
+import hashlib
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent.resolve()))
+
+import data.utils as dat_util
+from benchmark.http_server import start_server
+
+parser = argparse.ArgumentParser(prog="Download Benchmark",
+                                 description="Measures the throughput of segmented downloads against a local, bandwidth limited file server.")
+
+parser.add_argument("--size", type=int, default=64,
+                    help="Size of the served file in MB")
+parser.add_argument("--rate", type=int, default=16,
+                    help="Bandwidth limit of a single connection in MB/s")
+parser.add_argument("--connections", type=int, nargs="+", default=[1, 2, 4, 8],
+                    help="Numbers of connections to compare")
+
+
+def run_download(url: str, fname: str, connections: int, checksum: str) -> float:
+    """downloads a file from the local server and returns the time it took"""
+    start = time.perf_counter()
+    dat_util._download_file(url, fname, None, connections, checksum, True)
+    return time.perf_counter() - start
+
+
+def run_resume(directory: Path, fname: str, size: int, checksum: str) -> bool:
+    """interrupts a segmented download half way through and checks that it resumes to an intact file"""
+    server, base_url = start_server(directory, fail_after=size // 8)
+    try:
+        dat_util._download_file(f"{base_url}/{fname}", fname, None, 4, checksum, True)
+        return False
+    except Exception:
+        pass
+    finally:
+        server.shutdown()
+
+    server, base_url = start_server(directory)
+    try:
+        dat_util._download_file(f"{base_url}/{fname}", fname, None, 4, checksum)
+    finally:
+        server.shutdown()
+
+    with open(dat_util.DATA_FOLDER / fname, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest() == checksum
+
+
+if __name__ == "__main__":
+
+    options = parser.parse_args()
+
+    size = options.size * 1024 * 1024
+    fname = "benchmark_download.bin"
+
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = Path(tmp)
+        content = os.urandom(size)
+        checksum = hashlib.sha256(content).hexdigest()
+        with open(directory / fname, "wb") as out:
+            out.write(content)
+
+        try:
+            server, base_url = start_server(
+                directory, rate=options.rate * 1024 * 1024)
+            try:
+                for connections in options.connections:
+                    duration = run_download(
+                        f"{base_url}/{fname}", fname, connections, checksum)
+                    print(f"{connections} connection(s): {duration:.2f}s, {options.size / duration:.1f} MB/s")
+            finally:
+                server.shutdown()
+
+            print(f"resume after interruption: {'ok' if run_resume(directory, fname, size, checksum) else 'failed'}")
+        finally:
+            for path in dat_util.DATA_FOLDER.glob(f"{fname}*"):
+                path.unlink()
@@ -0,0 +1,181 @@
+import argparse
+import random
+import re
+import sys
+from itertools import accumulate
+from pathlib import Path
+from typing import Callable, Optional
+
+sys.path.insert(0, str(Path(__file__).parent.parent.resolve()))
+
+from data.utils import DATA_FOLDER
+
+BENCHMARK_FOLDER = DATA_FOLDER / "benchmark"
+
+XSD = "http://www.w3.org/2001/XMLSchema#"
+
+# share of properties with values of each type, roughly following the real infobox dumps
+DEFAULT_TYPE_MIX = {
+    "instance": 0.35,
+    "string": 0.3,
+    "integer": 0.12,
+    "nonNegativeInteger": 0.05,
+    "double": 0.08,
+    "date": 0.07,
+    "other": 0.03
+}
+
+
+
+def type_weight(value: str) -> tuple:
+    """argparse type for a type=weight pair of the type mix"""
+    typ, _, weight = value.partition("=")
+    if typ not in DEFAULT_TYPE_MIX:
+        raise argparse.ArgumentTypeError(
+            f"unknown type {typ}, use one of {list(DEFAULT_TYPE_MIX.keys())}")
+    try:
+        return typ, float(weight)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid weight in {value}, expected type=weight")
+
+
+parser = argparse.ArgumentParser(prog="Synthetic Dump Generator",
+                                 description="Writes deterministic infobox-properties dumps for two languages that can be used instead of the real DBpedia files.")
+
+parser.add_argument("--src_lang", type=str, default="en",
+                    help="Language code of the first dump")
+parser.add_argument("--trg_lang", type=str, default="de",
+                    help="Language code of the second dump")
+parser.add_argument("--subjects", type=int, default=100000,
+                    help="Number of subjects in every dump")
+parser.add_argument("--properties", type=int, default=2000,
+                    help="Number of distinct properties in every dump")
+parser.add_argument("--props_per_subject", type=float, default=6,
+                    help="Average number of triples per subject")
+parser.add_argument("--skew", type=float, default=1.1,
+                    help="Exponent of the zipf distribution of property sizes")
+parser.add_argument("--overlap", type=float, default=0.5,
+                    help="Share of subjects that exist in both languages")
+parser.add_argument("--agreement", type=float, default=0.8,
+                    help="Share of values of shared subjects that are equal in both languages")
+parser.add_argument("--same_name", type=float, default=0.1,
+                    help="Share of properties that have the same name in both languages")
+parser.add_argument("--type_mix", type=type_weight, nargs="+", default=None,
+                    help="Weights of the value types of properties as type=weight pairs, e.g. string=0.5 date=0.5")
+parser.add_argument("--seed", type=int, default=42,
+                    help="Seed of the random generator")
+
+
+def get_dump_name(lang: str) -> str:
+    return f"infobox-properties_lang={lang}.ttl"
+
+
+def generate_dumps(out_folder: Path, src_lang: str = "en", trg_lang: str = "de", subjects: int = 100000, properties: int = 2000,
+                   props_per_subject: float = 6, skew: float = 1.1, overlap: float = 0.5, agreement: float = 0.8,
+                   same_name: float = 0.1, type_mix: Optional[dict] = None, seed: int = 42) -> list:
+    """
+    writes a pair of synthetic dumps and returns their paths.
+    Both dumps describe the same underlying entities and attributes, so that the properties of both languages can be matched.
+    Property sizes follow a zipf distribution, the triples of every subject are written consecutively like in the real dumps.
+    """
+    out_folder.mkdir(parents=True, exist_ok=True)
+
+    type_mix = type_mix or DEFAULT_TYPE_MIX
+    rnd = random.Random(seed)
+    prop_types = rnd.choices(list(type_mix.keys()), weights=list(
+        type_mix.values()), k=properties)
+    cum_weights = list(accumulate(1 / (k + 1) ** skew for k in range(properties)))
+
+    files = []
+
+    for lang_idx, lang in enumerate([src_lang, trg_lang]):
+        out_file = out_folder / get_dump_name(lang)
+        files.append(out_file)
+
+        with open(out_file, "w", encoding="utf-8") as out:
+            for subj in range(subjects):
+                shared = _is_shared(subj, overlap)
+
+                # shared subjects are described with the same attributes in both languages, all others independently
+                subj_rnd = random.Random(
+                    f"{seed}-{subj}" if shared else f"{seed}-{lang}-{subj}")
+                num_props = max(1, round(subj_rnd.expovariate(1 / props_per_subject)))
+                attrs = sorted(set(subj_rnd.choices(
+                    range(properties), cum_weights=cum_weights, k=num_props)))
+
+                subj_name = get_entity_name(subj, lang)
+
+                for attr in attrs:
+                    prop = _get_prop_name(attr, lang, lang_idx, same_name)
+                    agrees = shared and subj_rnd.random() < agreement
+                    value = _get_value(subj, attr, prop_types[attr], lang, subjects,
+                                       None if agrees else f"{lang}-{subj_rnd.random()}")
+                    out.write(
+                        f"<http://{lang}.dbpedia.org/resource/{subj_name}> <http://{lang}.dbpedia.org/property/{prop}> {value} .\n")
+
+    return files
+
+
+def get_entity_name(idx: int, lang: str) -> str:
+    return f"Entity_{idx}_{lang}"
+
+
+def get_translation_stub(overlap: float) -> Callable:
+    """returns a replacement for translate_entity that translates the entities of generated dumps without network access"""
+    pattern = re.compile(r"Entity_(\d+)_\w+")
+
+    def translate_entity(entity_list, src_lang, langcodes, continue_val=None, part_results=None):
+        if isinstance(entity_list, str):
+            entity_list = [entity_list]
+
+        results = []
+        for entity in entity_list:
+            result = {src_lang: entity}
+            match = pattern.fullmatch(entity)
+            if match is not None and _is_shared(int(match.group(1)), overlap):
+                for lang in langcodes:
+                    result[lang] = get_entity_name(int(match.group(1)), lang)
+            results.append(result)
+
+        return results
+
+    return translate_entity
+
+
+def _is_shared(subj: int, overlap: float) -> bool:
+    return (subj * 2654435761) % 1000 < overlap * 1000
+
+
+def _get_prop_name(attr: int, lang: str, lang_idx: int, same_name: float) -> str:
+    if lang_idx == 0 or (attr * 40503) % 1000 < same_name * 1000:
+        return f"attr{attr}"
+    return f"{lang}Attr{attr}"
+
+
+def _get_value(subj: int, attr: int, typ: str, lang: str, subjects: int, noise: Optional[str]) -> str:
+    """returns the value of an attribute in turtle syntax. Values without noise are equal in all languages"""
+    rnd = random.Random(f"{subj}-{attr}" if noise is None else noise)
+
+    if typ == "instance":
+        return f"<http://{lang}.dbpedia.org/resource/{get_entity_name(rnd.randrange(subjects), lang)}>"
+    if typ == "string":
+        return f'"Value {rnd.randrange(10 ** 6)}"@{lang}'
+    if typ in ["integer", "nonNegativeInteger"]:
+        return f'"{rnd.randrange(10 ** 7)}"^^<{XSD}{typ}>'
+    if typ == "double":
+        return f'"{rnd.uniform(0, 10 ** 4):.3f}"^^<{XSD}double>'
+    if typ == "date":
+        return f'"{rnd.randrange(1800, 2023)}-{rnd.randrange(1, 13):02d}-{rnd.randrange(1, 29):02d}"^^<{XSD}date>'
+    return f"<http://example.org/{rnd.randrange(10 ** 6)}>"
+
+
+if __name__ == "__main__":
+
+    options = parser.parse_args()
+
+    paths = generate_dumps(BENCHMARK_FOLDER, options.src_lang, options.trg_lang, options.subjects, options.properties,
+                           options.props_per_subject, options.skew, options.overlap, options.agreement, options.same_name,
+                           dict(options.type_mix) if options.type_mix else None, options.seed)
+
+    for path in paths:
+        print(f"written {path} ({path.stat().st_size / 1024 ** 2:.1f} MB)")
@@ -0,0 +1,103 @@
+import os
+import re
+import time
+import threading
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+from functools import partial
+from pathlib import Path
+from typing import Optional, Tuple
+
+
+class RangeRequestHandler(SimpleHTTPRequestHandler):
+    """
+    serves files from a directory like the dbpedia databus does, including support for single byte range requests.
+    The bandwidth of every connection can be limited to emulate a remote server.
+    """
+
+    rate: Optional[int] = None
+    fail_after: Optional[int] = None
+    ranges: bool = True
+    max_range: Optional[int] = None
+
+    def send_head(self):
+        path = Path(self.translate_path(self.path))
+        if not path.is_file():
+            self.send_error(404, "File not found")
+            return None
+
+        size = path.stat().st_size
+        start, end = 0, size - 1
+        match = re.fullmatch(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+        if not self.ranges:
+            match = None
+
+        if match is not None:
+            start = int(match.group(1))
+            if match.group(2) != "":
+                end = min(int(match.group(2)), size - 1)
+            if start > end:
+                self.send_error(416, "Requested range not satisfiable")
+                return None
+            if self.max_range is not None:
+                # some servers answer a range request with a shorter range than requested
+                end = min(end, start + self.max_range - 1)
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        else:
+            self.send_response(200)
+
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Accept-Ranges", "bytes" if self.ranges else "none")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.end_headers()
+
+        f = open(path, "rb")
+        f.seek(start)
+        self.range = (start, end)
+        return f
+
+    def copyfile(self, source, outputfile):
+        start, end = self.range
+        remaining = end - start + 1
+        sent = 0
+        begin = time.monotonic()
+
+        while remaining > 0:
+            data = source.read(min(64 * 1024, remaining))
+            if not data:
+                break
+            if self.fail_after is not None and sent + len(data) > self.fail_after:
+                # drop the connection to emulate an interrupted download
+                outputfile.write(data[:max(0, self.fail_after - sent)])
+                self.close_connection = True
+                return
+            outputfile.write(data)
+            sent += len(data)
+            remaining -= len(data)
+
+            if self.rate is not None:
+                delay = sent / self.rate - (time.monotonic() - begin)
+                if delay > 0:
+                    time.sleep(delay)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(directory: Path, rate: Optional[int] = None, fail_after: Optional[int] = None, ranges: bool = True, max_range: Optional[int] = None) -> Tuple[ThreadingHTTPServer, str]:
+    """
+    starts a local file server in a background thread and returns it together with its base url.
+    Without ranges the server ignores range requests like a server that does not support them,
+    with max_range it sends at most this many bytes of every range request
+    """
+    handler = type("Handler", (RangeRequestHandler,), {
+                   "rate": rate, "fail_after": fail_after, "ranges": ranges, "max_range": max_range})
+    server = ThreadingHTTPServer(
+        ("127.0.0.1", 0), partial(handler, directory=os.fspath(directory)))
+    server.daemon_threads = True
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    host, port = server.server_address
+    return server, f"http://{host}:{port}"
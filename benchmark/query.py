@@ -0,0 +1,122 @@
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from pathlib import Path
+from urllib.parse import urlencode
+from urllib.request import urlopen
+
+sys.path.insert(0, str(Path(__file__).parent.parent.resolve()))
+
+from dbpedia_enhance import property_extractor, property_matcher, query_service
+from benchmark.generate import BENCHMARK_FOLDER, generate_dumps, get_translation_stub
+
+parser = argparse.ArgumentParser(prog="Query Benchmark",
+                                 description="Measures the latency and throughput of the query service on generated dumps with concurrent clients.")
+
+parser.add_argument("--subjects", type=int, default=20000,
+                    help="Number of subjects in every generated dump")
+parser.add_argument("--properties", type=int, default=500,
+                    help="Number of distinct properties in every generated dump")
+parser.add_argument("--requests", type=int, default=2000,
+                    help="Number of requests of every query type")
+parser.add_argument("--clients", type=int, default=8,
+                    help="Number of clients sending requests at the same time")
+parser.add_argument("--limit", type=int, default=100,
+                    help="Page size of the paginated queries")
+
+
+def get_queries(service: query_service.QueryService, src_lang: str, trg_lang: str, num: int, limit: int, seed: int = 0) -> dict:
+    """returns num random requests of every query type, pages are taken from anywhere in a property"""
+    rand = random.Random(seed)
+    src_index = service.get_index(src_lang)
+    props = [(lang, service.get_index(lang).properties) for lang in [src_lang, trg_lang]]
+    subjects = [(lang, service.get_index(lang).subjects) for lang in [src_lang, trg_lang]]
+
+    queries = {"values": [], "entity": [], "compare": [], "matches": []}
+
+    for _ in range(num):
+        lang, prop_array = rand.choice(props)
+        prop = prop_array[rand.randrange(len(prop_array))]
+        size = service.get_index(lang).get_properties(prop, 0, 1)["items"][0]["rows"]
+        queries["values"].append(("/values", {"lang": lang, "property": prop,
+                                              "offset": rand.randrange(max(1, size)), "limit": limit}))
+
+        lang, subject_array = rand.choice(subjects)
+        queries["entity"].append(("/entity", {"lang": lang, "subject": subject_array[rand.randrange(len(subject_array))],
+                                              "limit": limit}))
+
+        subject = src_index.subjects[rand.randrange(len(src_index.subjects))]
+        queries["compare"].append(("/compare", {"source": subject}))
+
+        queries["matches"].append(("/matches", {"limit": limit, "offset": rand.randrange(max(1, len(service.matches.pairs)))}))
+
+    return queries
+
+
+def run_load(base_url: str, queries: list, clients: int) -> tuple:
+    """sends the queries from several threads and returns the latency of every request in seconds and the total time"""
+    latencies = []
+    lock = threading.Lock()
+    pending = iter(queries)
+
+    def client():
+        while True:
+            with lock:
+                query = next(pending, None)
+            if query is None:
+                return
+            path, params = query
+            start = time.perf_counter()
+            with urlopen(f"{base_url}{path}?{urlencode(params)}") as response:
+                json.loads(response.read())
+            duration = time.perf_counter() - start
+            with lock:
+                latencies.append(duration)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return latencies, time.perf_counter() - start
+
+
+def _percentile(values: list, share: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(share * len(values)))]
+
+
+if __name__ == "__main__":
+
+    options = parser.parse_args()
+
+    src_lang, trg_lang = "en", "de"
+    src_file, trg_file = generate_dumps(BENCHMARK_FOLDER, src_lang, trg_lang, options.subjects, options.properties)
+    property_matcher.translate_entity = get_translation_stub(0.5)
+
+    src_props, src_dir = property_extractor.extract_properties(str(src_file))
+    trg_props, trg_dir = property_extractor.extract_properties(str(trg_file))
+    property_matcher.find_matches(src_props, trg_props, src_lang, trg_lang, src_dir, trg_dir, "query_benchmark")
+    out_file = property_matcher.get_matches_file(src_lang, trg_lang, "query_benchmark")
+
+    start = time.perf_counter()
+    service = query_service.get_query_service(src_lang, trg_lang, src_dir, trg_dir, out_file,
+                                              property_matcher.get_best_matches_file(out_file))
+    print(f"### query service opened in {time.perf_counter() - start:.2f}s")
+
+    server, base_url = query_service.start_server(service)
+
+    try:
+        print("")
+        print(f"{'query':<10}{'requests':>10}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+        for name, queries in get_queries(service, src_lang, trg_lang, options.requests, options.limit).items():
+            latencies, duration = run_load(base_url, queries, options.clients)
+            print(f"{name:<10}{len(latencies):>10}{len(latencies) / duration:>10.0f}{_percentile(latencies, 0.5) * 1000:>10.2f}"
+                  f"{_percentile(latencies, 0.95) * 1000:>10.2f}{_percentile(latencies, 0.99) * 1000:>10.2f}")
+    finally:
+        server.shutdown()
@@ -0,0 +1,213 @@
+import argparse
+import json
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent.resolve()))
+
+from dbpedia_enhance import metrics, executor, property_extractor, entity_extractor_new, type_extractor, property_matcher
+from dbpedia_enhance.utils import extract_value, get_chunks
+from benchmark.generate import BENCHMARK_FOLDER, generate_dumps, get_translation_stub, type_weight
+
+RESULTS_FILE = BENCHMARK_FOLDER / "results.jsonl"
+
+parser = argparse.ArgumentParser(prog="Pipeline Benchmark",
+                                 description="Runs every stage of the pipeline on synthetic dumps and records throughput and memory usage.")
+
+parser.add_argument("--subjects", type=int, default=20000,
+                    help="Number of subjects in every generated dump")
+parser.add_argument("--properties", type=int, default=500,
+                    help="Number of distinct properties in every generated dump")
+parser.add_argument("--skew", type=float, default=1.1,
+                    help="Exponent of the zipf distribution of property sizes")
+parser.add_argument("--overlap", type=float, default=0.5,
+                    help="Share of subjects that exist in both languages")
+parser.add_argument("--type_mix", type=type_weight, nargs="+", default=None,
+                    help="Weights of the value types of properties as type=weight pairs, e.g. string=0.5 date=0.5")
+parser.add_argument("--stages", type=str, nargs="+", default=None,
+                    help="Only run these stages")
+parser.add_argument("--compare", action="store_true",
+                    help="Only compare the last two recorded results")
+
+
+def bench_chunks(src_file: Path, **_) -> int:
+    return len(get_chunks(src_file, executor.get_num_tasks()))
+
+
+def bench_extract_value(src_file: Path, **_) -> int:
+    num = 0
+    with open(src_file, "r", encoding="utf-8") as f:
+        for line in f:
+            extract_value(line.split("> ", 2)[2])
+            num += 1
+    return num
+
+
+def bench_extract_properties(src_file: Path, trg_file: Path, state: dict, **_) -> int:
+    state["src_props"], state["src_dir"] = property_extractor.extract_properties(
+        str(src_file), force=True)
+    state["trg_props"], state["trg_dir"] = property_extractor.extract_properties(
+        str(trg_file), force=True)
+    return _count_lines(src_file) + _count_lines(trg_file)
+
+
+def bench_extract_subjects(src_file: Path, **_) -> int:
+    entity_extractor_new.extract_subjects(str(src_file), force=True)
+    return _count_lines(src_file)
+
+
+def bench_extract_types(src_file: Path, **_) -> int:
+    type_extractor.extract_types(str(src_file), force=True)
+    return _count_lines(src_file)
+
+
+def bench_split_dict(state: dict, trg_lang: str, src_lang: str, **_) -> int:
+    trg_props = sorted(property_matcher.clean_prop_list(state["trg_props"]))
+    trg_dict = property_matcher._get_split_dict(
+        trg_props, trg_lang, src_lang, state["trg_dir"])
+    return sum(len(entities) for entities in trg_dict.values())
+
+
+def bench_entity_matches(state: dict, trg_lang: str, src_lang: str, **_) -> int:
+    src_props, trg_props, _ = property_matcher.prepare_matching(
+        state["src_props"], state["trg_props"])
+    state["matches"] = property_matcher.find_entity_matches(
+        sorted(src_props), sorted(trg_props), src_lang, trg_lang, state["src_dir"], state["trg_dir"]).get_matches()
+    return len(src_props) * len(trg_props)
+
+
+# name, function, unit of the counted items; later stages depend on the results of extract_properties
+STAGES = [
+    ("get_chunks", bench_chunks, "chunks"),
+    ("extract_value", bench_extract_value, "triples"),
+    ("extract_properties", bench_extract_properties, "triples"),
+    ("extract_subjects", bench_extract_subjects, "triples"),
+    ("extract_types", bench_extract_types, "triples"),
+    ("split_dict", bench_split_dict, "entities"),
+    ("find_entity_matches", bench_entity_matches, "property pairs")
+]
+
+
+def run_benchmarks(options: argparse.Namespace) -> dict:
+    """generates the dumps, runs all stages and returns their results"""
+    src_lang, trg_lang = "en", "de"
+    type_mix = dict(options.type_mix) if options.type_mix else None
+    src_file, trg_file = generate_dumps(BENCHMARK_FOLDER, src_lang, trg_lang, options.subjects, options.properties,
+                                        skew=options.skew, overlap=options.overlap, type_mix=type_mix)
+
+    property_matcher.translate_entity = get_translation_stub(options.overlap)
+    metrics.enable(BENCHMARK_FOLDER / "profile", context=executor.MP_CONTEXT)
+
+    state = {}
+    results = {}
+
+    for name, func, unit in STAGES:
+        if options.stages is not None and name not in options.stages and name != "extract_properties":
+            continue
+
+        with metrics.stage(name):
+            start = time.perf_counter()
+            items = func(src_file=src_file, trg_file=trg_file,
+                         state=state, src_lang=src_lang, trg_lang=trg_lang)
+            duration = time.perf_counter() - start
+
+        results[name] = {
+            "seconds": duration,
+            "items": items,
+            "unit": unit,
+            "per_second": items / duration if duration > 0 else None
+        }
+
+    # memory is taken from the peak of the worker processes, or the main process for stages without workers
+    report = metrics.get_report()
+    worker_rss = {}
+    for rec in report["workers"]:
+        worker_rss[rec["name"]] = max(
+            worker_rss.get(rec["name"], 0), rec["peak_rss"] or 0)
+    for rec in report["stages"]:
+        if rec["name"] in results:
+            results[rec["name"]]["peak_rss"] = worker_rss.get(
+                _WORKER_NAMES.get(rec["name"]), rec["peak_rss"])
+
+    return {
+        "commit": _get_commit(),
+        "time": datetime.now().isoformat(timespec="seconds"),
+        "params": {"subjects": options.subjects, "properties": options.properties, "skew": options.skew, "overlap": options.overlap,
+                   "type_mix": type_mix},
+        "stages": results
+    }
+
+
+def compare_results(old: dict, new: dict) -> None:
+    """prints the change in throughput and memory between two recorded results"""
+    print(f"comparing {old['commit'][:8]} ({old['time']}) -> {new['commit'][:8]} ({new['time']})")
+    if old["params"] != new["params"]:
+        print("warning: the results were recorded with different parameters")
+
+    print(f"{'stage':<22}{'old/s':>14}{'new/s':>14}{'change':>9}{'old MB':>9}{'new MB':>9}")
+    for name, res in new["stages"].items():
+        prev = old["stages"].get(name)
+        if prev is None or prev["per_second"] is None or res["per_second"] is None:
+            continue
+        change = (res["per_second"] / prev["per_second"] - 1) * 100
+        print(f"{name:<22}{prev['per_second']:>14.0f}{res['per_second']:>14.0f}{change:>8.1f}%"
+              f"{_to_mb(prev.get('peak_rss')):>9}{_to_mb(res.get('peak_rss')):>9}")
+
+
+# worker functions that do the work of a stage
+_WORKER_NAMES = {
+    "extract_properties": "extract_properties",
+    "extract_subjects": "extract_subjects",
+    "extract_types": "extract_types",
+    "find_entity_matches": "match"
+}
+
+
+def _count_lines(file: Path) -> int:
+    with open(file, "rb") as f:
+        return sum(1 for _ in f)
+
+
+def _get_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=Path(__file__).parent).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def _to_mb(size) -> str:
+    return f"{size / 1024 ** 2:.0f}" if size else "-"
+
+
+def _read_results() -> list:
+    if not RESULTS_FILE.exists():
+        return []
+    with open(RESULTS_FILE, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip() != ""]
+
+
+if __name__ == "__main__":
+
+    options = parser.parse_args()
+
+    if not options.compare:
+        result = run_benchmarks(options)
+
+        with open(RESULTS_FILE, "a", encoding="utf-8") as out:
+            out.write(json.dumps(result) + "\n")
+
+        print("")
+        print(f"{'stage':<22}{'seconds':>10}{'throughput':>24}{'MB':>8}")
+        for name, res in result["stages"].items():
+            throughput = f"{res['per_second']:.0f} {res['unit']}/s" if res["per_second"] else "-"
+            print(f"{name:<22}{res['seconds']:>10.2f}{throughput:>24}{_to_mb(res.get('peak_rss')):>8}")
+        print(f"results appended to {RESULTS_FILE}")
+
+    results = _read_results()
+    if len(results) >= 2:
+        print("")
+        compare_results(results[-2], results[-1])
@@ -0,0 +1,244 @@
+import json
+import time
+import shutil
+import hashlib
+import threading
+from pathlib import Path
+from typing import Optional
+from filelock import FileLock, Timeout
+from data.utils import DATA_FOLDER
+from dbpedia_enhance import metrics
+
+CACHE_FOLDER = DATA_FOLDER / "cache"
+MANIFEST_FILE = CACHE_FOLDER / "manifest.json"
+
+# locks of the temporary folders this process is producing, they are released when the artifact is committed
+_producers = {}
+_producers_lock = threading.Lock()
+
+
+def get_key(stage: str, **inputs) -> str:
+    """returns the cache key of a pipeline stage as a hash of all inputs that influence its result"""
+    content = json.dumps({"stage": stage, **inputs},
+                         sort_keys=True, default=str)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def get_extraction_key(stage: str, file: str, lang: str, filtr: Optional[set], parser_version: str) -> str:
+    """returns the cache key of an extraction stage running over a dump file"""
+    return get_key(stage, lang=lang, dump=get_dump_checksum(file), category=get_set_hash(filtr), parser=parser_version)
+
+
+def get_dump_checksum(file: str) -> str:
+    """
+    returns the checksum of a dump file. This is the sha256 that was verified during the download if present,
+    otherwise a fingerprint of the file size and modification time
+    """
+    for sha_file in [DATA_FOLDER / f"{file}.sha256", DATA_FOLDER / f"{file}.bz2.sha256"]:
+        if sha_file.exists():
+            with open(sha_file, "r", encoding="utf-8") as f:
+                return f.read().strip()
+
+    stat = (DATA_FOLDER / file).stat()
+    return f"{stat.st_size}-{stat.st_mtime_ns}"
+
+
+def get_set_hash(items: Optional[set]) -> Optional[str]:
+    """returns an order independent hash of a set of strings"""
+    if items is None:
+        return None
+
+    sha = hashlib.sha256()
+    for item in sorted(items):
+        sha.update(item.encode("utf-8"))
+        sha.update(b"\n")
+
+    return sha.hexdigest()
+
+
+def get_artifact(key: str) -> Optional[Path]:
+    """returns the folder of a completed artifact or None if the stage has not been computed with these inputs yet"""
+    with _lock():
+        manifest = _read_manifest()
+        entry = manifest.get(key)
+
+        if entry is None or not (CACHE_FOLDER / entry["folder"]).exists():
+            metrics.count("cache_misses")
+            return None
+
+        entry["used"] = time.time()
+        _write_manifest(manifest)
+
+    metrics.count("cache_hits")
+
+    return CACHE_FOLDER / entry["folder"]
+
+
+def new_artifact(stage: str, key: str) -> Path:
+    """
+    returns an empty temporary folder for the artifact of a stage, which becomes visible after commit_artifact.
+    The folder is locked until it is committed or the process ends, another producer of the same key waits for it
+    """
+    folder_name = _get_folder_name(stage, key)
+    tmp_folder = CACHE_FOLDER / f"{folder_name}.tmp"
+
+    _lock_producer(folder_name)
+
+    if tmp_folder.exists():
+        shutil.rmtree(tmp_folder)
+
+    tmp_folder.mkdir(parents=True)
+
+    return tmp_folder
+
+
+def resume_artifact(stage: str, key: str) -> Path:
+    """returns the temporary folder of an artifact like new_artifact, but keeps the files of an earlier run that stopped before commit_artifact"""
+    folder_name = _get_folder_name(stage, key)
+    tmp_folder = CACHE_FOLDER / f"{folder_name}.tmp"
+
+    _lock_producer(folder_name)
+    tmp_folder.mkdir(parents=True, exist_ok=True)
+
+    return tmp_folder
+
+
+def commit_artifact(stage: str, key: str, inputs: Optional[dict] = None) -> Path:
+    """moves a finished artifact to its final location and records it in the manifest"""
+    folder_name = _get_folder_name(stage, key)
+    folder = CACHE_FOLDER / folder_name
+    tmp_folder = CACHE_FOLDER / f"{folder_name}.tmp"
+
+    with _lock():
+        if folder.exists():
+            shutil.rmtree(folder)
+        tmp_folder.replace(folder)
+
+        now = time.time()
+        manifest = _read_manifest()
+        manifest[key] = {
+            "stage": stage,
+            "folder": folder_name,
+            "inputs": inputs or {},
+            "size": _get_folder_size(folder),
+            "created": now,
+            "used": now
+        }
+        _write_manifest(manifest)
+
+    _unlock_producer(folder_name)
+
+    return folder
+
+
+def collect_garbage(max_size: Optional[int] = None, max_age: Optional[float] = None) -> list:
+    """
+    removes artifacts that have not been used for more than max_age seconds and afterwards the least recently used
+    artifacts until the cache is smaller than max_size bytes. Temporary folders of runs that stopped before they
+    committed their artifact count as used when they were last written to, folders that are still being produced are kept.
+    Returns the keys of the removed artifacts and the folder names of the removed temporary folders
+    """
+    removed = []
+
+    with _lock():
+        manifest = _read_manifest()
+        entries = [(key, entry["folder"], entry["size"], entry["used"]) for key, entry in manifest.items()]
+        entries.extend((None, folder.name, _get_folder_size(folder), _get_folder_mtime(folder))
+                       for folder in CACHE_FOLDER.glob("*.tmp") if folder.is_dir())
+        entries.sort(key=lambda entry: entry[3])
+        total = sum(entry[2] for entry in entries)
+        now = time.time()
+
+        for key, folder_name, size, used in entries:
+            too_old = max_age is not None and now - used > max_age
+            too_big = max_size is not None and total > max_size
+
+            if not too_old and not too_big:
+                continue
+
+            if key is None:
+                if not _remove_abandoned(folder_name):
+                    continue
+                removed.append(folder_name)
+            else:
+                shutil.rmtree(CACHE_FOLDER / folder_name, ignore_errors=True)
+                del manifest[key]
+                removed.append(key)
+            total -= size
+
+        _write_manifest(manifest)
+
+    return removed
+
+
+def _remove_abandoned(tmp_name: str) -> bool:
+    """removes a temporary folder if no process is producing it, returns if it was removed"""
+    lock = FileLock(str(CACHE_FOLDER / f"{tmp_name[:-len('.tmp')]}.lock"))
+
+    try:
+        lock.acquire(timeout=0)
+    except Timeout:
+        return False
+
+    try:
+        shutil.rmtree(CACHE_FOLDER / tmp_name, ignore_errors=True)
+    finally:
+        lock.release()
+
+    return True
+
+
+def _lock_producer(folder_name: str) -> None:
+    """locks the temporary folder of an artifact for this process, the same process can lock it again"""
+    CACHE_FOLDER.mkdir(parents=True, exist_ok=True)
+
+    with _producers_lock:
+        lock = _producers.get(folder_name)
+        if lock is None:
+            # artifacts can be committed by another thread than the one that created them
+            lock = _producers[folder_name] = FileLock(str(CACHE_FOLDER / f"{folder_name}.lock"), thread_local=False)
+
+    if not lock.is_locked:
+        lock.acquire()
+
+
+def _unlock_producer(folder_name: str) -> None:
+    with _producers_lock:
+        lock = _producers.pop(folder_name, None)
+
+    if lock is not None and lock.is_locked:
+        lock.release(force=True)
+
+
+def _get_folder_name(stage: str, key: str) -> str:
+    return f"{stage}_{key[:20]}"
+
+
+def _get_folder_size(folder: Path) -> int:
+    return sum(f.stat().st_size for f in folder.rglob("*") if f.is_file())
+
+
+def _get_folder_mtime(folder: Path) -> float:
+    return max([folder.stat().st_mtime] + [f.stat().st_mtime for f in folder.rglob("*") if f.is_file()])
+
+
+def _lock() -> FileLock:
+    CACHE_FOLDER.mkdir(parents=True, exist_ok=True)
+    return FileLock(str(CACHE_FOLDER / "manifest.json.lock"))
+
+
+def _read_manifest() -> dict:
+    if not MANIFEST_FILE.exists():
+        return {}
+
+    with open(MANIFEST_FILE, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _write_manifest(manifest: dict) -> None:
+    tmp_file = CACHE_FOLDER / "manifest.json.tmp"
+
+    with open(tmp_file, "w", encoding="utf-8") as out:
+        json.dump(manifest, out, indent=2)
+
+    tmp_file.replace(MANIFEST_FILE)
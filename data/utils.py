@@ -1,40 +1,68 @@
 import io
+import json
 import shutil
+import hashlib
+import threading
+import time
 import requests
 import bz2
-import multiprocessing as mp
 from tqdm import tqdm
+from filelock import FileLock
 from pathlib import Path
 from functools import partial
+from typing import Optional
+from dbpedia_enhance import metrics, executor
 
 DATA_FOLDER = Path(__file__).parent.resolve()
 
+# number of parallel connections used to download a single file
+DOWNLOAD_CONNECTIONS = 4
 
-def get_data(urllist: list, force_redownload: bool = False) -> list:
-    """download and extract the relevant rdf files from dbpedia"""
+# files (or remaining parts of files) smaller than this are not split any further
+MIN_SEGMENT_SIZE = 8 * 1024 * 1024
+
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+# seconds between two updates of the progress file of a segmented download
+STATE_SAVE_INTERVAL = 1.0
+
+DATABUS_SPARQL = "https://databus.dbpedia.org/sparql"
+
+# published checksums that were already looked up, a url contains the dump version so its checksum never changes
+CHECKSUM_FILE = DATA_FOLDER / "checksums.json"
+
+
+def get_data(urllist: list, force_redownload: bool = False, connections: int = DOWNLOAD_CONNECTIONS, checksums: Optional[dict] = None) -> list:
+    """
+    download and extract the relevant rdf files from dbpedia.
+    Every file is downloaded over multiple connections and checked against its published sha256 checksum.
+    Checksums can also be passed directly as a dict of url -> checksum, otherwise they are looked up on the databus.
+    """
     arglist = []
 
     for idx, url in enumerate(urllist):
-        args = (url, force_redownload, idx)
+        checksum = checksums.get(url) if checksums is not None else None
+        args = (url, force_redownload, idx, connections, checksum)
         arglist.append(args)
 
-    cpus = mp.cpu_count()
-    pool_size = min(len(urllist), cpus)
-
-    pool = mp.Pool(processes=pool_size, initializer=tqdm.set_lock,
-                   initargs=(mp.RLock(),))
-
-    filenames = pool.starmap(_get_file, arglist)
+    # every download shows its own progress bar, so the results are collected without an additional one
+    filenames = [None] * len(arglist)
+    for idx, fname in executor.imap_unordered(_get_file, arglist):
+        filenames[idx] = fname
 
     return filenames
 
 
-def _get_file(url: str, force_redownload: bool = False, pid=None) -> str:
+@metrics.worker("download")
+def _get_file(url: str, force_redownload: bool = False, pid=None, connections: int = DOWNLOAD_CONNECTIONS, checksum: Optional[str] = None) -> str:
     """downloads and extracts a single file from dbpedia"""
     fname = url.split("/")[-1]
 
-    if not Path(DATA_FOLDER / fname).exists() or force_redownload:
-        _download_file(url, fname, pid)
+    if checksum is None:
+        checksum = _get_published_checksum(url)
+
+    if not Path(DATA_FOLDER / fname).exists() or force_redownload or _is_outdated(fname, checksum):
+        _download_file(url, fname, pid, connections, checksum, force_redownload)
         if fname.endswith(".bz2"):
             fname = _extract_file(fname, pid)
 
@@ -45,21 +73,269 @@ def _get_file(url: str, force_redownload: bool = False, pid=None) -> str:
     return fname
 
 
-def _download_file(url: str, filename: str, pid) -> None:
-    """downloads a file from dbpedia"""
+def _is_outdated(filename: str, checksum: Optional[str]) -> bool:
+    """
+    checks if a downloaded file differs from the published one.
+    Dumps of different versions share the same file name, so this detects when another version is requested
+    """
+    sha_file = DATA_FOLDER / f"{filename}.sha256"
+
+    if checksum is None or not sha_file.exists():
+        return False
+
+    with open(sha_file, "r", encoding="utf-8") as f:
+        return f.read().strip() != checksum.lower()
+
+
+def _download_file(url: str, filename: str, pid, connections: int = DOWNLOAD_CONNECTIONS, checksum: Optional[str] = None, restart: bool = False) -> None:
+    """
+    downloads a file from dbpedia.
+    If the server supports range requests the file is split into segments that are downloaded in parallel.
+    The progress is kept next to the partial file, so that an interrupted download continues where it stopped.
+    """
+    part_file = DATA_FOLDER / f"{filename}.part"
+    state_file = DATA_FOLDER / f"{filename}.part.json"
+
+    with requests.head(url, allow_redirects=True, timeout=5) as res:
+        res.raise_for_status()
+        size = int(res.headers.get("Content-Length", 0))
+        ranges = res.headers.get("Accept-Ranges", "none") == "bytes"
+        # follow redirects only once for all segments
+        url = res.url
+
+    if size == 0 or not ranges or connections <= 1:
+        sha = _download_single(url, filename, part_file, size, pid)
+    else:
+        segments = None
+        if not restart:
+            segments = _load_segments(state_file, part_file, url, size)
+        if segments is None:
+            segments = _get_segments(size, connections)
+            with open(part_file, "wb") as file:
+                file.truncate(size)
+
+        sha = _download_segments(
+            url, filename, part_file, state_file, size, segments, pid)
+
+    if checksum is not None and sha != checksum.lower():
+        part_file.unlink(missing_ok=True)
+        state_file.unlink(missing_ok=True)
+        raise RuntimeError(
+            f"checksum mismatch for {filename}: expected {checksum}, got {sha}")
+
+    part_file.replace(DATA_FOLDER / filename)
+    state_file.unlink(missing_ok=True)
+
+    with open(DATA_FOLDER / f"{filename}.sha256", "w", encoding="utf-8") as out:
+        out.write(sha)
+
+
+def _download_single(url: str, filename: str, part_file: Path, size: int, pid) -> str:
+    """downloads a file over a single connection and returns its sha256 checksum"""
+    sha = hashlib.sha256()
+
     with requests.get(url, stream=True, timeout=5) as res:
         if res.status_code != 200:
             res.raise_for_status()
             raise RuntimeError(f"{url} returned {res.status_code} status")
 
-        size = int(res.headers.get("Content-Length", 0))
-
         res.raw.read = partial(res.raw.read, decode_content=True)
 
         desc = f"downloading {filename}"
-        with tqdm.wrapattr(res.raw, "read", total=size, desc=desc, position=pid) as raw_res:
-            with open(DATA_FOLDER / filename, "wb") as file:
-                shutil.copyfileobj(raw_res, file)
+        with tqdm(total=size, desc=desc, position=pid, unit="B", unit_scale=True) as pbar:
+            with open(part_file, "wb") as file:
+                for data in iter(lambda: res.raw.read(DOWNLOAD_CHUNK_SIZE), b""):
+                    file.write(data)
+                    sha.update(data)
+                    pbar.update(len(data))
+                    metrics.count("bytes_downloaded", len(data))
+
+    return sha.hexdigest()
+
+
+def _download_segments(url: str, filename: str, part_file: Path, state_file: Path, size: int, segments: list, pid) -> str:
+    """
+    downloads all unfinished segments of a file in parallel threads and returns the sha256 checksum of the file.
+    The checksum is computed while the download runs by following the part of the file that is already complete from the start.
+    """
+    cond = threading.Condition()
+    errors = []
+    last_save = [0.0]
+    done = sum(seg[2] for seg in segments)
+
+    desc = f"downloading {filename}"
+    pbar = tqdm(total=size, initial=done, desc=desc,
+                position=pid, unit="B", unit_scale=True)
+
+    def save_state(force=False):
+        # the state is only written periodically, a slightly outdated state just downloads a few bytes twice
+        if not force and time.monotonic() - last_save[0] < STATE_SAVE_INTERVAL:
+            return
+        last_save[0] = time.monotonic()
+        with open(state_file, "w", encoding="utf-8") as out:
+            json.dump({"url": url, "size": size, "segments": segments}, out)
+
+    def download_segment(seg):
+        try:
+            start, end, _ = seg
+            if start + seg[2] > end:
+                return
+            headers = {"Range": f"bytes={start + seg[2]}-{end}"}
+            with requests.get(url, headers=headers, stream=True, timeout=5) as res:
+                if res.status_code != 206:
+                    res.raise_for_status()
+                    raise RuntimeError(
+                        f"{url} returned {res.status_code} status for a range request")
+
+                with open(part_file, "r+b") as file:
+                    file.seek(start + seg[2])
+                    for data in res.iter_content(DOWNLOAD_CHUNK_SIZE):
+                        file.write(data)
+                        file.flush()
+                        with cond:
+                            seg[2] += len(data)
+                            save_state()
+                            cond.notify_all()
+                        pbar.update(len(data))
+
+            # a server can close the connection or answer with a shorter range without an error,
+            # the checksum would then wait forever for the rest of the segment
+            if start + seg[2] <= end:
+                raise ConnectionError(
+                    f"segment {start}-{end} of {url} ended after {seg[2]} of {end - start + 1} bytes")
+        except Exception as e:
+            with cond:
+                errors.append(e)
+                cond.notify_all()
+
+    def complete_prefix():
+        end = 0
+        for start, seg_end, seg_done in segments:
+            if start != end:
+                break
+            end = start + seg_done
+            if end <= seg_end:
+                break
+        return end
+
+    threads = [threading.Thread(target=download_segment, args=(seg,), daemon=True)
+               for seg in segments]
+    for thread in threads:
+        thread.start()
+
+    sha = hashlib.sha256()
+    hashed = 0
+
+    with open(part_file, "rb") as file:
+        while hashed < size:
+            with cond:
+                while complete_prefix() <= hashed and len(errors) == 0:
+                    cond.wait()
+                if len(errors) > 0:
+                    break
+                available = complete_prefix()
+
+            file.seek(hashed)
+            while hashed < available:
+                data = file.read(min(DOWNLOAD_CHUNK_SIZE, available - hashed))
+                sha.update(data)
+                hashed += len(data)
+
+    for thread in threads:
+        thread.join()
+    pbar.close()
+
+    # the segment threads are not part of the task, so their bytes are counted here once they are done
+    metrics.count("bytes_downloaded", sum(seg[2] for seg in segments) - done)
+
+    with cond:
+        save_state(force=True)
+
+    if len(errors) > 0:
+        raise errors[0]
+
+    return sha.hexdigest()
+
+
+def _get_segments(size: int, connections: int) -> list:
+    """splits a file into segments of [start, end, downloaded bytes] with inclusive byte ranges"""
+    num_segments = max(1, min(connections, size // MIN_SEGMENT_SIZE))
+    seg_size = size // num_segments
+
+    segments = []
+    for idx in range(num_segments):
+        start = idx * seg_size
+        end = size - 1 if idx == num_segments - 1 else start + seg_size - 1
+        segments.append([start, end, 0])
+
+    return segments
+
+
+def _load_segments(state_file: Path, part_file: Path, url: str, size: int) -> Optional[list]:
+    """loads the progress of an interrupted download if it belongs to the same remote file"""
+    if not state_file.exists() or not part_file.exists():
+        return None
+
+    try:
+        with open(state_file, "r", encoding="utf-8") as f:
+            state = json.load(f)
+    except ValueError:
+        return None
+
+    if state.get("url") != url or state.get("size") != size:
+        return None
+
+    return state["segments"]
+
+
+def _get_published_checksum(url: str) -> Optional[str]:
+    """
+    looks up the sha256 checksum of a file on the dbpedia databus. Returns None if it can not be retrieved.
+    Found checksums are kept in CHECKSUM_FILE, so the databus is only asked once per url
+    """
+    lock = FileLock(str(CHECKSUM_FILE) + ".lock")
+
+    with lock:
+        known = _load_checksums()
+    if url in known:
+        return known[url]
+
+    sha = _query_checksum(url)
+
+    if sha is not None:
+        with lock:
+            known = _load_checksums()
+            known[url] = sha
+            tmp_file = CHECKSUM_FILE.with_suffix(".json.tmp")
+            with open(tmp_file, "w", encoding="utf-8") as out:
+                json.dump(known, out, indent=2)
+            tmp_file.replace(CHECKSUM_FILE)
+
+    return sha
+
+
+def _load_checksums() -> dict:
+    if not CHECKSUM_FILE.exists():
+        return {}
+    with open(CHECKSUM_FILE, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _query_checksum(url: str) -> Optional[str]:
+    query = f"""
+    PREFIX databus: <https://dataid.dbpedia.org/databus#>
+    SELECT ?sha WHERE {{ ?dist databus:file <{url}> ; databus:sha256sum ?sha . }}
+    """
+    try:
+        with requests.get(DATABUS_SPARQL, params={"query": query}, headers={"Accept": "application/sparql-results+json"}, timeout=5) as res:
+            if res.status_code != 200:
+                return None
+            bindings = res.json()["results"]["bindings"]
+            if len(bindings) == 0:
+                return None
+            return bindings[0]["sha"]["value"].lower()
+    except (requests.RequestException, ValueError, KeyError):
+        return None
 
 
 def _extract_file(file: str, pid) -> str:
@@ -81,4 +357,4 @@ def _get_file_size(f):
     f.seek(0, io.SEEK_END)
     size = f.tell()
     f.seek(cur)
-    return size
\ No newline at end of file
+    return size
@@ -0,0 +1,144 @@
+import json
+import heapq
+import hashlib
+from collections import Counter
+from pathlib import Path
+from typing import Optional
+
+CATALOG_FILE = "_catalog.json"
+
+# number of smallest hashes kept to estimate distinct counts, counts up to this size are exact
+SKETCH_SIZE = 256
+
+HASH_RANGE = 2 ** 64
+
+# value types whose values can be equal to each other, types that are not listed here are compared as text
+TYPE_CLASSES = ["instance", "number", "date", "text"]
+
+NUMBER_TYPES = {"integer", "int", "long", "short", "byte", "decimal", "double", "float", "nonNegativeInteger",
+                "positiveInteger", "nonPositiveInteger", "negativeInteger", "unsignedInt", "unsignedLong"}
+
+DATE_TYPES = {"date", "dateTime", "gYear", "gYearMonth", "gMonthDay", "gMonth", "gDay", "time"}
+
+
+class PropertyStats:
+    """
+    statistics of a single property that can be collected on parts of a dump and merged afterwards.
+    Distinct subjects and values are counted with a sketch of the smallest hashes (k minimum values)
+    """
+
+    def __init__(self):
+        self.rows = 0
+        self.subjects = set()
+        self.values = set()
+        self.formats = Counter()
+
+    def add(self, subject: str, value: str, form: str) -> None:
+        self.rows += 1
+        self.subjects.add(_hash(subject))
+        self.values.add(_hash(value))
+        self.formats[form] += 1
+
+        if len(self.subjects) > 4 * SKETCH_SIZE:
+            self.subjects = set(heapq.nsmallest(SKETCH_SIZE, self.subjects))
+        if len(self.values) > 4 * SKETCH_SIZE:
+            self.values = set(heapq.nsmallest(SKETCH_SIZE, self.values))
+
+    def merge(self, other: "PropertyStats") -> None:
+        self.rows += other.rows
+        self.subjects = set(heapq.nsmallest(SKETCH_SIZE, self.subjects | other.subjects))
+        self.values = set(heapq.nsmallest(SKETCH_SIZE, self.values | other.values))
+        self.formats.update(other.formats)
+
+    def compact(self) -> "PropertyStats":
+        """drops all hashes that are not needed for the estimate, before the statistics are sent to another process"""
+        self.subjects = set(heapq.nsmallest(SKETCH_SIZE, self.subjects))
+        self.values = set(heapq.nsmallest(SKETCH_SIZE, self.values))
+        return self
+
+    def to_dict(self) -> dict:
+        return {"rows": self.rows, "subjects": _estimate(self.subjects), "values": _estimate(self.values),
+                "formats": dict(self.formats), "signature": get_signature(self.formats)}
+
+
+def write_catalog(out_path: Path, prop_stats: dict, num_triples: int, num_errors: int) -> dict:
+    """writes the statistics of all properties of an extraction together with the totals of the dump"""
+    all_subjects = set()
+    formats = Counter()
+    for stats in prop_stats.values():
+        all_subjects = set(heapq.nsmallest(SKETCH_SIZE, all_subjects | stats.subjects))
+        formats.update(stats.formats)
+
+    catalog = {
+        "totals": {
+            "triples": num_triples,
+            "errors": num_errors,
+            "rows": sum(stats.rows for stats in prop_stats.values()),
+            "properties": len(prop_stats),
+            "subjects": _estimate(all_subjects),
+            "formats": dict(formats)
+        },
+        "properties": {prop: stats.to_dict() for prop, stats in prop_stats.items()}
+    }
+
+    with open(out_path / CATALOG_FILE, "w", encoding="utf-8") as out:
+        json.dump(catalog, out)
+
+    return catalog
+
+
+def get_catalog(prop_dir: Path) -> Optional[dict]:
+    """returns the statistics catalog of an extraction folder, None for folders extracted without one"""
+    catalog_file = prop_dir / CATALOG_FILE
+
+    if not catalog_file.exists():
+        return None
+
+    with open(catalog_file, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def get_type_class(form: str) -> str:
+    """returns the class of a value type from extract_value"""
+    if form == "instance":
+        return "instance"
+    if form in NUMBER_TYPES:
+        return "number"
+    if form in DATE_TYPES:
+        return "date"
+    return "text"
+
+
+def get_signature(formats: dict) -> list:
+    """returns the type signature of a property, the sorted classes of all its value types"""
+    return sorted({get_type_class(form) for form in formats})
+
+
+def get_signature_mask(signature: list) -> int:
+    """encodes a type signature as a bitmask, two properties can only have equal values if their masks share a bit"""
+    mask = 0
+    for type_class in signature:
+        mask |= 1 << TYPE_CLASSES.index(type_class)
+    return mask
+
+
+def get_signatures(prop_dir: Path) -> dict:
+    """returns the type signature bitmask of every property of an extraction folder"""
+    prop_catalog = get_catalog(prop_dir)
+
+    if prop_catalog is None:
+        return {}
+
+    return {prop: get_signature_mask(stats.get("signature", get_signature(stats["formats"])))
+            for prop, stats in prop_catalog["properties"].items()}
+
+
+def _hash(text: str) -> int:
+    # the builtin hash differs between processes, so the sketches of different workers could not be merged
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def _estimate(sketch: set) -> int:
+    if len(sketch) < SKETCH_SIZE:
+        return len(sketch)
+    return round((SKETCH_SIZE - 1) * HASH_RANGE / max(heapq.nsmallest(SKETCH_SIZE, sketch)))
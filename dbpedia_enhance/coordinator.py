@@ -0,0 +1,327 @@
+import os
+import time
+import pickle
+import socket
+import argparse
+import threading
+import traceback
+from collections import deque
+from multiprocessing.managers import BaseManager
+from typing import Callable, Iterable, Optional, Tuple
+
+# seconds after which a task that was claimed by a worker without a sign of life is handed out again
+LEASE_TIMEOUT = 60.0
+
+# number of times a failing task is tried before the error is passed on
+MAX_ATTEMPTS = 3
+
+# seconds a worker waits for a new task before it asks again
+CLAIM_TIMEOUT = 5.0
+
+AUTHKEY_ENV = "DBPEDIA_ENHANCE_AUTHKEY"
+
+
+class TaskBoard:
+    """
+    keeps the tasks of a distributed run. Workers claim tasks and hold a lease on them, which they renew while the task runs.
+    Tasks of workers that fail or stop renewing their lease are handed out again until MAX_ATTEMPTS is reached
+    """
+
+    def __init__(self, lease_timeout: float = LEASE_TIMEOUT, max_attempts: int = MAX_ATTEMPTS):
+        self.lease_timeout = lease_timeout
+        self.max_attempts = max_attempts
+        self.cond = threading.Condition()
+        self.tasks = {}
+        self.pending = deque()
+        self.leases = {}
+        self.attempts = {}
+        self.results = {}
+        self.workers = {}
+        self.next_id = 0
+        self.closed = False
+
+    def submit(self, task: bytes) -> int:
+        """adds a pickled (function, arguments) tuple. Tasks stay pickled, so only the workers need to import their code"""
+        with self.cond:
+            task_id = self.next_id
+            self.next_id += 1
+            self.tasks[task_id] = task
+            self.attempts[task_id] = 0
+            self.pending.append(task_id)
+            self.cond.notify_all()
+            return task_id
+
+    def claim(self, worker: str, timeout: float = CLAIM_TIMEOUT) -> Optional[tuple]:
+        """returns the next (task id, pickled task) for a worker, None if there is none or "stop" after close"""
+        deadline = time.monotonic() + timeout
+
+        with self.cond:
+            self.workers.setdefault(worker, {"claimed": 0, "done": 0, "failed": 0})
+
+            while True:
+                self._expire_leases()
+                if self.closed:
+                    return "stop"
+                if len(self.pending) > 0:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self.cond.wait(min(remaining, self.lease_timeout))
+
+            task_id = self.pending.popleft()
+            self.attempts[task_id] += 1
+            self.leases[task_id] = (worker, time.monotonic() + self.lease_timeout)
+            self.workers[worker]["claimed"] += 1
+
+            return task_id, self.tasks[task_id]
+
+    def renew(self, worker: str, task_id: int) -> None:
+        with self.cond:
+            lease = self.leases.get(task_id)
+            if lease is not None and lease[0] == worker:
+                self.leases[task_id] = (worker, time.monotonic() + self.lease_timeout)
+
+    def complete(self, worker: str, task_id: int, result) -> None:
+        with self.cond:
+            # a task that was handed out again after its lease expired may finish twice, only the first result counts
+            if task_id in self.tasks:
+                self.results[task_id] = (True, result)
+                del self.tasks[task_id]
+                self.workers[worker]["done"] += 1
+            self.leases.pop(task_id, None)
+            self.cond.notify_all()
+
+    def fail(self, worker: str, task_id: int, error: str) -> None:
+        with self.cond:
+            self.workers[worker]["failed"] += 1
+            if self.leases.get(task_id, (None,))[0] == worker:
+                del self.leases[task_id]
+                self._retry(task_id, error)
+            self.cond.notify_all()
+
+    def wait_any(self, task_ids: list, timeout: Optional[float] = None) -> Optional[Tuple[int, bool, object]]:
+        """waits until one of the tasks is done and returns (task id, success, result or error)"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        with self.cond:
+            while True:
+                self._expire_leases()
+                for task_id in task_ids:
+                    if task_id in self.results:
+                        ok, result = self.results.pop(task_id)
+                        return task_id, ok, result
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self.cond.wait(self.lease_timeout if remaining is None else min(remaining, self.lease_timeout))
+
+    def close(self) -> None:
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def get_stats(self) -> dict:
+        with self.cond:
+            return {"pending": len(self.pending), "running": len(self.leases), "workers": dict(self.workers)}
+
+    def _expire_leases(self) -> None:
+        now = time.monotonic()
+        for task_id, (worker, deadline) in list(self.leases.items()):
+            if deadline < now:
+                del self.leases[task_id]
+                self._retry(task_id, f"lease of {worker} expired")
+
+    def _retry(self, task_id: int, error: str) -> None:
+        if task_id not in self.tasks:
+            return
+        if self.attempts[task_id] < self.max_attempts:
+            self.pending.append(task_id)
+        else:
+            self.results[task_id] = (False, error)
+            del self.tasks[task_id]
+        self.cond.notify_all()
+
+
+class CoordinatorManager(BaseManager):
+    """serves the task board of a run"""
+
+
+class WorkerManager(BaseManager):
+    """connects to the task board of a coordinator"""
+
+
+# the task board lives in the server process of the coordinator
+_board = None
+
+
+def _get_board() -> TaskBoard:
+    global _board
+    if _board is None:
+        _board = TaskBoard()
+    return _board
+
+
+CoordinatorManager.register("board", callable=_get_board)
+WorkerManager.register("board")
+
+
+class DistributedPool:
+    """pool interface of the executor that runs the tasks on all workers connected to a coordinator"""
+
+    def __init__(self, address: Tuple[str, int], authkey: bytes, local_workers: int, context):
+        self.manager = start_coordinator(address, authkey, context)
+        self.board = self.manager.board()
+        self.processes = []
+
+        host, port = self.manager.address
+        print(f"### coordinator listening on {host}:{port}")
+
+        # local workers simulate additional nodes on this host
+        for idx in range(local_workers):
+            proc = context.Process(target=run_worker, args=(
+                self.manager.address, authkey, f"{socket.gethostname()}-local-{idx}"), daemon=True)
+            proc.start()
+            self.processes.append(proc)
+
+    def imap_unordered(self, func: Callable, tasks: Iterable, chunksize: int = 1):
+        ids = {self.board.submit(pickle.dumps((func, (task,)))): None for task in tasks}
+        while len(ids) > 0:
+            res = self.board.wait_any(list(ids.keys()))
+            if res is None:
+                continue
+            del ids[res[0]]
+            yield _get_result(res)
+
+    def apply_async(self, func: Callable, args: tuple):
+        return _DistributedResult(self.board, self.board.submit(pickle.dumps((func, args))))
+
+    def close(self) -> None:
+        self.board.close()
+
+    def join(self) -> None:
+        for proc in self.processes:
+            proc.join(timeout=2 * CLAIM_TIMEOUT)
+        self.manager.shutdown()
+
+
+class _DistributedResult:
+    def __init__(self, board, task_id: int):
+        self.board = board
+        self.task_id = task_id
+        self.res = None
+
+    def ready(self) -> bool:
+        # the board hands out a result only once, so it is kept for get
+        if self.res is None:
+            self.res = self.board.wait_any([self.task_id], 0)
+        return self.res is not None
+
+    def get(self, timeout=None):
+        res = self.res if self.res is not None else self.board.wait_any([self.task_id], timeout)
+        if res is None:
+            raise TimeoutError(f"task {self.task_id} did not finish in time")
+        return _get_result(res)
+
+
+def _get_result(res: tuple):
+    _, ok, result = res
+    if not ok:
+        raise RuntimeError(f"task failed on all attempts: {result}")
+    return pickle.loads(result)
+
+
+def start_coordinator(address: Tuple[str, int], authkey: bytes, context) -> CoordinatorManager:
+    """starts the coordinator with its task board in a server process that workers on other hosts can connect to"""
+    manager = CoordinatorManager(address=address, authkey=authkey, ctx=context)
+    manager.start()
+    return manager
+
+
+def connect(address: Tuple[str, int], authkey: bytes):
+    """connects to a coordinator and returns its task board"""
+    manager = WorkerManager(address=address, authkey=authkey)
+    manager.connect()
+    return manager.board()
+
+
+def run_worker(address: Tuple[str, int], authkey: bytes, name: Optional[str] = None) -> None:
+    """claims and runs tasks of a coordinator until it is closed"""
+    name = name or f"{socket.gethostname()}-{os.getpid()}"
+    board = connect(address, authkey)
+
+    while True:
+        task = board.claim(name)
+        if task is None:
+            continue
+        if task == "stop":
+            return
+
+        task_id, task = task
+        running = threading.Event()
+        running.set()
+
+        def renew():
+            while running.is_set():
+                time.sleep(LEASE_TIMEOUT / 3)
+                if running.is_set():
+                    board.renew(name, task_id)
+
+        renew_thread = threading.Thread(target=renew, daemon=True)
+        renew_thread.start()
+
+        try:
+            func, args = pickle.loads(task)
+            result = pickle.dumps(func(*args))
+        except Exception:
+            running.clear()
+            board.fail(name, task_id, f"{name}: {traceback.format_exc()}")
+            continue
+
+        running.clear()
+        board.complete(name, task_id, result)
+
+
+def run_node(address: Tuple[str, int], authkey: bytes, workers: int, context) -> None:
+    """runs a number of workers on this host, which all take tasks from the same coordinator"""
+    host = socket.gethostname()
+    processes = [context.Process(target=run_worker, args=(address, authkey, f"{host}-{idx}"))
+                 for idx in range(workers)]
+    for proc in processes:
+        proc.start()
+    for proc in processes:
+        proc.join()
+
+
+def parse_address(address: str) -> Tuple[str, int]:
+    host, _, port = address.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+def get_authkey(local: bool = False) -> bytes:
+    """
+    returns the shared secret of the coordinator and its workers from the environment.
+    A coordinator that only accepts local workers uses a random secret if none is set
+    """
+    authkey = os.environ.get(AUTHKEY_ENV)
+    if authkey is not None:
+        return authkey.encode("utf-8")
+    if local:
+        return os.urandom(32)
+    raise ValueError(f"the coordinator and its workers need a shared secret, set {AUTHKEY_ENV}")
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(prog="DBpedia Property Enhancer Worker",
+                                     description="Runs workers on this host that take tasks from a coordinator started with --backend distributed.")
+    parser.add_argument("--connect", type=str, required=True,
+                        help="host:port of the coordinator")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="Number of worker processes on this host")
+
+    options = parser.parse_args()
+
+    from .executor import MP_CONTEXT
+
+    run_node(parse_address(options.connect), get_authkey(), options.workers, MP_CONTEXT)
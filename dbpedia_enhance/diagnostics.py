@@ -0,0 +1,209 @@
+import json
+import time
+import itertools
+import threading
+from collections import Counter
+from pathlib import Path
+from typing import Optional
+
+# seconds between two batches of errors and progress a worker sends to the parent while a task runs
+FLUSH_INTERVAL = 0.5
+
+# number of distinct lines kept as samples of every error class
+MAX_SAMPLES = 5
+
+# seconds the parent waits for batches that were sent before the result of their task
+DRAIN_TIMEOUT = 10
+
+ERRORS_FILE = "_errors.json"
+
+_queue = None
+_local = threading.local()
+
+_channels = {}
+_channels_lock = threading.Lock()
+_channel_ids = itertools.count(1)
+_listener = None
+
+
+class ErrorReport:
+    """number of lines that could not be parsed per error class, together with a few sample lines of every class"""
+
+    def __init__(self):
+        self.counts = Counter()
+        self.samples = {}
+
+    def __len__(self) -> int:
+        return sum(self.counts.values())
+
+    def merge(self, errors: dict) -> None:
+        """adds the {error class: (count, samples)} of a batch"""
+        for error_class, (count, samples) in errors.items():
+            self.counts[error_class] += count
+            kept = self.samples.setdefault(error_class, [])
+            # a line that is repeated many times would otherwise take all samples of its class
+            for sample in samples:
+                if len(kept) >= MAX_SAMPLES:
+                    break
+                if sample not in kept:
+                    kept.append(sample)
+
+    def to_dict(self) -> dict:
+        return {"errors": len(self), "classes": {error_class: {"count": count, "samples": self.samples.get(error_class, [])}
+                                                 for error_class, count in self.counts.most_common()}}
+
+    def write(self, out_file: Path) -> None:
+        with open(out_file, "w", encoding="utf-8") as out:
+            json.dump(self.to_dict(), out, indent=2, ensure_ascii=False)
+
+    def summary(self) -> str:
+        return ", ".join(f"{error_class}={count}" for error_class, count in self.counts.most_common())
+
+
+def error(error_class: str, line: str) -> None:
+    """records a line that could not be parsed in the task that is currently running in this thread"""
+    buffer = getattr(_local, "buffer", None)
+    if buffer is None:
+        return
+
+    entry = buffer["errors"].setdefault(error_class, [0, []])
+    entry[0] += 1
+    if len(entry[1]) < MAX_SAMPLES and line not in entry[1]:
+        entry[1].append(line)
+
+    _maybe_flush(buffer)
+
+
+def progress(amount: int) -> None:
+    """adds to the progress of the task that is currently running in this thread, in the unit of its weight"""
+    buffer = getattr(_local, "buffer", None)
+    if buffer is None:
+        return
+
+    buffer["progress"] += amount
+    _maybe_flush(buffer)
+
+
+def start_task(channel: Optional[int], idx: int) -> None:
+    """starts collecting the errors and progress of a task in this thread"""
+    _local.task = (channel, idx)
+    _local.sent = 0
+    _local.buffer = _new_buffer()
+
+
+def finish_task() -> dict:
+    """stops collecting and returns the batch that was not sent yet, together with the number of batches that were sent"""
+    batch = getattr(_local, "buffer", None) or _new_buffer()
+    batch["sent"] = getattr(_local, "sent", 0)
+    _local.buffer = None
+
+    return batch
+
+
+def init_worker(worker_queue) -> None:
+    """sets the queue the batches of a worker process are sent to"""
+    global _queue
+    _queue = worker_queue
+
+
+def get_queue(context):
+    """
+    returns the queue that the workers send their batches to and starts the thread that reads it in the parent.
+    The queue is created with the given multiprocessing context, so that it can be passed to worker processes
+    """
+    global _queue, _listener
+
+    with _channels_lock:
+        if _listener is None:
+            _queue = context.Queue()
+            _listener = threading.Thread(target=_listen, args=(_queue,), daemon=True)
+            _listener.start()
+
+    return _queue
+
+
+class Channel:
+    """
+    receives the batches of the tasks of one call of the executor. Progress is added to a progress bar, but never more
+    than the weight of a task, errors are collected in an error report
+    """
+
+    def __init__(self, pbar, weights: list, errors: Optional[ErrorReport] = None):
+        self.id = next(_channel_ids)
+        self.pbar = pbar
+        self.weights = weights
+        self.errors = errors
+        self.reported = Counter()
+        self.received = Counter()
+        self.expected = {}
+        self.cond = threading.Condition()
+
+    def __enter__(self) -> "Channel":
+        with _channels_lock:
+            _channels[self.id] = self
+        return self
+
+    def __exit__(self, *exc) -> None:
+        # batches that were sent before the last results can still be in the queue
+        with self.cond:
+            self.cond.wait_for(lambda: all(self.received[idx] >= sent for idx, sent in self.expected.items()),
+                               DRAIN_TIMEOUT if exc[0] is None else 0)
+        with _channels_lock:
+            _channels.pop(self.id, None)
+
+    def receive(self, idx: int, batch: dict) -> None:
+        """adds a batch that a task sent while it was running"""
+        with self.cond:
+            self.received[idx] += 1
+            self._add(idx, batch)
+            self.cond.notify_all()
+
+    def finish(self, idx: int, batch: dict) -> None:
+        """adds the last batch of a finished task and completes its progress"""
+        with self.cond:
+            self.expected[idx] = batch["sent"]
+            self._add(idx, batch)
+            self.pbar.update(self.weights[idx] - self.reported[idx])
+            self.reported[idx] = self.weights[idx]
+            self.cond.notify_all()
+
+    def _add(self, idx: int, batch: dict) -> None:
+        if self.errors is not None:
+            self.errors.merge(batch["errors"])
+
+        amount = min(batch["progress"], self.weights[idx] - self.reported[idx])
+        if amount > 0:
+            self.reported[idx] += amount
+            self.pbar.update(amount)
+
+
+def _new_buffer() -> dict:
+    return {"progress": 0, "errors": {}, "flushed": time.monotonic()}
+
+
+def _maybe_flush(buffer: dict) -> None:
+    now = time.monotonic()
+    if _queue is None or now - buffer["flushed"] < FLUSH_INTERVAL:
+        return
+
+    channel, idx = _local.task
+    if channel is not None:
+        _queue.put((channel, idx, {"progress": buffer["progress"], "errors": buffer["errors"]}))
+        _local.sent += 1
+
+    buffer["progress"] = 0
+    buffer["errors"] = {}
+    buffer["flushed"] = now
+
+
+def _listen(listen_queue) -> None:
+    while True:
+        try:
+            channel_id, idx, batch = listen_queue.get()
+        except (EOFError, OSError):
+            # the queue is closed when the interpreter exits
+            return
+        with _channels_lock:
+            channel = _channels.get(channel_id)
+        if channel is not None:
+            channel.receive(idx, batch)
@@ -1,15 +1,14 @@
-import multiprocessing as mp
 import os
 import csv
-from tqdm import tqdm
-from filelock import FileLock
 from pathlib import Path
 from data.utils import DATA_FOLDER
-from .utils import extract_prop_name, extract_subj_name, extract_value, get_lang_code, get_category_members
+from . import metrics, executor, diagnostics
+from .subject_index import get_extraction_chunks
+from .utils import extract_prop_name, extract_value, get_lang_code, get_category_members, iter_subject_blocks, get_block_lines, PROGRESS_STEP
 from typing import Optional
 
 
-def extract_subjects(file: str, suffix: Optional[str] = None, use_category: Optional[str] = None, force: Optional[bool] = False):
+def extract_subjects(file: str, suffix: Optional[str] = None, use_category: Optional[str] = None, force: Optional[bool] = False, version: Optional[str] = None, cat_depth: int = 0):
     """
     extract all subjects from a language file and stores the results in individual lists.
     Additionally a single csv file containing all distinct subject names is created
@@ -20,7 +19,8 @@ def extract_subjects(file: str, suffix: Optional[str] = None, use_category: Opti
     filtr = None
 
     if use_category is not None:
-        filtr = get_category_members(use_category, lang_code)
+        filtr = get_category_members(
+            use_category, lang_code, version, cat_depth, force)
 
     if suffix is not None:
         lang_code = lang_code + "_" + suffix
@@ -41,23 +41,34 @@ def extract_subjects(file: str, suffix: Optional[str] = None, use_category: Opti
 
         return all_subjects
 
-    chunk_args = _get_chunks(DATA_FOLDER / file, out_path)
+    # category members are read from the subject index instead of scanning the whole dump
+    chunks = get_extraction_chunks(file, filtr)
 
     pool_args = []
-    for idx, arg in enumerate(chunk_args):
-        new_arg = (*arg, filtr, idx+1)
-        pool_args.append(new_arg)
-
-    tqdm.set_lock(mp.RLock())
-    with mp.Pool(processes=mp.cpu_count(), initializer=tqdm.set_lock, initargs=(tqdm.get_lock(),)) as pool:
-        all_sub_list = pool.starmap(_extract_subjects, pool_args)
-
-    for file in out_path.iterdir():
-        if file.is_file() and file.suffix == ".lock":
-            file.unlink(missing_ok=True)
-
-    for subjects in all_sub_list:
-        all_subjects.update(subjects)
+    for chunk_start, chunk_end in chunks:
+        pool_args.append((DATA_FOLDER / file, chunk_start, chunk_end, filtr))
+
+    errors = diagnostics.ErrorReport()
+    written = set()
+
+    # the workers return the rows of every subject and only the parent writes them, so no file has to be locked
+    for _, subject_rows in executor.imap_progress(_extract_subjects, pool_args, f"extracting subjects of {lang_code}",
+                                                  [end - start for start, end in chunks], "B", errors):
+        for subject, rows in subject_rows.items():
+            new_file = subject not in written
+            # files of an earlier extraction are replaced instead of extended
+            with open(out_path / f"{subject}.csv", "w" if new_file else "a", encoding="utf-8", newline="") as out:
+                out_writer = csv.writer(out)
+                if new_file:
+                    out_writer.writerow(["property", "value", "format"])
+                out_writer.writerows(rows)
+            written.add(subject)
+
+    if len(errors) > 0:
+        errors.write(out_path / diagnostics.ERRORS_FILE)
+        print(f"### {len(errors)} lines of {lang_code} could not be parsed: {errors.summary()}")
+
+    all_subjects.update(written)
 
     with open(subj_file, "w", encoding="utf-8", newline="") as out:
         out_writer = csv.writer(out)
@@ -67,105 +78,36 @@ def extract_subjects(file: str, suffix: Optional[str] = None, use_category: Opti
     return all_subjects
 
 
-def _extract_subjects(file: Path, chunk_start: int, chunk_end: int, size: int, out_folder: Path, filtr: Optional[list], pid: int) -> set:
-    """extracts the subjects from an rdf file and saves them into individual files. Returns a set with all individual subject names"""
-    all_subj = set()
-
-    desc = f"#{pid}"
-
-    with tqdm(total=size, desc=desc, position=pid) as pbar:
-        with open(file, "r", encoding="utf-8") as f:
-            f.seek(chunk_start)
-
-            for line in f:
-                chunk_start += len(line)
-                if chunk_start > chunk_end:
-                    break
-
-                try:
-                    content = line.split("> ", 2)
-                    subject = extract_subj_name(content[0])
-                    prop = extract_prop_name(content[1])
-                    value, form = extract_value(content[2])
-
-                    if filtr is None or subject in filtr:
-                        out_file = out_folder / f"{subject}.csv"
-                        lock_file = out_folder / f"{subject}.csv.lock"
-
-                        lock = FileLock(str(lock_file))
-
-                        with lock:
-                            if not out_file.exists():
-                                with open(out_file, "a", encoding="utf-8", newline="") as out:
-                                    out_writer = csv.writer(out)
-                                    out_writer.writerow(
-                                        ["property", "value", "format"])
-                                    out_writer.writerow([prop, value, form])
-                            else:
-                                with open(out_file, "a", encoding="utf-8", newline="") as out:
-                                    out_writer = csv.writer(out)
-                                    out_writer.writerow([prop, value, form])
-
-                        all_subj.add(prop)
-                except Exception as e:
-                    err_file = out_folder / "_err.log"
-                    lock_file = out_folder / "_err.log.lock"
-                    lock = FileLock(str(lock_file))
-
-                    with lock:
-                        with open(err_file, "a", encoding="utf-8") as err_f:
-                            err_f.write(line + " || Error: " + str(e) + "\n")
-                pbar.update(len(line.encode("utf-8")))
-
-    return all_subj
-
-
-def _get_chunks(file: Path, out: Path) -> list:
-    """split a file into smaller chunks for multiprocessing"""
-    # multiprocessing code adapted from https://nurdabolatov.com/parallel-processing-large-file-in-python
-
-    cpus = mp.cpu_count()
-    fsize = os.path.getsize(file)
-    chunk_size = fsize // cpus
-
-    chunk_args = []
-
-    with open(file, "r", encoding="utf-8") as f:
-
-        def is_start_of_line(pos):
-            if pos == 0:
-                return True
+@metrics.worker("extract_subject_rows")
+def _extract_subjects(file: Path, chunk_start: int, chunk_end: int, filtr: Optional[set]) -> dict:
+    """
+    extracts the triples of every subject from a chunk of an rdf file. Returns the (property, value, format) rows of
+    every subject, lines that can not be parsed are reported to diagnostics
+    """
+    subject_rows = {}
+    progress = 0
 
-            f.seek(pos - 1)
+    # the subject is parsed and filtered once for all triples of a block
+    for subject, block in iter_subject_blocks(file, chunk_start, chunk_end, filtr):
+        for line in get_block_lines(block):
             try:
-                return f.read(1) == "\n"
-            except UnicodeDecodeError:
-                return False
-
-        def get_next_line_position(pos):
-            f.seek(pos)
-            f.readline()
-            return f.tell()
-
-        chunk_start = 0
-
-        while chunk_start < fsize:
-            chunk_end = min(fsize, chunk_start + chunk_size)
-
-            while not is_start_of_line(chunk_end):
-                chunk_end -= 1
-
-            if chunk_start == chunk_end:
-                chunk_end = get_next_line_position(chunk_end)
+                content = line.split("> ", 2)
+                prop = extract_prop_name(content[1])
+                value, form = extract_value(content[2])
+            except Exception as e:
+                diagnostics.error(type(e).__name__, line + " || Error: " + str(e))
+                continue
 
-            size = chunk_end - chunk_start
+            subject_rows.setdefault(subject, []).append((prop, value, form))
 
-            args = (file, chunk_start, chunk_end, size, out)
-            chunk_args.append(args)
+        progress += len(block)
+        if progress >= PROGRESS_STEP:
+            diagnostics.progress(progress)
+            progress = 0
 
-            chunk_start = chunk_end
+    metrics.count("bytes_read", chunk_end - chunk_start)
 
-    return chunk_args
+    return subject_rows
 
 
 def _check_dir_exists(path):
@@ -1,17 +1,20 @@
-import multiprocessing as mp
-import os
-import csv
-from tqdm import tqdm
 from pathlib import Path
 from data.utils import DATA_FOLDER
-from .utils import extract_subj_name, get_lang_code, get_category_members
+from data import cache
+from . import metrics, executor
+from .subject_index import get_extraction_chunks
+from .utils import get_lang_code, get_category_members, iter_subject_blocks, PARSER_VERSION
+from .string_array import StringArray, write_string_array
 from typing import Optional
 
+SUBJECTS_FILE = "subjects.bin"
 
-def extract_subjects(file: str, suffix: Optional[str] = None, use_category: Optional[str] = None, force: Optional[bool] = False):
+
+def extract_subjects(file: str, use_category: Optional[str] = None, force: Optional[bool] = False, version: Optional[str] = None, cat_depth: int = 0) -> StringArray:
     """
-    extract all subjects from a language file and stores the results in individual lists.
-    Additionally a single csv file containing all distinct subject names is created
+    extract all subjects from a language file and stores them as a sorted string array.
+    Returns the distinct subject names as a memory mapped string array.
+    The results are cached by the dump, category members and parser version, so they are only computed once.
     """
 
     lang_code = get_lang_code(file)
@@ -19,122 +22,56 @@ def extract_subjects(file: str, suffix: Optional[str] = None, use_category: Opti
     filtr = None
 
     if use_category is not None:
-        filtr = get_category_members(use_category, lang_code)
-
-    if suffix is not None:
-        lang_code = lang_code + "_" + suffix
+        filtr = get_category_members(
+            use_category, lang_code, version, cat_depth, force)
 
-    subj_file = DATA_FOLDER / f"{lang_code}_subjects.csv"
+    key = cache.get_extraction_key(
+        "subjects", file, lang_code, filtr, PARSER_VERSION)
 
     all_subjects = set()
 
-    if subj_file.exists() and not force:
-        with open(subj_file, "r", newline="", encoding="utf-8") as csvfile:
-            csvreader = csv.reader(csvfile)
-            for row in csvreader:
-                all_subjects.update(row)
+    out_path = cache.get_artifact(key) if not force else None
 
-        return all_subjects
+    if out_path is not None:
+        return StringArray(out_path / SUBJECTS_FILE)
 
-    chunk_args = _get_chunks(DATA_FOLDER / file)
+    out_path = cache.new_artifact("subjects", key)
 
-    pool_args = []
-    for idx, arg in enumerate(chunk_args):
-        new_arg = (*arg, filtr, idx+1)
-        pool_args.append(new_arg)
+    # category members are read from the subject index instead of scanning the whole dump
+    chunks = get_extraction_chunks(file, filtr)
 
-    with mp.Pool(processes=mp.cpu_count(), initializer=tqdm.set_lock, initargs=(mp.RLock(),)) as pool:
-        all_sub_list = pool.starmap(_extract_subjects, pool_args)
+    pool_args = []
+    for chunk_start, chunk_end in chunks:
+        pool_args.append((DATA_FOLDER / file, chunk_start, chunk_end, filtr))
 
+    all_sub_list = executor.run(_extract_subjects, pool_args, f"extracting subjects of {lang_code}",
+                                [end - start for start, end in chunks], "B")
 
     for subjects in all_sub_list:
         all_subjects.update(subjects)
 
-    with open(subj_file, "w", encoding="utf-8", newline="") as out:
-        out_writer = csv.writer(out)
-        for sub in all_subjects:
-            out_writer.writerow([sub])
+    write_string_array(out_path / SUBJECTS_FILE, all_subjects)
 
-    return all_subjects
+    out_path = cache.commit_artifact("subjects", key, {
+        "lang": lang_code, "category": use_category, "version": version, "cat_depth": cat_depth})
+
+    return StringArray(out_path / SUBJECTS_FILE)
 
-def _extract_subjects(file: Path, chunk_start: int, chunk_end: int, size: int, filtr: Optional[list], pid: int) -> set:
+@metrics.worker("extract_subjects")
+def _extract_subjects(file: Path, chunk_start: int, chunk_end: int, filtr: Optional[set]) -> set:
     """
     extracts the subjects from an rdf file and saves them into individual files. Returns a set with all individual subject names.
-    When a filter is present we still try to extract subjects through the file to make sure that they are present in the exported data.
+    Blocks of subjects that are not in the filter are skipped.
     """
     all_subjects = set()
+    num_triples = 0
 
-    desc = f"#{pid}"
-
-    with tqdm(total=size, desc=desc, position=pid) as pbar:
-        with open(file, "r", encoding="utf-8") as f:
-            f.seek(chunk_start)
-
-            for line in f:
-                chunk_start += len(line)
-                if chunk_start > chunk_end:
-                    break
+    # only the subject of every block is parsed, the lines themselves are not decoded
+    for subject, block in iter_subject_blocks(file, chunk_start, chunk_end, filtr):
+        num_triples += block.count(b"\n")
+        all_subjects.add(subject)
 
-                content = line.split("> ", 2)
-                subject = extract_subj_name(content[0])
-
-                if filtr is None or subject in filtr:
-
-                    all_subjects.add(subject)
-
-                pbar.update(len(line.encode("utf-8")))
+    metrics.count("bytes_read", chunk_end - chunk_start)
+    metrics.count("triples", num_triples)
 
     return all_subjects
-
-
-def _get_chunks(file: Path) -> list:
-    """split a file into smaller chunks for multiprocessing"""
-    # multiprocessing code adapted from https://nurdabolatov.com/parallel-processing-large-file-in-python
-
-    cpus = mp.cpu_count()
-    fsize = os.path.getsize(file)
-    chunk_size = fsize // cpus
-
-    chunk_args = []
-
-    with open(file, "r", encoding="utf-8") as f:
-
-        def is_start_of_line(pos):
-            if pos == 0:
-                return True
-
-            f.seek(pos - 1)
-            try:
-                return f.read(1) == "\n"
-            except UnicodeDecodeError:
-                return False
-
-        def get_next_line_position(pos):
-            f.seek(pos)
-            f.readline()
-            return f.tell()
-
-        chunk_start = 0
-
-        while chunk_start < fsize:
-            chunk_end = min(fsize, chunk_start + chunk_size)
-
-            while not is_start_of_line(chunk_end):
-                chunk_end -= 1
-
-            if chunk_start == chunk_end:
-                chunk_end = get_next_line_position(chunk_end)
-
-            size = chunk_end - chunk_start
-
-            args = (file, chunk_start, chunk_end, size)
-            chunk_args.append(args)
-
-            chunk_start = chunk_end
-
-    return chunk_args
-
-
-def _check_dir_exists(path):
-    if not os.path.exists(path):
-        os.makedirs(path)
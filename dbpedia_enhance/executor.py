@@ -0,0 +1,168 @@
+import os
+import atexit
+import threading
+import multiprocessing as mp
+from multiprocessing.pool import ThreadPool
+from typing import Callable, Iterable, Optional, Tuple
+from tqdm import tqdm
+from . import metrics, diagnostics, coordinator
+
+# pools are started from a clean server process instead of being forked, so that they can be created safely
+# while other pipeline stages are running in threads of the same process
+MP_CONTEXT = mp.get_context("spawn" if os.name == "nt" else "forkserver")
+
+BACKENDS = ["process", "thread", "serial", "distributed"]
+
+# work is split into this many tasks per worker, so that workers that finish early can take over the remaining tasks
+TASKS_PER_WORKER = 4
+
+_workers = mp.cpu_count()
+_backend = "process"
+_coordinator = None
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def configure(workers: Optional[int] = None, backend: str = "process", address: Optional[Tuple[str, int]] = None, local_workers: Optional[int] = None) -> None:
+    """
+    sets the number of workers and the backend used by all stages. Has to be called before the first task is run.
+    The distributed backend hands out the tasks from a coordinator listening on the given (host, port) address to workers
+    on any host, local_workers of them are started on this host. The number of workers is then the expected number
+    of workers on all hosts
+    """
+    global _workers, _backend, _coordinator
+
+    if backend not in BACKENDS:
+        raise ValueError(f"unknown backend {backend}, use one of {BACKENDS}")
+
+    shutdown()
+
+    _workers = workers or mp.cpu_count()
+    _backend = backend
+    _coordinator = (address or ("127.0.0.1", 0), local_workers)
+
+
+def get_workers() -> int:
+    return _workers if _backend != "serial" else 1
+
+
+def get_num_tasks() -> int:
+    """returns the number of tasks a stage should split its work into"""
+    return get_workers() * TASKS_PER_WORKER
+
+
+def run(func: Callable, args_list: list, desc: Optional[str] = None, weights: Optional[list] = None, unit: str = "it", errors: Optional[diagnostics.ErrorReport] = None) -> list:
+    """
+    runs func for every tuple of arguments and returns the results in the same order.
+    Workers take the next task as soon as they are done with their last one. The progress of all tasks is shown
+    in a single bar, where every task counts with its weight (e.g. the number of bytes it processes).
+    Tasks can report their progress in the unit of the weight and lines that could not be parsed with diagnostics,
+    these are collected in errors.
+    """
+    results = [None] * len(args_list)
+
+    for idx, result in imap_progress(func, args_list, desc, weights, unit, errors):
+        results[idx] = result
+
+    return results
+
+
+def imap_progress(func: Callable, args_list: list, desc: Optional[str] = None, weights: Optional[list] = None, unit: str = "it", errors: Optional[diagnostics.ErrorReport] = None) -> Iterable:
+    """like run, but yields (index, result) pairs as soon as the tasks finish, so that the results can be processed one by one"""
+    weights = weights or [1] * len(args_list)
+
+    # the workers send their progress and errors in batches, which are shown in one bar
+    diagnostics.get_queue(MP_CONTEXT)
+
+    with tqdm(total=sum(weights), desc=desc, unit=unit, unit_scale=unit == "B") as pbar:
+        with diagnostics.Channel(pbar, weights, errors) as channel:
+            for idx, result, batch in _imap_tasks(func, args_list, channel.id):
+                channel.finish(idx, batch)
+                yield idx, result
+
+
+def imap_unordered(func: Callable, args_list: Iterable) -> Iterable:
+    """runs func for every tuple of arguments and yields (index, result) pairs as soon as the tasks finish"""
+    for idx, result, _ in _imap_tasks(func, args_list, None):
+        yield idx, result
+
+
+def _imap_tasks(func: Callable, args_list: Iterable, channel: Optional[int]) -> Iterable:
+    tasks = ((func, idx, args, channel) for idx, args in enumerate(args_list))
+
+    if _backend == "serial":
+        for task in tasks:
+            yield _run_task(task)
+        return
+
+    yield from _get_pool().imap_unordered(_run_task, tasks, chunksize=1)
+
+
+def apply_async(func: Callable, args: tuple):
+    """schedules a single task and returns an object whose get method waits for the result and whose ready method tells if it is done"""
+    if _backend == "serial":
+        return _Done(func(*args))
+
+    return _get_pool().apply_async(func, args)
+
+
+def shutdown() -> None:
+    """stops the workers of the shared pool"""
+    global _pool
+
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool.join()
+            _pool = None
+
+
+def _get_pool():
+    """returns the pool that is shared by all stages, it is started on first use and reused afterwards"""
+    global _pool
+
+    with _pool_lock:
+        if _pool is None:
+            if _backend == "process":
+                _pool = MP_CONTEXT.Pool(processes=_workers, initializer=_init_worker,
+                                        initargs=(metrics.worker_args(MP_CONTEXT.RLock()), diagnostics.get_queue(MP_CONTEXT)))
+            elif _backend == "distributed":
+                address, local_workers = _coordinator
+                _pool = coordinator.DistributedPool(address, coordinator.get_authkey(local=address[0] == "127.0.0.1"),
+                                                    _workers if local_workers is None else local_workers, MP_CONTEXT)
+            else:
+                _pool = ThreadPool(processes=_workers)
+
+    return _pool
+
+
+def _init_worker(metrics_args: tuple, diagnostics_queue) -> None:
+    metrics.init_worker(*metrics_args)
+    diagnostics.init_worker(diagnostics_queue)
+
+
+def _run_task(task: tuple) -> tuple:
+    func, idx, args, channel = task
+
+    # the batch that was not sent yet is returned with the result, so that it arrives even without a queue to the parent
+    diagnostics.start_task(channel, idx)
+    try:
+        result = func(*args)
+    finally:
+        batch = diagnostics.finish_task()
+
+    return idx, result, batch
+
+
+class _Done:
+    def __init__(self, result):
+        self.result = result
+
+    def ready(self) -> bool:
+        return True
+
+    def get(self, timeout=None):
+        return self.result
+
+
+atexit.register(shutdown)
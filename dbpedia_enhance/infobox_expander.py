@@ -0,0 +1,249 @@
+import csv
+import gzip
+import heapq
+import tempfile
+from collections import OrderedDict
+from pathlib import Path
+from typing import Iterator, Optional
+from data.utils import DATA_FOLDER
+from data import cache
+from . import metrics, executor, sort_merge, diagnostics
+from .translate_entity import translate_entity
+from .property_extractor import get_property_sizes
+from .utils import create_rdf_subj, create_rdf_prop, create_rdf_value
+
+EXPANDER_VERSION = "1"
+
+# memory in bytes all workers together may use to sort the entities of the property pair they expand
+DEFAULT_MEMORY = 512 * 1024 ** 2
+
+# number of source entities that are translated with one request
+TRANSLATION_BATCH_SIZE = 40
+
+# number of translated names every worker keeps, entities often have several properties that are expanded
+TRANSLATION_CACHE_SIZE = 100_000
+
+# number of triples that are compressed at once
+WRITE_BATCH_SIZE = 10_000
+
+# fast compression, the shards are written at the speed of the join instead of the speed of gzip
+COMPRESS_LEVEL = 1
+
+REPORT_FILE = "expansion.csv"
+
+REPORT_HEADER = ["source", "target", "candidates", "present", "untranslated", "triples", "shard"]
+
+# rows of the target property sort before the translated source rows of the same subject
+EXISTING = "0"
+CANDIDATE = "1"
+
+_translations = OrderedDict()
+
+
+def expand_infoboxes(matches: list, src_lang: str, trg_lang: str, src_dir: Path, trg_dir: Path, suffix: Optional[str] = None, max_memory: Optional[int] = None, force: Optional[bool] = False) -> Path:
+    """
+    generates the triples that are missing in the infoboxes of the target language from the property matches.
+    Every entity of a source property whose subject has an article in the target language but lacks the matched target
+    property becomes a triple of the target property. The property pairs are joined in parallel, every task writes its
+    triples to its own compressed N-Triples shard. The results are cached by both extractions and the matches.
+    Returns the folder with the shards and the report of the number of triples of every property pair
+    """
+    pairs = sorted({(src_prop, trg_prop) for src_prop, trg_prop in matches if src_prop != "" and trg_prop != ""})
+
+    key = cache.get_key("expansion", src=src_dir.name, trg=trg_dir.name, pairs=cache.get_set_hash({f"{src}\t{trg}" for src, trg in pairs}),
+                        expander=EXPANDER_VERSION)
+
+    out_path = cache.get_artifact(key) if not force else None
+
+    if out_path is None:
+        out_path = cache.new_artifact("expansion", key)
+
+        src_sizes = get_property_sizes(src_dir)
+        pairs = [pair for pair in pairs if pair[0] in src_sizes and (trg_dir / f"{pair[1]}.csv").exists()]
+
+        tasks = schedule_expansion(pairs, src_sizes, executor.get_num_tasks())
+        worker_memory = (max_memory or DEFAULT_MEMORY) // executor.get_workers()
+
+        pool_args = [(task_pairs, src_dir, trg_dir, src_lang, trg_lang, out_path / f"part-{idx:05d}.nt.gz", worker_memory)
+                     for idx, (_, task_pairs) in enumerate(tasks)]
+
+        rows = []
+        for idx, pair_counts in executor.imap_progress(_expand_properties, pool_args, f"expanding infoboxes of {trg_lang}",
+                                                       [cost for cost, _ in tasks], "entities"):
+            rows.extend(counts + [pool_args[idx][5].name] for counts in pair_counts)
+
+        with open(out_path / REPORT_FILE, "w", encoding="utf-8", newline="") as out:
+            out_writer = csv.writer(out)
+            out_writer.writerow(REPORT_HEADER)
+            out_writer.writerows(sorted(rows))
+
+        out_path = cache.commit_artifact("expansion", key, {
+                                         "src_lang": src_lang, "trg_lang": trg_lang, "src": src_dir.name, "trg": trg_dir.name})
+
+    num_pairs = 0
+    num_triples = 0
+
+    report_file = get_report_file(src_lang, trg_lang, suffix)
+    with open(out_path / REPORT_FILE, "r", newline="", encoding="utf-8") as csvfile, open(report_file, "w", encoding="utf-8", newline="") as out:
+        csvreader = csv.reader(csvfile)
+        out_writer = csv.writer(out)
+        out_writer.writerow(next(csvreader))
+        for row in csvreader:
+            # the shards stay in the cache, the report in the data folder points to them
+            out_writer.writerow(row[:-1] + [out_path / row[-1]])
+            num_pairs += 1
+            num_triples += int(row[5])
+
+    print(f"### {num_triples} triples of {num_pairs} property pairs written to {out_path}")
+
+    return out_path
+
+
+def get_report_file(src_lang: str, trg_lang: str, suffix: Optional[str] = None) -> Path:
+    """returns the path of the csv file in the data folder with the number of generated triples of every property pair"""
+    out_name = f"{src_lang}_{trg_lang}"
+
+    if suffix is not None:
+        out_name = out_name + "_" + suffix
+
+    return DATA_FOLDER / f"{out_name}_expansion.csv"
+
+
+def schedule_expansion(pairs: list, src_sizes: dict, num_tasks: int) -> list:
+    """
+    groups the property pairs into tasks with a similar number of source entities, starting with the largest pair.
+    Returns (number of source entities, pairs) tuples of all tasks that got a pair
+    """
+    bins = [(0, idx, []) for idx in range(max(1, num_tasks))]
+
+    for pair in sorted(pairs, key=lambda p: (-src_sizes.get(p[0], 0), p)):
+        cost, idx, task_pairs = heapq.heappop(bins)
+        task_pairs.append(pair)
+        heapq.heappush(bins, (cost + src_sizes.get(pair[0], 0), idx, task_pairs))
+
+    return [(cost, task_pairs) for cost, _, task_pairs in sorted(bins, key=lambda b: b[1]) if len(task_pairs) > 0]
+
+
+@metrics.worker("expand")
+def _expand_properties(pairs: list, src_dir: Path, trg_dir: Path, src_lang: str, trg_lang: str, shard_file: Path, max_memory: int) -> list:
+    """
+    anti-joins the translated entities of every source property with the subjects of its matched target property and
+    writes the triples of the subjects that do not have the target property yet to a shard.
+    Both sides are sorted by subject with a bounded memory, so the size of a property does not matter.
+    Returns [source, target, candidates, present, untranslated, triples] of every pair
+    """
+    results = []
+
+    with gzip.open(shard_file, "wt", encoding="utf-8", compresslevel=COMPRESS_LEVEL) as out, tempfile.TemporaryDirectory(dir=shard_file.parent) as tmp:
+        for src_prop, trg_prop in pairs:
+            rows = sort_merge.RunWriter(Path(tmp), max_memory, "subjects")
+
+            for subject in _read_subjects(trg_dir / f"{trg_prop}.csv"):
+                rows.add((subject, EXISTING, ""))
+
+            candidates = 0
+            untranslated = 0
+            for subject, value in _translate_entities(src_dir / f"{src_prop}.csv", src_lang, trg_lang):
+                if subject is None or value is None:
+                    untranslated += 1
+                    continue
+                rows.add((subject, CANDIDATE, value))
+                candidates += 1
+
+            prop = create_rdf_prop(trg_prop, trg_lang)
+            present = 0
+            lines = []
+            num_triples = 0
+
+            for (subject,), group in sort_merge.group_rows(rows.merged(), 1):
+                group = list(dict.fromkeys(group))
+                if group[0][1] == EXISTING:
+                    present += sum(1 for row in group if row[1] == CANDIDATE)
+                    continue
+
+                rdf_subj = create_rdf_subj(subject, trg_lang)
+                lines.extend(f"{rdf_subj} {prop} {row[2]} .\n" for row in group)
+
+                if len(lines) >= WRITE_BATCH_SIZE:
+                    num_triples += len(lines)
+                    out.writelines(lines)
+                    lines = []
+
+            num_triples += len(lines)
+            out.writelines(lines)
+
+            metrics.count("generated_triples", num_triples)
+            results.append([src_prop, trg_prop, candidates, present, untranslated, num_triples])
+
+    return results
+
+
+def _read_subjects(prop_file: Path) -> Iterator[str]:
+    with open(prop_file, "r", newline="", encoding="utf-8") as csvfile:
+        csvreader = csv.reader(csvfile)
+        next(csvreader, None)
+        for row in csvreader:
+            yield row[0]
+
+
+def _translate_entities(prop_file: Path, src_lang: str, trg_lang: str) -> Iterator[tuple]:
+    """
+    yields the subject and the rdf value of every entity of a source property in the target language.
+    The subject is None if it has no article in the target language, instance values without an article are None as well.
+    Strings keep the tag of the source language, since their text is not translated
+    """
+    batch = []
+
+    with open(prop_file, "r", newline="", encoding="utf-8") as csvfile:
+        csvreader = csv.reader(csvfile)
+        next(csvreader, None)
+        for row in csvreader:
+            batch.append(row)
+            if len(batch) == TRANSLATION_BATCH_SIZE:
+                yield from _translate_rows(batch, src_lang, trg_lang)
+                diagnostics.progress(len(batch))
+                batch = []
+
+    if len(batch) > 0:
+        yield from _translate_rows(batch, src_lang, trg_lang)
+
+
+def _translate_rows(rows: list, src_lang: str, trg_lang: str) -> Iterator[tuple]:
+    names = [row[0] for row in rows] + [row[1] for row in rows if row[2] == "instance"]
+    translations = _translate_names(names, src_lang, trg_lang)
+
+    for row in rows:
+        subject, value, form = row[0], row[1], row[2]
+        if form == "instance":
+            value = translations[value]
+            rdf_value = create_rdf_value(value, form, trg_lang) if value is not None else None
+        else:
+            rdf_value = create_rdf_value(value, form, src_lang)
+        yield translations[subject], rdf_value
+
+
+def _translate_names(names: list, src_lang: str, trg_lang: str) -> dict:
+    """returns the name of every entity in the target language or None, recently translated names are not requested again"""
+    result = {}
+    missing = []
+
+    for name in dict.fromkeys(names):
+        cache_key = (src_lang, trg_lang, name)
+        if cache_key in _translations:
+            _translations.move_to_end(cache_key)
+            result[name] = _translations[cache_key]
+        else:
+            missing.append(name)
+
+    for idx in range(0, len(missing), TRANSLATION_BATCH_SIZE):
+        part = missing[idx:idx + TRANSLATION_BATCH_SIZE]
+        for name, trans in zip(part, translate_entity(part, src_lang, [trg_lang])):
+            result[name] = trans.get(trg_lang)
+            _translations[(src_lang, trg_lang, name)] = result[name]
+
+    while len(_translations) > TRANSLATION_CACHE_SIZE:
+        _translations.popitem(last=False)
+
+    metrics.count("translated_entities", len(missing))
+
+    return result
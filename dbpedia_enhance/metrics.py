@@ -0,0 +1,359 @@
+import os
+import sys
+import json
+import time
+import cProfile
+import threading
+import functools
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Optional, Tuple
+from tqdm import tqdm
+
+try:
+    import resource
+except ImportError:
+    # not available on windows, peak memory is not reported there
+    resource = None
+
+# interval in seconds between two samples of the sampling profiler
+SAMPLE_INTERVAL = 0.01
+
+# interval in seconds between two samples of the resident memory of a stage or task
+RSS_INTERVAL = 0.05
+
+_enabled = False
+_queue = None
+_profile_dir = None
+_cprofile = set()
+_sample = set()
+
+_records = []
+_records_lock = threading.Lock()
+_local = threading.local()
+_manager = None
+_num_tasks = 0
+
+# clock for the cpu time of worker tasks. Tasks running in threads of the parent only measure their own thread,
+# a worker process measures the whole process so that the helper threads of a task are included
+_worker_clock = time.thread_time
+
+# counters that are incremented outside of a recorded stage, e.g. in helper threads
+_unattributed = Counter()
+
+
+def enable(profile_dir: Path, cprofile: Optional[list] = None, sample: Optional[list] = None, context=None) -> None:
+    """
+    starts recording metrics for all stages and workers. Profiles of the stages named in cprofile are captured with cProfile,
+    stages in sample are captured with a sampling profiler. Both are written to profile_dir
+    """
+    global _enabled, _queue, _profile_dir, _cprofile, _sample, _manager
+
+    _enabled = True
+    _profile_dir = profile_dir
+    _cprofile = set(cprofile or [])
+    _sample = set(sample or [])
+
+    if context is not None:
+        # a managed queue delivers records synchronously, so they are not lost when a pool is terminated
+        _manager = context.Manager()
+        _queue = _manager.Queue()
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def count(counter: str, amount: int = 1) -> None:
+    """adds to a counter of the stage or worker task that is currently running in this thread"""
+    counters = getattr(_local, "counters", None)
+    if counters is not None:
+        counters[counter] += amount
+    elif _enabled:
+        with _records_lock:
+            _unattributed[counter] += amount
+
+
+@contextmanager
+def stage(name: str):
+    """records wall time, cpu time, peak memory and all counters of a stage running in the current thread"""
+    if not _enabled:
+        yield
+        return
+
+    with _measure(name, time.thread_time, "stage"):
+        yield
+
+
+def worker(name: str) -> Callable:
+    """decorator that records the metrics of a function running as a task in a worker process and sends them to the parent"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+
+            with _measure(name, _worker_clock, "worker"):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def init_worker(lock, enabled: bool = False, queue=None, profile_dir: Optional[Path] = None, cprofile: Optional[set] = None) -> None:
+    """initializer of all worker pools, which shares the tqdm lock and the metrics settings of the parent"""
+    global _enabled, _queue, _profile_dir, _cprofile, _worker_clock
+
+    tqdm.set_lock(lock)
+
+    _worker_clock = time.process_time
+    _enabled = enabled
+    _queue = queue
+    _profile_dir = profile_dir
+    _cprofile = cprofile or set()
+
+
+def worker_args(lock) -> tuple:
+    """returns the initargs for init_worker"""
+    return (lock, _enabled, _queue, _profile_dir, _cprofile)
+
+
+def get_report() -> dict:
+    """
+    returns all metrics recorded so far, aggregating the tasks of every worker function per worker.
+    The utilisation of a worker is the share of time it spent on tasks of a function between the start of the first
+    and the end of the last task of that function on any worker
+    """
+    with _records_lock:
+        while _queue is not None and not _queue.empty():
+            _records.append(_queue.get())
+        records = list(_records)
+
+    stages = [rec for rec in records if rec["kind"] == "stage"]
+
+    workers = {}
+    for rec in records:
+        if rec["kind"] != "worker":
+            continue
+        key = (rec["name"], rec["pid"], rec.get("thread"))
+        agg = workers.setdefault(key, {"name": rec["name"], "pid": rec["pid"], "thread": rec.get("thread"), "tasks": 0,
+                                       "wall": 0.0, "cpu": 0.0, "peak_rss": 0, "rss_delta": 0, "counters": Counter()})
+        agg["tasks"] += 1
+        agg["wall"] += rec["wall"]
+        agg["cpu"] += rec["cpu"]
+        agg["peak_rss"] = max(agg["peak_rss"], rec["peak_rss"] or 0)
+        agg["rss_delta"] = max(agg["rss_delta"], rec["rss_delta"] or 0)
+        agg["counters"].update(rec["counters"])
+
+    spans = {}
+    for rec in records:
+        if rec["kind"] == "worker":
+            start, end = spans.get(rec["name"], (rec["start"], rec["start"] + rec["wall"]))
+            spans[rec["name"]] = (min(start, rec["start"]), max(end, rec["start"] + rec["wall"]))
+
+    for agg in workers.values():
+        agg["counters"] = dict(agg["counters"])
+        start, end = spans[agg["name"]]
+        agg["utilisation"] = agg["wall"] / (end - start) if end > start else None
+        _add_rates(agg)
+
+    for rec in stages:
+        _add_rates(rec)
+
+    if len(_unattributed) > 0:
+        stages.append({"kind": "stage", "name": "(other)", "pid": os.getpid(), "start": None, "wall": 0.0,
+                       "cpu": 0.0, "peak_rss": None, "rss_delta": None, "counters": dict(_unattributed)})
+
+    return {"stages": stages, "workers": list(workers.values())}
+
+
+def write_report(out_file: Path) -> dict:
+    """writes the metrics to a json file and prints a summary"""
+    report = get_report()
+
+    with open(out_file, "w", encoding="utf-8") as out:
+        json.dump(report, out, indent=2)
+
+    print("")
+    print("############# profile")
+    print(f"{'stage':<24}{'wall (s)':>10}{'cpu (s)':>10}{'rss (MB)':>10}  counters")
+    for rec in report["stages"]:
+        _print_row(rec["name"], rec)
+
+    print("")
+    print(f"{'worker':<24}{'wall (s)':>10}{'cpu (s)':>10}{'rss (MB)':>10}  counters")
+    for rec in sorted(report["workers"], key=lambda r: (r["name"], r["pid"], r["thread"] or 0)):
+        _print_row(f"{rec['name']} [{rec['pid']}]", rec)
+
+    print("")
+    print(f"{'worker':<24}{'workers':>10}{'min util':>10}{'max util':>10}")
+    for name in sorted(set(rec["name"] for rec in report["workers"])):
+        utils = [rec["utilisation"] for rec in report["workers"]
+                 if rec["name"] == name and rec["utilisation"] is not None]
+        if len(utils) > 0:
+            print(f"{name:<24}{len(utils):>10}{min(utils):>10.0%}{max(utils):>10.0%}")
+
+    print(f"report written to {out_file}")
+
+    return report
+
+
+@contextmanager
+def _measure(name: str, cpu_clock: Callable, kind: str):
+    global _num_tasks
+
+    prev_counters = getattr(_local, "counters", None)
+    _local.counters = Counter()
+
+    profiler = None
+    if name in _cprofile:
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    sampler = None
+    if kind == "stage" and name in _sample:
+        sampler = _Sampler(threading.get_ident())
+        sampler.start()
+
+    rss_sampler = _RssSampler()
+    rss_sampler.start()
+
+    wall_start = time.perf_counter()
+    cpu_start = cpu_clock()
+
+    try:
+        yield
+    finally:
+        peak_rss, rss_delta = rss_sampler.stop()
+        record = {
+            "kind": kind,
+            "name": name,
+            "pid": os.getpid(),
+            "thread": threading.get_ident(),
+            "start": time.time() - (time.perf_counter() - wall_start),
+            "wall": time.perf_counter() - wall_start,
+            "cpu": cpu_clock() - cpu_start,
+            "peak_rss": peak_rss,
+            "rss_delta": rss_delta,
+            "counters": dict(_local.counters)
+        }
+        _local.counters = prev_counters
+
+        suffix = name
+        if kind == "worker":
+            _num_tasks += 1
+            suffix = f"{name}_{os.getpid()}_{_num_tasks}"
+
+        if profiler is not None:
+            profiler.disable()
+            _profile_dir.mkdir(parents=True, exist_ok=True)
+            profiler.dump_stats(_profile_dir / f"{suffix}.prof")
+
+        if sampler is not None:
+            sampler.stop()
+            _profile_dir.mkdir(parents=True, exist_ok=True)
+            sampler.write(_profile_dir / f"{suffix}.folded")
+
+        if _queue is not None and kind == "worker":
+            _queue.put(record)
+        else:
+            with _records_lock:
+                _records.append(record)
+
+
+class _Sampler(threading.Thread):
+    """
+    samples the stack of a thread in regular intervals. The samples are written in the folded format
+    that flamegraph tools understand
+    """
+
+    def __init__(self, ident: int):
+        super().__init__(daemon=True)
+        self.ident_to_sample = ident
+        self.samples = Counter()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(SAMPLE_INTERVAL):
+            frame = sys._current_frames().get(self.ident_to_sample)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(
+                    f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if len(stack) > 0:
+                self.samples[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+    def write(self, out_file: Path):
+        with open(out_file, "w", encoding="utf-8") as out:
+            for stack, num in self.samples.most_common():
+                out.write(f"{stack} {num}\n")
+
+
+class _RssSampler(threading.Thread):
+    """
+    samples the resident memory of the current process while a stage or task runs.
+    Stages share the main process, so the peak of a stage also contains the memory of stages running at the same time,
+    the memory of worker processes is reported by their tasks
+    """
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.start_rss = _get_rss()
+        self.peak = self.start_rss
+        self.stopped = threading.Event()
+
+    def run(self):
+        if self.start_rss is None:
+            return
+        while not self.stopped.wait(RSS_INTERVAL):
+            self.peak = max(self.peak, _get_rss())
+
+    def stop(self) -> Tuple[Optional[int], Optional[int]]:
+        """returns the peak memory during the measurement and the difference between its end and start"""
+        self.stopped.set()
+        self.join()
+
+        end_rss = _get_rss()
+        if self.start_rss is None or end_rss is None:
+            # without /proc only the high-water mark of the whole process lifetime is known
+            return _get_max_rss(), None
+
+        return max(self.peak, end_rss), end_rss - self.start_rss
+
+
+def _get_rss() -> Optional[int]:
+    """returns the current resident memory of the process in bytes"""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _get_max_rss() -> Optional[int]:
+    """returns the peak resident memory over the lifetime of the current process in bytes"""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # linux reports kilobytes, macos bytes
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def _add_rates(rec: dict) -> None:
+    if rec["wall"] > 0 and "triples" in rec["counters"]:
+        rec["triples_per_second"] = rec["counters"]["triples"] / rec["wall"]
+
+
+def _print_row(label: str, rec: dict) -> None:
+    rss = f"{rec['peak_rss'] / 1024 ** 2:.0f}" if rec["peak_rss"] else "-"
+    counters = ", ".join(f"{key}={val}" for key,
+                         val in sorted(rec["counters"].items()))
+    if "triples_per_second" in rec:
+        counters += f", triples/s={rec['triples_per_second']:.0f}"
+    print(f"{label:<24}{rec['wall']:>10.2f}{rec['cpu']:>10.2f}{rss:>10}  {counters}")
@@ -0,0 +1,170 @@
+import os
+import csv
+from collections import Counter
+from pathlib import Path
+from typing import Iterable, Optional
+
+OVERLAP_FILE = "overlap.csv"
+
+OVERLAP_HEADER = ["source", "target", "overlap", "source_size", "target_size"]
+
+CHECKPOINT_FILE = "checkpoint.csv"
+
+# last column of the row that closes the counts of a target property in a checkpoint
+FINISHED = "finished"
+
+BEST_HEADER = ["source", "target", "overlap", "score", "source_best", "target_best"]
+
+# share of the entities of the smaller property that have to be equal, so that two properties match
+MIN_SCORE = 0.5
+
+
+class PropertyOverlap:
+    """
+    number of equal entities of every pair of source and target properties that have any. The counts are symmetric,
+    so the best matches of both directions are derived from the same counts instead of matching the languages twice
+    """
+
+    def __init__(self, src_sizes: Optional[dict] = None, trg_sizes: Optional[dict] = None):
+        self.counts = Counter()
+        self.src_sizes = dict(src_sizes or {})
+        self.trg_sizes = dict(trg_sizes or {})
+
+    def __len__(self) -> int:
+        return len(self.counts)
+
+    def add(self, src_prop: str, trg_prop: str, count: int) -> None:
+        if count > 0:
+            self.counts[(src_prop, trg_prop)] += count
+
+    def add_target(self, trg_prop: str, size: int, counts: dict) -> None:
+        """adds the equal entities of every source property with a target property of the given size"""
+        self.trg_sizes[trg_prop] = size
+        for src_prop, count in counts.items():
+            self.add(src_prop, trg_prop, count)
+
+    def update(self, rows: Iterable) -> None:
+        """adds (source, target, count) rows, e.g. the results of a worker"""
+        for src_prop, trg_prop, count in rows:
+            self.add(src_prop, trg_prop, count)
+
+    def get_score(self, src_prop: str, trg_prop: str) -> float:
+        """returns the equal entities of two properties relative to the size of the smaller one"""
+        size = min(self.src_sizes.get(src_prop, 0), self.trg_sizes.get(trg_prop, 0))
+
+        if size == 0:
+            return 0.0
+        return self.counts[(src_prop, trg_prop)] / size
+
+    def get_best(self, direction: str = "source") -> dict:
+        """
+        returns the best matching target property of every source property, or with direction "target" the best source
+        property of every target property. Ties are decided by the number of equal entities and then by name
+        """
+        best = {}
+
+        for (src_prop, trg_prop), count in self.counts.items():
+            score = self.get_score(src_prop, trg_prop)
+            if score < MIN_SCORE:
+                continue
+
+            prop, other = (src_prop, trg_prop) if direction == "source" else (trg_prop, src_prop)
+            rank = (-score, -count, other)
+            if prop not in best or rank < best[prop]:
+                best[prop] = rank
+
+        return {prop: rank[2] for prop, rank in best.items()}
+
+    def get_targets(self) -> dict:
+        """returns {target property: {source property: equal entities}} of all target properties"""
+        targets = {trg_prop: {} for trg_prop in self.trg_sizes}
+        for (src_prop, trg_prop), count in self.counts.items():
+            targets.setdefault(trg_prop, {})[src_prop] = count
+        return targets
+
+    def get_matches(self) -> list:
+        """returns the (source, target) pairs of the best target property of every source property"""
+        return sorted(self.get_best("source").items())
+
+    def get_mutual(self) -> list:
+        """returns the (source, target) pairs where both properties are the best match of each other"""
+        trg_best = self.get_best("target")
+        return [(src_prop, trg_prop) for src_prop, trg_prop in self.get_matches() if trg_best.get(trg_prop) == src_prop]
+
+    def write(self, out_file: Path) -> None:
+        with open(out_file, "w", encoding="utf-8", newline="") as out:
+            out_writer = csv.writer(out)
+            out_writer.writerow(OVERLAP_HEADER)
+            for (src_prop, trg_prop), count in sorted(self.counts.items()):
+                out_writer.writerow([src_prop, trg_prop, count, self.src_sizes.get(
+                    src_prop, 0), self.trg_sizes.get(trg_prop, 0)])
+
+    def write_best(self, out_file: Path) -> None:
+        """writes every pair that is the best match in at least one direction, mutual best matches are best in both"""
+        src_best = self.get_best("source")
+        trg_best = self.get_best("target")
+        pairs = set(src_best.items()) | {(src_prop, trg_prop) for trg_prop, src_prop in trg_best.items()}
+
+        with open(out_file, "w", encoding="utf-8", newline="") as out:
+            out_writer = csv.writer(out)
+            out_writer.writerow(BEST_HEADER)
+            for src_prop, trg_prop in sorted(pairs):
+                out_writer.writerow([src_prop, trg_prop, self.counts[(src_prop, trg_prop)],
+                                     round(self.get_score(src_prop, trg_prop), 4),
+                                     src_best.get(src_prop) == trg_prop, trg_best.get(trg_prop) == src_prop])
+
+
+def read_overlap(overlap_file: Path) -> PropertyOverlap:
+    """reads the counts written by PropertyOverlap.write"""
+    overlap = PropertyOverlap()
+
+    with open(overlap_file, "r", newline="", encoding="utf-8") as csvfile:
+        csvreader = csv.reader(csvfile)
+        next(csvreader, None)
+        for src_prop, trg_prop, count, src_size, trg_size in csvreader:
+            overlap.add(src_prop, trg_prop, int(count))
+            overlap.src_sizes[src_prop] = int(src_size)
+            overlap.trg_sizes[trg_prop] = int(trg_size)
+
+    return overlap
+
+
+def read_checkpoint(checkpoint: Path) -> dict:
+    """
+    returns (size, {source property: equal entities}) of every finished target property in a checkpoint.
+    The counts of a target property are only used if the row that closes them was written completely
+    """
+    finished = {}
+
+    if not checkpoint.exists():
+        return finished
+
+    pending = {}
+    with open(checkpoint, "r", newline="", encoding="utf-8") as csvfile:
+        for row in csv.reader(csvfile):
+            if len(row) == 4 and row[3] == FINISHED:
+                finished[row[0]] = (int(row[2]), {src_prop: int(count) for src_prop, count in pending.pop(row[0], [])})
+            elif len(row) == 3:
+                pending.setdefault(row[0], []).append((row[1], row[2]))
+
+    return finished
+
+
+def write_checkpoint(checkpoint: Path, targets: dict, append: bool = True) -> None:
+    """
+    writes the counts of finished target properties, as returned by read_checkpoint, to a checkpoint.
+    They are on disk when this returns, so a run that is interrupted afterwards does not compare them again
+    """
+    out_file = checkpoint if append else checkpoint.with_name(checkpoint.name + ".tmp")
+
+    with open(out_file, "a" if append else "w", encoding="utf-8", newline="") as out:
+        out_writer = csv.writer(out)
+        for trg_prop, (size, counts) in targets.items():
+            for src_prop, count in counts.items():
+                out_writer.writerow([trg_prop, src_prop, count])
+            out_writer.writerow([trg_prop, "", size, FINISHED])
+        out.flush()
+        os.fsync(out.fileno())
+
+    if not append:
+        out_file.replace(checkpoint)
@@ -0,0 +1,143 @@
+import argparse
+from typing import Optional, Tuple
+import data.utils as dat_util
+from . import property_extractor, property_matcher, infobox_expander, executor
+from .scheduler import Pipeline
+
+# maximum number of translated target properties per worker that wait for the matching
+TRANSLATION_QUEUES_PER_WORKER = 2
+
+DUMP_URL = "https://databus.dbpedia.org/dbpedia/generic/infobox-properties/{version}/infobox-properties_lang={lang}.ttl.bz2"
+
+
+def get_dump_url(version: str, lang: str) -> str:
+    return DUMP_URL.format(version=version, lang=lang)
+
+
+def get_dump_file(version: str, lang: str, force: Optional[bool] = False) -> str:
+    """returns the name of the extracted dump of a language in the data folder and only downloads it if it is missing"""
+    url = get_dump_url(version, lang)
+    fname = url.split("/")[-1][:-len(".bz2")]
+
+    if force or not (dat_util.DATA_FOLDER / fname).exists():
+        fname = dat_util.get_data([url], force)[0]
+
+    return fname
+
+
+def run_pipeline(options: argparse.Namespace) -> Tuple[list, set, set]:
+    """
+    downloads, extracts and matches the properties of two languages.
+    Both languages are downloaded and extracted at the same time, the target properties are translated as soon as
+    they are extracted and the matching starts on the first translated properties instead of waiting for all of them.
+    With the expand option the triples that are missing in the target language are generated from the matches.
+    With a time budget the largest target properties are matched first and the matching stops when it is used up.
+    Returns the matches and the extracted source and target properties.
+    """
+    src_link = get_dump_url(options.version, options.src_lang)
+    trg_link = get_dump_url(options.version, options.trg_lang)
+
+    max_memory = options.max_memory
+    if max_memory is not None:
+        max_memory = int(max_memory * 1024 ** 2)
+    mode = property_matcher.get_match_mode(max_memory, options.value_tolerance)
+
+    # the budget counts from the start of the run, so downloading and extracting are part of it
+    budget = property_matcher.TimeBudget(
+        options.time_budget * 60) if options.time_budget is not None else None
+
+    pipeline = Pipeline()
+    translated = pipeline.add_queue(
+        TRANSLATION_QUEUES_PER_WORKER * executor.get_workers())
+    # target properties whose translation failed, the matches are not cached without them
+    failed = set()
+
+    def download(link):
+        return dat_util.get_data([link], options.force_new)[0]
+
+    def extract_properties(fname, category):
+        return property_extractor.extract_properties(
+            fname, category, options.force_new, options.version, options.cat_depth)
+
+    def translate(trg_result):
+        trg_props, trg_dir = trg_result
+        trg_props = property_matcher.clean_prop_list(trg_props)
+        finished = None
+
+        def skip(prop):
+            # direct matches and properties an interrupted run already compared are not translated anymore once the source properties are known
+            nonlocal finished
+            src_result = pipeline.get_result("extract_src")
+            if src_result is None:
+                return False
+            if finished is None:
+                finished = set() if options.force_new or max_memory is not None else property_matcher.get_checkpointed_properties(
+                    property_matcher.get_checkpoint(src_result[1], trg_dir, mode))
+            return prop in src_result[0] or prop in finished
+
+        # the largest properties are translated first, so they are matched before a time budget is used up
+        trg_order = property_matcher.order_by_size(trg_props, property_extractor.get_property_sizes(trg_dir))
+        for item in property_matcher.translate_properties(trg_order, options.trg_lang, options.src_lang, trg_dir, skip, failed):
+            if translated.cancelled.is_set():
+                break
+            translated.put(item)
+
+        translated.close()
+
+    def match(src_result, trg_result):
+        src_props, src_dir = src_result
+        trg_props, trg_dir = trg_result
+
+        out_file = property_matcher.get_matches_file(
+            options.src_lang, options.trg_lang, options.out_suffix)
+
+        if not options.force_new:
+            matches = property_matcher.get_cached_matches(
+                src_dir, trg_dir, out_file, mode)
+            if matches is not None:
+                translated.cancel()
+                return matches
+
+        src_clean, trg_clean, matches = property_matcher.prepare_matching(
+            src_props, trg_props)
+
+        trg_items = ((prop, entities)
+                     for prop, entities in translated if prop in trg_clean)
+
+        checkpoint = property_matcher.get_checkpoint(
+            src_dir, trg_dir, mode, options.force_new) if max_memory is None else None
+        overlap = property_matcher.find_entity_matches_translated(
+            list(src_clean), trg_items, src_dir, max_memory, options.value_tolerance, checkpoint, budget)
+
+        if translated.cancelled.is_set():
+            # another stage failed and the queue ended early, the checkpoint keeps the compared properties for the next run
+            raise RuntimeError("the translated target properties ended early, the matches are not saved")
+
+        if budget is not None and budget.expired:
+            # the remaining target properties are not translated anymore
+            translated.cancel()
+
+        matches.extend(overlap.get_matches())
+
+        property_matcher.save_matches(matches, src_clean, trg_clean, options.src_lang,
+                                      options.trg_lang, src_dir, trg_dir, out_file, mode, overlap, budget, failed)
+
+        return matches
+
+    pipeline.add_stage("download_src", lambda: download(src_link))
+    pipeline.add_stage("download_trg", lambda: download(trg_link))
+    pipeline.add_stage("extract_src", lambda fname: extract_properties(
+        fname, options.src_cat), ["download_src"])
+    pipeline.add_stage("extract_trg", lambda fname: extract_properties(
+        fname, options.trg_cat), ["download_trg"])
+    pipeline.add_stage("translate", translate, ["extract_trg"])
+    pipeline.add_stage("match", match, ["extract_src", "extract_trg"])
+
+    if options.expand:
+        pipeline.add_stage("expand", lambda matches, src_result, trg_result: infobox_expander.expand_infoboxes(
+            matches, options.src_lang, options.trg_lang, src_result[1], trg_result[1], options.out_suffix, max_memory, options.force_new),
+            ["match", "extract_src", "extract_trg"])
+
+    results = pipeline.run()
+
+    return results["match"], results["extract_src"][0], results["extract_trg"][0]
@@ -0,0 +1,240 @@
+import json
+import math
+import random
+import time
+from pathlib import Path
+from typing import Iterable, Optional, Tuple
+from data.utils import DATA_FOLDER
+from . import metrics, executor, property_extractor, property_matcher
+from .overlap import PropertyOverlap, MIN_SCORE
+from .translate_entity import translate_entity
+from .utils import iter_subject_blocks, get_category_members, get_lang_code
+
+# number of subjects of the source language the preview matches
+PREVIEW_SUBJECTS = 1000
+
+# the dump is divided into this many parts and one window at a random position of every part is read
+NUM_WINDOWS = 256
+
+WINDOW_SIZE = 256 * 1024
+
+# z value of the 95% confidence interval of the estimates
+CONFIDENCE_Z = 1.96
+
+# number of entities with the average share of equal entities of all properties that are added to every property,
+# so that properties with only a few sampled entities do not match by chance
+PRIOR_ENTITIES = 10
+
+# number of subjects that are translated with one request
+TRANSLATION_BATCH_SIZE = 40
+
+
+def run_preview(src_file: str, trg_file: str, src_lang: str, trg_lang: str, sample_size: int = PREVIEW_SUBJECTS, src_cat: Optional[str] = None, trg_cat: Optional[str] = None,
+                version: Optional[str] = None, cat_depth: int = 0, suffix: Optional[str] = None, tolerance: float = 0.0, seed: int = 0) -> dict:
+    """
+    estimates the number of property matches of two languages from a sample of the source subjects.
+    The sampled subjects and their translations are extracted, translated and matched like a full run. A second sample
+    of the target dump estimates the sizes of the target properties, since the translations only cover the subjects
+    of both languages. The match probability of every source property is derived from its share of equal entities.
+    Returns the estimate, which is also written next to the matches file
+    """
+    start = time.perf_counter()
+
+    src_subjects, src_ranges, num_src_subjects = get_sample(src_file, src_lang, sample_size, src_cat, version, cat_depth, seed)
+    trg_subjects = translate_subjects(src_subjects, src_lang, trg_lang)
+    print(f"### {len(src_subjects)} of about {num_src_subjects} subjects of {src_lang} sampled, {len(trg_subjects)} exist in {trg_lang}")
+
+    src_props, src_dir = property_extractor.extract_properties(
+        src_file, src_cat, False, version, cat_depth, src_subjects, src_ranges)
+    # the translated subjects are read from the subject index of the target dump, which is built once per dump
+    trg_props, trg_dir = property_extractor.extract_properties(
+        trg_file, trg_cat, False, version, cat_depth, trg_subjects)
+
+    size_subjects, size_ranges, num_trg_subjects = get_sample(trg_file, trg_lang, sample_size, trg_cat, version, cat_depth, seed)
+    _, size_dir = property_extractor.extract_properties(
+        trg_file, trg_cat, False, version, cat_depth, size_subjects, size_ranges)
+    trg_scale = num_trg_subjects / max(1, len(size_subjects))
+    trg_sizes = {prop: size * trg_scale for prop, size in property_extractor.get_property_sizes(size_dir).items()}
+
+    preview_suffix = "preview" if suffix is None else f"{suffix}_preview"
+    matches = property_matcher.find_matches(src_props, trg_props, src_lang, trg_lang, src_dir, trg_dir,
+                                            preview_suffix, tolerance=tolerance)
+    overlap = property_matcher.get_cached_overlap(
+        src_dir, trg_dir, property_matcher.get_match_mode(None, tolerance)) or PropertyOverlap()
+
+    # direct matches of the sample are direct matches of the whole dumps as well
+    num_direct = len(matches) - len(overlap.get_matches())
+    estimate = estimate_matches(overlap, num_src_subjects / max(1, len(src_subjects)), trg_sizes, num_direct)
+    estimate.update({"sampled_subjects": len(src_subjects), "estimated_subjects": num_src_subjects, "translated_subjects": len(trg_subjects),
+                     "estimated_target_subjects": num_trg_subjects, "source_properties": len(src_props), "target_properties": len(trg_props),
+                     "seconds": round(time.perf_counter() - start, 1)})
+
+    out_file = get_preview_file(src_lang, trg_lang, suffix)
+    with open(out_file, "w", encoding="utf-8") as out:
+        json.dump(estimate, out, indent=2)
+
+    return estimate
+
+
+def get_sample(file: str, lang: str, sample_size: int, category: Optional[str] = None, version: Optional[str] = None, cat_depth: int = 0, seed: int = 0) -> Tuple[set, Optional[list], int]:
+    """
+    returns the sampled subjects of a dump, their byte ranges and the estimated number of subjects of the dump.
+    The members of a category are known, so they are sampled directly and their ranges are read from the subject index
+    """
+    if category is None:
+        sample, num_subjects = sample_subjects(file, sample_size, seed)
+        return set(sample), [rng for ranges in sample.values() for rng in ranges], num_subjects
+
+    members = sorted(get_category_members(category, lang, version, cat_depth))
+    return set(random.Random(seed).sample(members, min(sample_size, len(members)))), None, len(members)
+
+
+def get_preview_file(src_lang: str, trg_lang: str, suffix: Optional[str] = None) -> Path:
+    """returns the path of the json file in the data folder the estimate of a preview is written to"""
+    out_name = f"{src_lang}_{trg_lang}"
+
+    if suffix is not None:
+        out_name = out_name + "_" + suffix
+
+    return DATA_FOLDER / f"{out_name}_preview.json"
+
+
+def sample_subjects(file: str, sample_size: int, seed: int = 0) -> Tuple[dict, int]:
+    """
+    reservoir samples subjects from windows at random positions of a dump, instead of reading the whole dump.
+    The dump is divided into equal parts and one window of every part is read in parallel, every subject whose
+    triples lie completely in a window is a candidate. Returns {subject: byte ranges} of the sample and the number of
+    subjects of the dump, estimated from the subjects per byte of the windows
+    """
+    path = DATA_FOLDER / file
+    size = path.stat().st_size
+    rand = random.Random(seed)
+
+    num_windows = max(1, min(NUM_WINDOWS, size // WINDOW_SIZE))
+    part_size = size // num_windows
+    windows = [(path, idx * part_size + rand.randrange(max(1, part_size - WINDOW_SIZE)), WINDOW_SIZE, size) for idx in range(num_windows)]
+
+    window_blocks = executor.run(_read_window, windows, f"sampling {get_lang_code(file)}",
+                                 [length for _, _, length, _ in windows], "B")
+
+    candidates = {}
+    num_bytes = 0
+    for blocks in window_blocks:
+        for subject, start, end in blocks:
+            # the end of a window is moved to the end of its line, so neighbouring windows can share a subject
+            ranges = candidates.setdefault(subject, set())
+            if (start, end) not in ranges:
+                ranges.add((start, end))
+                num_bytes += end - start
+
+    sample = reservoir_sample(sorted(candidates), sample_size, rand)
+    num_subjects = round(len(candidates) * size / num_bytes) if num_bytes > 0 else 0
+
+    return {subject: sorted(candidates[subject]) for subject in sample}, num_subjects
+
+
+def reservoir_sample(items: Iterable, k: int, rand: random.Random) -> list:
+    """returns k items drawn uniformly without replacement from an iterable of unknown length with one pass"""
+    sample = []
+
+    for idx, item in enumerate(items):
+        if idx < k:
+            sample.append(item)
+        else:
+            pos = rand.randrange(idx + 1)
+            if pos < k:
+                sample[pos] = item
+
+    return sample
+
+
+def translate_subjects(subjects: set, src_lang: str, trg_lang: str) -> set:
+    """returns the names of the subjects that have an article in the target language"""
+    names = sorted(subjects)
+    translated = set()
+
+    for idx in range(0, len(names), TRANSLATION_BATCH_SIZE):
+        for trans in translate_entity(names[idx:idx + TRANSLATION_BATCH_SIZE], src_lang, [trg_lang]):
+            if trans.get(trg_lang) is not None:
+                translated.add(trans[trg_lang])
+
+    return translated
+
+
+def estimate_matches(overlap: PropertyOverlap, src_scale: float, trg_sizes: dict, num_direct: int = 0, z: float = CONFIDENCE_Z) -> dict:
+    """
+    estimates the number of matches of the whole dumps from the equal entity counts of a sample.
+    Counts and source sizes are scaled by the share of sampled source subjects, trg_sizes are the estimated sizes of
+    the target properties in the whole dump. The best target property of every source property matches with the
+    probability that its share of equal entities is at least MIN_SCORE. The share is measured on the sampled entities
+    together with PRIOR_ENTITIES entities of the average share, the matches are the sum of these probabilities and the
+    interval follows from their variance
+    """
+    best = {}
+    for (src_prop, trg_prop), count in overlap.counts.items():
+        src_size = overlap.src_sizes.get(src_prop, 0) * src_scale
+        # a target property that was not in the size sample is at least as large as its translated entities
+        trg_size = max(trg_sizes.get(trg_prop, 0), overlap.trg_sizes.get(trg_prop, 0) * src_scale)
+        size = min(src_size, trg_size)
+        if size == 0:
+            continue
+
+        # equal entities and size in the unit of sampled entities
+        sample_size = size / src_scale
+        sample_count = min(count, sample_size)
+        if src_prop not in best or sample_count / sample_size > best[src_prop][0] / best[src_prop][1]:
+            best[src_prop] = (sample_count, sample_size)
+
+    prior = sum(count for count, _ in best.values()) / max(1, sum(size for _, size in best.values()))
+
+    probabilities = []
+    for count, size in best.values():
+        size += PRIOR_ENTITIES
+        probabilities.append(get_match_probability((count + PRIOR_ENTITIES * prior) / size, size))
+
+    expected = sum(probabilities)
+    deviation = math.sqrt(sum(p * (1 - p) for p in probabilities))
+
+    metrics.count("preview_candidates", len(best))
+
+    return {
+        "matches": round(num_direct + expected, 1),
+        "low": round(num_direct + max(0.0, expected - z * deviation), 1),
+        "high": round(num_direct + min(float(len(best)), expected + z * deviation), 1),
+        "direct_matches": num_direct,
+        "sample_matches": num_direct + len(overlap.get_matches()),
+        "candidates": len(best)
+    }
+
+
+def get_match_probability(score: float, size: float) -> float:
+    """returns the probability that a share of equal entities measured on size entities is at least MIN_SCORE"""
+    # the added variance keeps shares of 0 or 1 from being certain
+    error = math.sqrt((score * (1 - score) + 1 / (4 * size)) / size)
+    return 0.5 * (1 + math.erf((score - MIN_SCORE) / (error * math.sqrt(2))))
+
+
+@metrics.worker("sample")
+def _read_window(file: Path, start: int, length: int, size: int) -> list:
+    """
+    returns (subject, start, end) of every subject whose lines lie completely in a window of a file.
+    The first and last subject of a window can continue outside of it and are left out, except at the ends of the file
+    """
+    with open(file, "rb") as f:
+        if start > 0:
+            f.seek(start - 1)
+            f.readline()
+            start = f.tell()
+        f.seek(min(size, start + length))
+        f.readline()
+        end = f.tell()
+
+    blocks = []
+    pos = start
+    for subject, block in iter_subject_blocks(file, start, end):
+        blocks.append((subject, pos, pos + len(block)))
+        pos += len(block)
+
+    metrics.count("bytes_read", end - start)
+
+    return blocks[0 if start == 0 else 1:len(blocks) if end >= size else -1]
@@ -1,170 +1,140 @@
-import multiprocessing as mp
 import os
 import csv
-from tqdm import tqdm
-from filelock import FileLock
 from pathlib import Path
 from data.utils import DATA_FOLDER
-from .utils import extract_prop_name, extract_subj_name, extract_value, get_lang_code, get_category_members
-from typing import Optional
+from data import cache
+from . import metrics, executor, catalog, diagnostics
+from .subject_index import get_extraction_chunks, join_ranges
+from .utils import extract_prop_name, extract_value, get_lang_code, get_category_members, parse_typed_value, iter_subject_blocks, get_block_lines, PARSER_VERSION
+from .string_array import StringArray, write_string_array
+from typing import Optional, Tuple
 
+PROPERTIES_FILE = "_properties.bin"
 
-def extract_properties(file: str, suffix: Optional[str] = None, use_category: Optional[str] = None, force: Optional[bool] = False):
+# columns of the file of every property, typed holds the parsed number or day of numeric and date values
+PROPERTY_HEADER = ["subject", "value", "format", "typed"]
+
+
+def extract_properties(file: str, use_category: Optional[str] = None, force: Optional[bool] = False, version: Optional[str] = None, cat_depth: int = 0, subjects: Optional[set] = None, ranges: Optional[list] = None) -> Tuple[StringArray, Path]:
     """
     extract all properties from a language file and stores the results in individual lists.
-    Additionally a single csv file containing all distinct property names is created.
-    Optionally, the extracted proeprties can be limited to a single category from Wikipedia.
+    Additionally a sorted string array containing all distinct property names is created.
+    Optionally, the extracted proeprties can be limited to a single category from Wikipedia or to a set of subjects,
+    e.g. a sample. The byte ranges of the subjects are read from the subject index unless they are given.
+    The results are cached by the dump, category members and parser version, so they are only computed once.
+    Returns the property names as a memory mapped string array and the folder containing the individual lists.
     """
     lang_code = get_lang_code(file)
 
     filtr = None
 
     if use_category is not None:
-        filtr = get_category_members(use_category, lang_code)
-
-    if suffix is not None:
-        lang_code = lang_code + "_" + suffix
+        filtr = get_category_members(
+            use_category, lang_code, version, cat_depth, force)
 
-    out_path = DATA_FOLDER / lang_code
+    if subjects is not None:
+        filtr = subjects if filtr is None else filtr & subjects
 
-    prop_file = DATA_FOLDER / f"{lang_code}_properties.csv"
+    key = cache.get_extraction_key(
+        "properties", file, lang_code, filtr, PARSER_VERSION)
 
-    all_properties = set()
+    out_path = cache.get_artifact(key) if not force else None
 
-    if prop_file.exists() and not force:
-        with open(prop_file, "r", newline="", encoding="utf-8") as csvfile:
-            csvreader = csv.reader(csvfile)
-            for row in csvreader:
-                all_properties.update(row)
+    if out_path is not None:
+        return StringArray(out_path / PROPERTIES_FILE), out_path
 
-        return all_properties
+    out_path = cache.new_artifact("properties", key)
 
-    _check_dir_exists(out_path)
-
-    chunk_args = _get_chunks(DATA_FOLDER / file, out_path)
+    # category members are read from the subject index instead of scanning the whole dump
+    chunks = join_ranges(ranges) if ranges is not None else get_extraction_chunks(file, filtr)
 
     pool_args = []
-    for idx, arg in enumerate(chunk_args):
-        new_arg = (*arg, filtr, idx+1)
-        pool_args.append(new_arg)
-
-    tqdm.set_lock(mp.RLock())
-    with mp.Pool(processes=mp.cpu_count(), initializer=tqdm.set_lock, initargs=(tqdm.get_lock(),)) as pool:
-        all_prop_list = pool.starmap(_extract_properties, pool_args)
-
-    for file in out_path.iterdir():
-        if file.is_file() and file.suffix == ".lock":
-            file.unlink(missing_ok=True)
-
-    for properties in all_prop_list:
-        all_properties.update(properties)
-
-    with open(prop_file, "w", encoding="utf-8", newline="") as out:
-        out_writer = csv.writer(out)
-        for prop in all_properties:
-            out_writer.writerow([prop])
-
-    return all_properties
-
+    for chunk_start, chunk_end in chunks:
+        pool_args.append((DATA_FOLDER / file, chunk_start, chunk_end, filtr))
 
-def _extract_properties(file: Path, chunk_start: int, chunk_end: int, size: int, out_folder: Path, filtr: Optional[list], pid: int) -> set:
-    """extracts the properties from an rdf file and saves them into individual files. Returns a set with all individual property names"""
-    all_props = set()
+    prop_stats = {}
+    num_triples = 0
+    errors = diagnostics.ErrorReport()
 
-    desc = f"#{pid}"
+    # the workers return their rows instead of writing them, so that a task can be repeated and workers do not need
+    # to share the output folder
+    for _, (prop_rows, chunk_stats, chunk_triples) in executor.imap_progress(_extract_properties, pool_args, f"extracting properties of {lang_code}",
+                                                                           [end - start for start, end in chunks], "B", errors):
+        for prop, rows in prop_rows.items():
+            out_file = out_path / f"{prop}.csv"
+            new_file = prop not in prop_stats
+            with open(out_file, "a", encoding="utf-8", newline="") as out:
+                out_writer = csv.writer(out)
+                if new_file:
+                    out_writer.writerow(PROPERTY_HEADER)
+                out_writer.writerows(rows)
 
-    with tqdm(total=size, desc=desc, position=pid) as pbar:
-        with open(file, "r", encoding="utf-8") as f:
-            f.seek(chunk_start)
+            if new_file:
+                prop_stats[prop] = chunk_stats[prop]
+            else:
+                prop_stats[prop].merge(chunk_stats[prop])
 
-            for line in f:
-                chunk_start += len(line)
-                if chunk_start > chunk_end:
-                    break
+        num_triples += chunk_triples
 
-                try:
-                    content = line.split("> ", 2)
-                    subject = extract_subj_name(content[0])
-                    prop = extract_prop_name(content[1])
-                    value, form = extract_value(content[2])
+    if len(errors) > 0:
+        errors.write(out_path / diagnostics.ERRORS_FILE)
+        print(f"### {len(errors)} lines of {lang_code} could not be parsed: {errors.summary()}")
 
-                    if filtr is None or subject in filtr:
-                        out_file = out_folder / f"{prop}.csv"
-                        lock_file = out_folder / f"{prop}.csv.lock"
-                        lock = FileLock(str(lock_file))
+    write_string_array(out_path / PROPERTIES_FILE, prop_stats.keys())
+    catalog.write_catalog(out_path, prop_stats, num_triples, len(errors))
 
-                        with lock:
-                            if not out_file.exists():
-                                with open(out_file, "a", encoding="utf-8", newline="") as out:
-                                    out_writer = csv.writer(out)
-                                    out_writer.writerow(
-                                        ["subject", "value", "format"])
-                                    out_writer.writerow([subject, value, form])
-                            else:
-                                with open(out_file, "a", encoding="utf-8", newline="") as out:
-                                    out_writer = csv.writer(out)
-                                    out_writer.writerow([subject, value, form])
+    out_path = cache.commit_artifact(
+        "properties", key, {"lang": lang_code, "category": use_category, "version": version, "cat_depth": cat_depth,
+                            "subjects": None if subjects is None else len(subjects)})
 
-                        all_props.add(prop)
-                except Exception as e:
-                    err_file = out_folder / "_err.log"
-                    lock_file = out_folder / "_err.log.lock"
-                    lock = FileLock(str(lock_file))
+    return StringArray(out_path / PROPERTIES_FILE), out_path
 
-                    with lock:
-                        with open(err_file, "a", encoding="utf-8") as err_f:
-                            err_f.write(line + " || Error: " + str(e) + "\n")
-                pbar.update(len(line.encode("utf-8")))
 
-    return all_props
-
-
-def _get_chunks(file: Path, out: Path) -> list:
-    """split a file into smaller chunks for multiprocessing"""
-    # multiprocessing code adapted from https://nurdabolatov.com/parallel-processing-large-file-in-python
-
-    cpus = mp.cpu_count()
-    fsize = os.path.getsize(file)
-    chunk_size = fsize // cpus
-
-    chunk_args = []
-
-    with open(file, "r", encoding="utf-8") as f:
+@metrics.worker("extract_properties")
+def _extract_properties(file: Path, chunk_start: int, chunk_end: int, filtr: Optional[set]) -> Tuple[dict, dict, int]:
+    """
+    extracts the properties from a chunk of an rdf file. Returns the rows and statistics of every property
+    and the number of triples read, lines that can not be parsed are reported to diagnostics
+    """
+    prop_rows = {}
+    prop_stats = {}
+    num_triples = 0
 
-        def is_start_of_line(pos):
-            if pos == 0:
-                return True
+    # the subject is parsed and filtered once for all triples of a block
+    for subject, block in iter_subject_blocks(file, chunk_start, chunk_end, filtr):
+        lines = get_block_lines(block)
+        num_triples += len(lines)
 
-            f.seek(pos - 1)
+        for line in lines:
             try:
-                return f.read(1) == "\n"
-            except UnicodeDecodeError:
-                return False
-
-        def get_next_line_position(pos):
-            f.seek(pos)
-            f.readline()
-            return f.tell()
-
-        chunk_start = 0
+                content = line.split("> ", 2)
+                prop = extract_prop_name(content[1])
+                value, form = extract_value(content[2])
+            except Exception as e:
+                diagnostics.error(type(e).__name__, line + " || Error: " + str(e))
+                continue
 
-        while chunk_start < fsize:
-            chunk_end = min(fsize, chunk_start + chunk_size)
+            # numbers and dates are also stored parsed, so that the matching does not depend on how they are written
+            typed = parse_typed_value(value, form)
+            prop_rows.setdefault(prop, []).append((subject, value, form, "" if typed is None else repr(typed)))
+            if prop not in prop_stats:
+                prop_stats[prop] = catalog.PropertyStats()
+            prop_stats[prop].add(subject, value, form)
 
-            while not is_start_of_line(chunk_end):
-                chunk_end -= 1
+    metrics.count("bytes_read", chunk_end - chunk_start)
+    metrics.count("triples", num_triples)
 
-            if chunk_start == chunk_end:
-                chunk_end = get_next_line_position(chunk_end)
+    for stats in prop_stats.values():
+        stats.compact()
 
-            size = chunk_end - chunk_start
+    return prop_rows, prop_stats, num_triples
 
-            args = (file, chunk_start, chunk_end, size, out)
-            chunk_args.append(args)
 
-            chunk_start = chunk_end
+def get_property_sizes(prop_dir: Path) -> dict:
+    """returns the number of entities of every property in an extraction folder from its statistics catalog"""
+    prop_catalog = catalog.get_catalog(prop_dir)
 
-    return chunk_args
+    return {prop: stats["rows"] for prop, stats in prop_catalog["properties"].items()}
 
 
 def _check_dir_exists(path):
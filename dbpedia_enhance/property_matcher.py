@@ -1,44 +1,277 @@
-import multiprocessing as mp
 from data.utils import DATA_FOLDER
+from data import cache
 import csv
-from typing import Any, Optional
+import bisect
+import heapq
+import itertools
+import json
+import math
+import shutil
+import tempfile
+import time
+from collections import Counter, deque
+from pathlib import Path
+from typing import Any, Callable, Generator, Iterable, Iterator, Optional, Tuple
 from tqdm.auto import tqdm
 from .translate_entity import translate_entity
+from .property_extractor import get_property_sizes, PROPERTY_HEADER
+from .string_array import StringArray
+from .overlap import PropertyOverlap, read_overlap, read_checkpoint, write_checkpoint, OVERLAP_FILE, CHECKPOINT_FILE
+from . import metrics, executor, sort_merge, string_array, catalog
 import re
 
 SPECIAL_PROPERTIES = ["url", "x", "y", "image"]
 
+# increase this whenever the matching logic changes, so that cached matches are regenerated
+MATCHER_VERSION = "4"
+
+# type signature of properties whose value types are unknown, which is compatible with every other signature
+ALL_TYPES = (1 << len(catalog.TYPE_CLASSES)) - 1
+
+BEST_MATCHES_FILE = "best_matches.csv"
+
+# number of translated target properties that are compared at once when matching runs alongside the translation
+MATCH_BATCH_SIZE = 50
+
+# number of batches of target properties that are compared at the same time, before the oldest one has to finish
+MAX_PENDING_BATCHES = 4
+
+
+class TimeBudget:
+    """
+    limits the time of the entity matching. Target properties are only taken from an iterable until the given number
+    of seconds has passed since the budget was created, comparisons that already started are still finished
+    """
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.start = time.monotonic()
+        self.expired = False
+
+    def take(self, items: Iterable) -> Iterator:
+        """yields the items until the budget is used up, expired tells if items were left over"""
+        for item in items:
+            if time.monotonic() - self.start >= self.seconds:
+                self.expired = True
+                return
+            yield item
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.start
+
+
+def find_matches(src_props: set, trg_props: set, src_lang: str, trg_lang: str, src_dir: Path, trg_dir: Path, suffix: Optional[str] = None, force: Optional[bool] = False, max_memory: Optional[int] = None, tolerance: float = 0.0, budget: Optional[TimeBudget] = None) -> list:
+    """
+    finds all matching properties between two languages.
+    The property lists are read from the given extraction folders. Results are cached for each pair of folders,
+    the matches are additionally written to a csv file in the data folder.
+    With max_memory (in bytes) the entities are matched with an external sort instead of being kept in memory.
+    Numbers whose difference is at most tolerance relative to the larger one are counted as equal values.
+    With a budget the largest target properties are matched first and the matching stops when the budget is used up,
+    the matches of the compared properties are written to the output file and the next run continues with the others
+    """
+    results = iter_matches(src_props, trg_props, src_lang, trg_lang, src_dir, trg_dir, suffix, force, max_memory, tolerance, budget)
+
+    while True:
+        try:
+            next(results)
+        except StopIteration as stop:
+            return stop.value
+
+
+def iter_matches(src_props: set, trg_props: set, src_lang: str, trg_lang: str, src_dir: Path, trg_dir: Path, suffix: Optional[str] = None, force: Optional[bool] = False, max_memory: Optional[int] = None, tolerance: float = 0.0, budget: Optional[TimeBudget] = None) -> Generator[Tuple[str, dict], None, list]:
+    """
+    like find_matches, but yields (target property, {source property: equal entities}) as soon as all comparisons
+    of a target property are done and returns the matches at the end. Finished target properties are written to a
+    checkpoint in the cache first, so an interrupted run continues after them instead of translating and comparing them again.
+    Cached matches are returned without yielding, the external sort yields all target properties at its end
+    """
+    out_file = get_matches_file(src_lang, trg_lang, suffix)
+    mode = get_match_mode(max_memory, tolerance)
+    _check_budget(max_memory, budget)
+
+    if not force:
+        matches = get_cached_matches(src_dir, trg_dir, out_file, mode)
+        if matches is not None:
+            return matches
+
+    src_props, trg_props, matches = prepare_matching(src_props, trg_props)
+
+    trg_order = order_by_size(trg_props, get_property_sizes(trg_dir))
+
+    print("### finding entity matches")
+    failed = set()
+
+    if max_memory is not None:
+        trg_items = translate_properties(
+            trg_order, trg_lang, src_lang, trg_dir, failed=failed)
+        overlap = find_entity_matches_external(
+            list(src_props), trg_items, src_dir, max_memory)
+        yield from sorted(overlap.get_targets().items())
+    else:
+        checkpoint = get_checkpoint(src_dir, trg_dir, mode, force)
+        finished = get_checkpointed_properties(checkpoint)
+        trg_items = translate_properties(
+            trg_order, trg_lang, src_lang, trg_dir, lambda prop: prop in finished, failed)
+        if budget is not None:
+            trg_items = budget.take(trg_items)
+        overlap = yield from iter_entity_overlap(
+            list(src_props), trg_items, src_dir, checkpoint, tolerance=tolerance)
+    _print_entity_matches(overlap)
+
+    matches.extend(overlap.get_matches())
+
+    save_matches(matches, src_props, trg_props, src_lang,
+                 trg_lang, src_dir, trg_dir, out_file, mode, overlap, budget, failed)
+
+    return matches
+
+
+def get_matches_file(src_lang: str, trg_lang: str, suffix: Optional[str] = None) -> Path:
+    """returns the path of the csv file in the data folder the matches between two languages are written to"""
+    out_name = f"{src_lang}_{trg_lang}"
+
+    if suffix is not None:
+        out_name = out_name + "_" + suffix
+
+    return DATA_FOLDER / f"{out_name}_matches.csv"
+
+
+def get_best_matches_file(out_file: Path) -> Path:
+    """returns the path of the csv file with the best matches of both directions that belongs to a matches file"""
+    return out_file.with_name(out_file.name.replace("_matches.csv", "_best_matches.csv"))
+
+
+def get_match_mode(max_memory: Optional[int] = None, tolerance: float = 0.0) -> Optional[str]:
+    """returns the mode of the entity matching, which is part of the cache key of the matches"""
+    if not 0 <= tolerance < 1:
+        raise ValueError(f"value tolerance {tolerance} has to be at least 0 and smaller than 1")
+    if max_memory is not None:
+        # the external sort only joins equal values, so the tolerance does not change its matches
+        return "external"
+    if tolerance > 0:
+        return f"tolerance={tolerance}"
+    return None
+
+
+def get_cached_matches(src_dir: Path, trg_dir: Path, out_file: Path, mode: Optional[str] = None) -> Optional[list]:
+    """returns the cached matches between two extraction folders and copies them to the output file. Returns None if they were not computed yet"""
+    cache_path = cache.get_artifact(_get_cache_key(src_dir, trg_dir, mode))
+
+    if cache_path is None:
+        return None
 
-def find_matches(src_props: set, trg_props: set, src_lang: str, trg_lang: str, suffix: Optional[str] = None) -> list:
-    """finds all matching properties between two languages"""
     matches = []
-    src_props = clean_prop_list(src_props)
-    trg_props = clean_prop_list(trg_props)
+    with open(cache_path / "matches.csv", "r", newline="", encoding="utf-8") as csvfile:
+        csvreader = csv.reader(csvfile)
+        next(csvreader, None)
+        for row in csvreader:
+            if row[0] != "" and row[1] != "":
+                matches.append((row[0], row[1]))
+
+    shutil.copyfile(cache_path / "matches.csv", out_file)
+    if (cache_path / BEST_MATCHES_FILE).exists():
+        shutil.copyfile(cache_path / BEST_MATCHES_FILE, get_best_matches_file(out_file))
+
+    return matches
+
+
+def get_checkpoint(src_dir: Path, trg_dir: Path, mode: Optional[str] = None, force: Optional[bool] = False) -> Path:
+    """
+    returns the checkpoint file of the entity matching between two extraction folders. It is kept in the unfinished
+    cache folder of the matches until they are saved, with force an earlier checkpoint is removed
+    """
+    key = _get_cache_key(src_dir, trg_dir, mode)
+    folder = cache.new_artifact("matches", key) if force else cache.resume_artifact("matches", key)
+
+    return folder / CHECKPOINT_FILE
+
+
+def get_checkpointed_properties(checkpoint: Path) -> set:
+    """returns the target properties that are finished in a checkpoint"""
+    return set(read_checkpoint(checkpoint).keys())
+
+
+def get_cached_overlap(src_dir: Path, trg_dir: Path, mode: Optional[str] = None) -> Optional[PropertyOverlap]:
+    """returns the equal entity counts of all property pairs of cached matches, None if they were not computed yet"""
+    cache_path = cache.get_artifact(_get_cache_key(src_dir, trg_dir, mode))
+
+    if cache_path is None or not (cache_path / OVERLAP_FILE).exists():
+        return None
+
+    return read_overlap(cache_path / OVERLAP_FILE)
+
+
+def prepare_matching(src_props: set, trg_props: set) -> Tuple[set, set, list]:
+    """
+    cleans both property sets and finds the direct matches.
+    Returns the cleaned sets, where direct matches are removed from the target set, and the direct matches
+    """
+    matches = []
     print("### finding direct matches")
-    direct_matches = find_direct_matches(src_props, trg_props)
+    direct_matches = clean_prop_list(find_direct_matches(src_props, trg_props))
     print(f"### {len(direct_matches)} found")
+    src_props = clean_prop_list(src_props)
+    trg_props = clean_prop_list(trg_props)
 
     # remove all direct matches from target set to make it smaller
     for match in direct_matches:
         matches.append((match, match))
         trg_props.discard(match)
 
-    print("### finding entity matches")
-    entity_matches = find_entity_matches(
-        list(src_props), list(trg_props), src_lang, trg_lang, suffix)
-    print(f"### {len(entity_matches)} enitity matches found")
+    return src_props, trg_props, matches
 
-    for match in entity_matches:
-        matches.append(match)
-        src_props.discard(match[0])
-        trg_props.discard(match[1])
 
-    out_name = f"{src_lang}_{trg_lang}"
+def save_matches(matches: list, src_props: set, trg_props: set, src_lang: str, trg_lang: str, src_dir: Path, trg_dir: Path, out_file: Path, mode: Optional[str] = None, overlap: Optional[PropertyOverlap] = None,
+                 budget: Optional[TimeBudget] = None, failed: Optional[set] = None) -> None:
+    """
+    writes all matches together with the unmatched properties of both languages to the cache and the output file.
+    The overlap of the entity matching is cached as well and its best matches of both directions are written next to the output file.
+    With a budget the covered share of the target properties is written next to the output file as well. If the budget
+    was used up or target properties in failed could not be translated, the matches are incomplete and only written
+    to the output file, the checkpoint stays in the cache so the next run compares the missing properties
+    """
+    if budget is not None:
+        save_coverage(overlap, trg_props, trg_dir, budget, get_coverage_file(out_file))
 
-    if suffix is not None:
-        out_name = out_name + "_" + suffix
+    if failed:
+        print(f"### {len(failed)} target properties could not be translated, the matches are not cached")
+
+    if (budget is not None and budget.expired) or failed:
+        # target properties that were not compared yet are left out instead of being listed as unmatched
+        compared = set(overlap.trg_sizes) if overlap is not None else set(trg_props) - set(failed or ())
+        _write_matches(out_file, matches, src_props, compared)
+        if overlap is not None:
+            overlap.write_best(get_best_matches_file(out_file))
+        return
+
+    key = _get_cache_key(src_dir, trg_dir, mode)
+
+    # the folder can contain the checkpoint of the entity matching, which is not needed anymore once the matches are saved
+    cache_path = cache.resume_artifact("matches", key)
+    (cache_path / CHECKPOINT_FILE).unlink(missing_ok=True)
 
-    out_file = DATA_FOLDER / f"{out_name}_matches.csv"
+    _write_matches(cache_path / "matches.csv", matches, src_props, trg_props)
+
+    if overlap is not None:
+        overlap.write(cache_path / OVERLAP_FILE)
+        overlap.write_best(cache_path / BEST_MATCHES_FILE)
+
+    cache_path = cache.commit_artifact("matches", key, {
+                                       "src_lang": src_lang, "trg_lang": trg_lang, "src": src_dir.name, "trg": trg_dir.name})
+
+    shutil.copyfile(cache_path / "matches.csv", out_file)
+    if overlap is not None:
+        shutil.copyfile(cache_path / BEST_MATCHES_FILE, get_best_matches_file(out_file))
+
+
+def _write_matches(out_file: Path, matches: list, src_props: set, trg_props: set) -> None:
+    src_props = set(src_props)
+    trg_props = set(trg_props)
+
+    for match in matches:
+        src_props.discard(match[0])
+        trg_props.discard(match[1])
 
     with open(out_file, "w", encoding="utf-8", newline="") as out:
         out_writer = csv.writer(out)
@@ -53,221 +286,662 @@ def find_matches(src_props: set, trg_props: set, src_lang: str, trg_lang: str, s
         for prop in trg_props:
             out_writer.writerow(["", prop])
 
-    return matches
 
+def get_coverage_file(out_file: Path) -> Path:
+    """returns the path of the json file with the covered share of the target properties that belongs to a matches file"""
+    return out_file.with_name(out_file.name.replace("_matches.csv", "_coverage.json"))
 
-def find_direct_matches(src_props: set, trg_props: set) -> set:
-    """ find all properties in two sets where the property names are equal"""
-    return set.intersection(src_props, trg_props)
+
+def get_coverage(overlap: Optional[PropertyOverlap], trg_props: set, trg_dir: Path) -> dict:
+    """
+    returns the number of target properties and entities that were compared with all source properties.
+    The entities of the extraction are the property mass, every compared target property covers all pairs with the
+    source properties, so the covered share of the target entities is the covered share of all property pairs
+    """
+    trg_sizes = get_property_sizes(trg_dir)
+    compared = set(overlap.trg_sizes) if overlap is not None else set()
+
+    total = sum(trg_sizes.get(prop, 0) for prop in trg_props)
+    covered = sum(trg_sizes.get(prop, 0) for prop in trg_props if prop in compared)
+
+    return {
+        "target_properties": len(trg_props),
+        "compared_properties": len(compared & set(trg_props)),
+        "entities": total,
+        "covered_entities": covered,
+        "coverage": round(covered / total, 4) if total > 0 else 1.0
+    }
 
 
-def find_entity_matches(src_props: list, trg_props: list, src_lang: str, trg_lang: str, suffix: Optional[str] = None) -> set:
-    """finds all occurences where an entity of the source language matches an entity in the target language"""
+def save_coverage(overlap: Optional[PropertyOverlap], trg_props: set, trg_dir: Path, budget: TimeBudget, out_file: Path) -> dict:
+    """prints the coverage of a matching with a time budget and writes it to a json file"""
+    coverage = get_coverage(overlap, trg_props, trg_dir)
+    coverage.update({"finished": not budget.expired, "budget_seconds": budget.seconds,
+                     "seconds": round(budget.elapsed(), 1)})
 
-    num_splits = mp.cpu_count()
+    if budget.expired:
+        print(f"### time budget used up, {coverage['compared_properties']} of {coverage['target_properties']} target properties "
+              f"compared, which cover {round(100 * coverage['coverage'], 1)}% of the target entities")
+    else:
+        print(f"### all {coverage['target_properties']} target properties compared within the time budget")
 
-    src_splits = _split_list_equal(src_props, num_splits)
-    trg_splits = _split_list_equal(trg_props, num_splits)
+    metrics.count("covered_entities", coverage["covered_entities"])
 
-    all_matches = []
+    with open(out_file, "w", encoding="utf-8") as out:
+        json.dump(coverage, out, indent=2)
+
+    return coverage
+
+
+def order_by_size(props: Iterable, sizes: dict) -> list:
+    """returns the properties ordered by their number of entities, starting with the largest"""
+    return sorted(props, key=lambda prop: (-sizes.get(prop, 0), prop))
+
+
+def _check_budget(max_memory: Optional[int], budget: Optional[TimeBudget]) -> None:
+    if max_memory is not None and budget is not None:
+        # the external sort joins all properties at once at its end, so it can not stop after the largest ones
+        raise ValueError("a time budget can not be used together with max_memory")
+
+
+def _get_cache_key(src_dir: Path, trg_dir: Path, mode: Optional[str] = None) -> str:
+    if mode is None:
+        return cache.get_key("matches", src=src_dir.name, trg=trg_dir.name, matcher=MATCHER_VERSION)
+    return cache.get_key("matches", src=src_dir.name, trg=trg_dir.name, matcher=MATCHER_VERSION, mode=mode)
+
+
+def find_direct_matches(src_props: Iterable, trg_props: Iterable) -> set:
+    """ find all properties in two sets where the property names are equal"""
+    if isinstance(src_props, StringArray) and isinstance(trg_props, StringArray):
+        # both arrays are sorted, so they are intersected by merging them without loading them into sets
+        return set(string_array.intersect(src_props, trg_props))
+    return set.intersection(set(src_props), set(trg_props))
+
+
+def find_entity_matches(src_props: list, trg_props: list, src_lang: str, trg_lang: str, src_dir: Path, trg_dir: Path, tolerance: float = 0.0) -> PropertyOverlap:
+    """
+    finds all occurences where an entity of the source language matches an entity in the target language.
+    Returns the number of equal entities of every pair of properties, from which the matches of both directions are taken
+    """
+
+    src_sizes = get_property_sizes(src_dir)
+    src_signatures = catalog.get_signatures(src_dir)
+    trg_splits = _split_list_equal(trg_props, executor.get_workers())
+
+    overlap = PropertyOverlap(src_sizes)
+    num_pruned = 0
 
     for trg_split in trg_splits:
-        split_args = []
-        trg_dict = _get_split_dict(trg_split, trg_lang, src_lang, suffix)
-        for idx, src_split in enumerate(src_splits):
-            split_args.append((src_split, trg_dict, src_lang, idx+1, suffix))
+        trg_dict = _get_split_dict(trg_split, trg_lang, src_lang, trg_dir)
+        overlap.trg_sizes.update(_get_sizes(trg_dict))
+        submitted, pruned = _submit_blocks(
+            src_props, src_sizes, src_signatures, trg_dict, src_dir, executor.get_num_tasks(), tolerance)
+        _collect_overlap(submitted, overlap)
+        num_pruned += pruned
+
+    _print_pruned(num_pruned, len(src_props) * len(trg_props))
+
+    return overlap
+
+
+def find_entity_matches_streamed(src_props: list, trg_items: Iterable, src_dir: Path, batch_size: int = MATCH_BATCH_SIZE, tolerance: float = 0.0, checkpoint: Optional[Path] = None) -> PropertyOverlap:
+    """
+    finds all occurences where an entity of the source language matches an entity in the target language,
+    while the translated target properties are still being produced.
+    Every batch of target properties is compared against all source properties as soon as it is complete
+    """
+    results = iter_entity_overlap(src_props, trg_items, src_dir, checkpoint, batch_size, tolerance)
+
+    while True:
+        try:
+            next(results)
+        except StopIteration as stop:
+            return stop.value
+
+
+def iter_entity_overlap(src_props: list, trg_items: Iterable, src_dir: Path, checkpoint: Optional[Path] = None, batch_size: int = MATCH_BATCH_SIZE, tolerance: float = 0.0) -> Generator[Tuple[str, dict], None, PropertyOverlap]:
+    """
+    compares batches of translated target properties with all source properties like find_entity_matches_streamed and
+    yields (target property, {source property: equal entities}) as soon as a batch is done. Returns the overlap of all of them.
+    With a checkpoint every finished batch is written to it before it is yielded. Target properties that are already
+    in the checkpoint are yielded first and skipped when they are produced again
+    """
+    src_sizes = get_property_sizes(src_dir)
+    src_signatures = catalog.get_signatures(src_dir)
+    # the largest source properties are scheduled first, so their comparisons of a batch finish early
+    src_props = order_by_size(src_props, src_sizes)
+
+    overlap = PropertyOverlap(src_sizes)
+    finished = {}
+
+    if checkpoint is not None:
+        finished = read_checkpoint(checkpoint)
+        # the counts of a batch that was interrupted while it was written are dropped
+        write_checkpoint(checkpoint, finished, append=False)
+        if len(finished) > 0:
+            print(f"### continuing the matching after {len(finished)} finished target properties")
+
+    for trg_prop, (size, counts) in finished.items():
+        overlap.add_target(trg_prop, size, counts)
+        yield trg_prop, counts
+
+    pending = deque()
+    num_pruned = 0
+    num_trg = 0
+
+    with tqdm(total=0, desc="matching") as pbar:
+        batches = _iter_batches(((prop, entities) for prop, entities in trg_items if prop not in finished), batch_size)
+
+        for batch in itertools.chain(batches, [None]):
+            if batch is not None:
+                num_trg += len(batch)
+                submitted, pruned = _submit_blocks(
+                    src_props, src_sizes, src_signatures, batch, src_dir, executor.get_workers(), tolerance)
+                num_pruned += pruned
+                pbar.total += sum(cost for cost, _ in submitted)
+                pbar.refresh()
+                pending.append((_get_sizes(batch), submitted))
+
+            # finished batches are checkpointed and yielded right away, oldest first. Older batches are waited for when
+            # too many are pending, so that only a few batches of translated entities are held at once
+            while len(pending) > 0 and (len(pending) > (MAX_PENDING_BATCHES if batch is not None else 0)
+                                        or all(result.ready() for _, result in pending[0][1])):
+                sizes, submitted = pending.popleft()
+                counts = {trg_prop: {} for trg_prop in sizes}
+                for cost, result in submitted:
+                    for src_prop, trg_prop, count in result.get():
+                        counts[trg_prop][src_prop] = counts[trg_prop].get(src_prop, 0) + count
+                    pbar.update(cost)
+
+                targets = {trg_prop: (size, counts[trg_prop]) for trg_prop, size in sizes.items()}
+                if checkpoint is not None:
+                    write_checkpoint(checkpoint, targets)
+
+                for trg_prop, (size, trg_counts) in targets.items():
+                    overlap.add_target(trg_prop, size, trg_counts)
+                    yield trg_prop, trg_counts
+
+    _print_pruned(num_pruned, len(src_props) * num_trg)
+
+    return overlap
+
+
+def _iter_batches(trg_items: Iterable, batch_size: int) -> Iterator[dict]:
+    batch = {}
+    for prop, entities in trg_items:
+        batch[prop] = entities
+        if len(batch) == batch_size:
+            yield batch
+            batch = {}
+
+    if len(batch) > 0:
+        yield batch
+
+
+def find_entity_matches_translated(src_props: list, trg_items: Iterable, src_dir: Path, max_memory: Optional[int] = None, tolerance: float = 0.0, checkpoint: Optional[Path] = None,
+                                   budget: Optional[TimeBudget] = None) -> PropertyOverlap:
+    """
+    matches the source properties against translated target properties, with an external sort if max_memory (in bytes) is set.
+    The tolerance of numeric values, the checkpoint and the time budget only apply without the external sort
+    """
+    _check_budget(max_memory, budget)
+    if budget is not None:
+        trg_items = budget.take(trg_items)
+
+    print("### finding entity matches")
+    if max_memory is not None:
+        overlap = find_entity_matches_external(
+            src_props, trg_items, src_dir, max_memory)
+    else:
+        overlap = find_entity_matches_streamed(
+            src_props, trg_items, src_dir, tolerance=tolerance, checkpoint=checkpoint)
+    _print_entity_matches(overlap)
 
-        tqdm.set_lock(mp.RLock())
-        with mp.Pool(processes=mp.cpu_count(), initializer=tqdm.set_lock, initargs=(tqdm.get_lock(),)) as pool:
-            all_match_list = pool.starmap(_find_entity_matches, split_args)
+    return overlap
 
-        for match_list in all_match_list:
-            all_matches.extend(match_list)
 
-    return all_matches
+def _print_entity_matches(overlap: PropertyOverlap) -> None:
+    print(f"### {len(overlap.get_matches())} enitity matches found, {len(overlap.get_best('target'))} target properties "
+          f"have a best source property, {len(overlap.get_mutual())} matches are mutual")
 
 
-def find_single_entity_match(src_props: list, trg_ent: str, src_lang: str, trg_lang: str, suffix: Optional[str] = None) -> set:
+def find_single_entity_match(src_props: list, trg_ent: str, src_lang: str, trg_lang: str, src_dir: Path, trg_dir: Path, tolerance: float = 0.0) -> list:
     """finds all occurences where an entity of the source language matches an entity in the target language for a single entity"""
 
-    num_splits = mp.cpu_count()
+    src_sizes = get_property_sizes(src_dir)
+    trg_dict = _get_split_dict([trg_ent], trg_lang, src_lang, trg_dir)
+    submitted, _ = _submit_blocks(src_props, src_sizes, catalog.get_signatures(src_dir),
+                                  trg_dict, src_dir, executor.get_num_tasks(), tolerance)
 
-    src_splits = _split_list_equal(src_props, num_splits)
+    return _collect_overlap(submitted, PropertyOverlap(src_sizes, _get_sizes(trg_dict))).get_matches()
 
-    all_matches = []
 
-    split_args = []
-    trg_dict = _get_split_dict([trg_ent], trg_lang, src_lang, suffix)
-    for idx, src_split in enumerate(src_splits):
-        split_args.append((src_split, trg_dict, src_lang, idx+1, suffix))
+def find_entity_matches_external(src_props: list, trg_items: Iterable, src_dir: Path, max_memory: int) -> PropertyOverlap:
+    """
+    finds all occurences where an entity of the source language matches an entity in the target language with a bounded memory.
+    The (subject, value) pairs of both languages are written to sorted runs on disk of at most max_memory bytes, a merge join
+    then counts the equal pairs of every property pair, like the comparison of the other modes
+    """
+    src_sizes = get_property_sizes(src_dir)
+    trg_order = []
+    trg_sizes = []
 
-    tqdm.set_lock(mp.RLock())
-    with mp.Pool(processes=mp.cpu_count(), initializer=tqdm.set_lock, initargs=(tqdm.get_lock(),)) as pool:
-        all_match_list = pool.starmap(_find_entity_matches, split_args)
+    with tempfile.TemporaryDirectory(dir=DATA_FOLDER) as tmp:
+        keys = sort_merge.RunWriter(Path(tmp), max_memory, "keys")
 
-    for match_list in all_match_list:
-        all_matches.extend(match_list)
+        for src_property in tqdm(src_props, desc="sorting source entities"):
+            try:
+                with open(src_dir / f"{src_property}.csv", "r", newline="", encoding="utf-8") as csv_src_file:
+                    csv_src_reader = csv.reader(csv_src_file)
+                    next(csv_src_reader, None)
+                    for row in csv_src_reader:
+                        keys.add((row[0], _get_value_key(row), "s", src_property))
+            except Exception as e:
+                print(str(e))
 
-    return all_matches
+        for prop, entities in trg_items:
+            for entity in entities:
+                keys.add((entity[0], _get_value_key(entity), "t", str(len(trg_order))))
+            trg_order.append(prop)
+            trg_sizes.append(len(entities))
 
+        # every group of equal (subject, value) pairs adds the product of its occurences to all property pairs in it
+        pairs = sort_merge.RunWriter(Path(tmp), max_memory, "pairs")
 
-def _get_split_dict(prop_list: list, trg_lang: str, src_lang: str, suffix: Optional[str] = None) -> dict:
+        for _, rows in sort_merge.group_rows(keys.merged(), 2):
+            src_counts = Counter()
+            trg_counts = Counter()
+            for row in rows:
+                (src_counts if row[2] == "s" else trg_counts)[row[3]] += 1
 
-    path_name = trg_lang
+            for src_property, src_count in src_counts.items():
+                for trg_idx, trg_count in trg_counts.items():
+                    pairs.add((src_property, trg_idx, str(src_count * trg_count)))
 
-    if suffix is not None:
-        path_name = path_name + "_" + suffix
+        overlap = PropertyOverlap(src_sizes, dict(zip(trg_order, trg_sizes)))
 
-    prop_path = DATA_FOLDER / path_name
+        for src_property, pair_rows in sort_merge.group_rows(pairs.merged(), 1):
+            for (trg_idx,), rows in sort_merge.group_rows((row[1:] for row in pair_rows), 1):
+                overlap.add(src_property[0], trg_order[int(trg_idx)], sum(int(row[1]) for row in rows))
 
-    size = len(prop_list)
+    return overlap
+
+
+def _get_value_key(entity: list) -> str:
+    """
+    returns the value an entity is joined on in the external sort, numbers and dates are joined on their parsed value.
+    The type class is part of the key, so only values of the same class are equal like in the other modes
+    """
+    if len(entity) > 3 and entity[3] != "":
+        return f"#{catalog.get_type_class(entity[2])}:{entity[3]}"
+    return f"{catalog.get_type_class(entity[2])}:{entity[1]}"
+
+
+def schedule_comparisons(src_props: list, src_sizes: dict, trg_lang_props: dict, num_tasks: int) -> list:
+    """
+    groups the comparisons of source properties against translated target properties into tasks of similar cost.
+    The cost of a source property is estimated as its number of entities times the number of target entities.
+    Properties are assigned to the cheapest task starting with the most expensive one, a source property that costs
+    more than an average task is split into sub-tasks over the target properties instead.
+    Returns (cost, source properties, target properties, split property) tuples ordered by decreasing cost
+    """
+    trg_items = list(trg_lang_props.items())
+    trg_size = max(1, sum(len(entities) for _, entities in trg_items))
+
+    costs = {prop: max(1, src_sizes.get(prop, 1)) * trg_size for prop in src_props}
+    avg_cost = sum(costs.values()) / max(1, num_tasks)
+
+    tasks = []
+    bins = [(0, idx, []) for idx in range(num_tasks)]
+
+    for prop in sorted(src_props, key=lambda p: (-costs[p], p)):
+        num_parts = min(len(trg_items), math.ceil(costs[prop] / avg_cost))
+
+        if num_parts > 1:
+            for trg_part in _split_items_by_size(trg_items, num_parts):
+                part_cost = costs[prop] * sum(len(ents) for _, ents in trg_part) // trg_size
+                tasks.append((part_cost, [prop], [p for p, _ in trg_part], prop))
+            continue
+
+        cost, idx, props = heapq.heappop(bins)
+        props.append(prop)
+        heapq.heappush(bins, (cost + costs[prop], idx, props))
+
+    tasks.extend((cost, props, None, None)
+                 for cost, _, props in bins if len(props) > 0)
+    tasks.sort(key=lambda task: task[0], reverse=True)
+
+    return tasks
+
+
+def partition_by_signature(src_props: list, src_signatures: dict, trg_lang_props: dict) -> Tuple[list, int]:
+    """
+    groups the source properties by their type signature and pairs every group with the target properties that share
+    a type class with it, as properties without a common value type can not have equal values.
+    Returns the (source properties, target properties) blocks and the number of pruned comparisons
+    """
+    trg_masks = {prop: catalog.get_signature_mask(catalog.get_signature({entity[2] for entity in entities}))
+                 for prop, entities in trg_lang_props.items()}
+
+    groups = {}
+    for prop in src_props:
+        # properties without a signature are compared with all target properties
+        groups.setdefault(src_signatures.get(prop, ALL_TYPES), []).append(prop)
+
+    blocks = []
+    num_pruned = 0
+
+    for mask, props in groups.items():
+        trg_dict = {prop: entities for prop, entities in trg_lang_props.items() if trg_masks[prop] & mask}
+        num_pruned += len(props) * (len(trg_lang_props) - len(trg_dict))
+        if len(trg_dict) > 0:
+            blocks.append((props, trg_dict))
+
+    return blocks, num_pruned
+
+
+def _submit_blocks(src_props: list, src_sizes: dict, src_signatures: dict, trg_lang_props: dict, src_dir: Path, num_tasks: int, tolerance: float = 0.0) -> Tuple[list, int]:
+    """schedules and starts the comparisons of every type compatible block, returns the submitted tasks and the number of pruned comparisons"""
+    blocks, num_pruned = partition_by_signature(
+        src_props, src_signatures, trg_lang_props)
+
+    submitted = []
+    for block_props, trg_dict in blocks:
+        tasks = schedule_comparisons(
+            block_props, src_sizes, trg_dict, num_tasks)
+        submitted.extend(_submit_comparisons(tasks, trg_dict, src_dir, tolerance))
 
-    prop_dict = {}
+    metrics.count("pruned_comparisons", num_pruned)
+
+    return submitted, num_pruned
+
+
+def _print_pruned(num_pruned: int, num_pairs: int) -> None:
+    if num_pairs > 0:
+        print(f"### {num_pruned} of {num_pairs} property comparisons pruned by value type ({round(100 * num_pruned / num_pairs, 1)}%)")
+
+
+def _submit_comparisons(tasks: list, trg_lang_props: dict, src_dir: Path, tolerance: float = 0.0) -> list:
+    """starts the tasks in the given order and returns (cost, result) tuples"""
+    submitted = []
+    for cost, src_split, trg_part, _ in tasks:
+        trg_dict = trg_lang_props if trg_part is None else {
+            prop: trg_lang_props[prop] for prop in trg_part}
+        result = executor.apply_async(
+            _find_entity_overlap, (src_split, trg_dict, src_dir, tolerance))
+        submitted.append((cost, result))
+
+    return submitted
+
+
+def _collect_overlap(submitted: list, overlap: PropertyOverlap) -> PropertyOverlap:
+    """
+    waits for all submitted tasks and adds their counts to the overlap. The sub-tasks of a split property count
+    different target properties, so their results are simply added
+    """
+    with tqdm(total=sum(cost for cost, _ in submitted), desc="matching") as pbar:
+        for cost, result in submitted:
+            overlap.update(result.get())
+            pbar.update(cost)
+
+    return overlap
+
+
+def _get_sizes(trg_lang_props: dict) -> dict:
+    return {prop: len(entities) for prop, entities in trg_lang_props.items()}
+
+
+def _get_split_dict(prop_list: list, trg_lang: str, src_lang: str, prop_path: Path) -> dict:
+    return dict(translate_properties(prop_list, trg_lang, src_lang, prop_path))
+
+
+def translate_properties(prop_list: list, trg_lang: str, src_lang: str, prop_path: Path, skip: Optional[Callable] = None, failed: Optional[set] = None) -> Iterator[Tuple[str, list]]:
+    """
+    translates the subjects and instance values of target properties into the source language.
+    Yields every property together with its translated entities as soon as it is done. Properties for which skip returns True are left out,
+    properties that can not be translated are left out as well and added to failed
+    """
+    size = len(prop_list)
 
     with tqdm(total=size) as pbar:
         for prop in prop_list:
-            trg_entities = []
-
             pbar.update(1)
-            try:
-                with open(prop_path / f"{prop}.csv", "r", newline="", encoding="utf-8") as csv_trg_file:
-                    csv_trg_reader = csv.reader(csv_trg_file)
-
-                    # skip first row with headers
-                    next(csv_trg_reader, None)
-                    val_list = []
-                    subj_list = []
-                    form_list = []
-                    for row in csv_trg_reader:
-                        subj_list.append(row[0])
-                        val_list.append(row[1])
-                        form_list.append(row[2])
-
-                        if len(subj_list) == 40:
-
-                            subj_trans = translate_entity(
-                                subj_list, trg_lang, [src_lang])
-
-                            for idx, subj in enumerate(subj_trans):
-                                trans = subj.get(src_lang)
-                                if trans is not None:
-                                    subj_list[idx] = trans
-
-                            val_trans_src = []
-                            val_trans_ids = []
-                            for idx, val in enumerate(val_list):
-                                if form_list[idx] == "instance":
-                                    val_trans_src.append(val)
-                                    val_trans_ids.append(idx)
-
-                            if len(val_trans_src) > 0:
-                                val_trans = translate_entity(
-                                    val_trans_src, trg_lang, [src_lang])
-
-                                for idx, idy in enumerate(val_trans_ids):
-                                    val_list[idy] = val_trans[idx].get(
-                                        src_lang, val_list[idy])
-
-                            for idx, subj in enumerate(subj_list):
-                                trg_entities.append(
-                                    [subj, val_list[idx], form_list[idx]])
-
-                            val_list = []
-                            subj_list = []
-                            form_list = []
-
-                    if len(subj_list) > 0:
-
-                        subj_trans = translate_entity(
-                            subj_list, trg_lang, [src_lang])
-
-                        for idx, subj in enumerate(subj_trans):
-                            trans = subj.get(src_lang)
-                            if trans is not None:
-                                subj_list[idx] = trans
-
-                        val_trans_src = []
-                        val_trans_ids = []
-                        for idx, val in enumerate(val_list):
-                            if form_list[idx] == "instance":
-                                val_trans_src.append(val)
-                                val_trans_ids.append(idx)
-
-                        if len(val_trans_src) > 0:
-                            val_trans = translate_entity(
-                                val_trans_src, trg_lang, [src_lang])
-
-                            for idx, idy in enumerate(val_trans_ids):
-                                val_list[idy] = val_trans[idx].get(
-                                    src_lang, val_list[idy])
-
-                        for idx, subj in enumerate(subj_list):
-                            trg_entities.append(
-                                [subj, val_list[idx], form_list[idx]])
-
-                prop_dict[prop] = trg_entities
 
+            if skip is not None and skip(prop):
+                continue
+
+            try:
+                trg_entities = _translate_property(
+                    prop_path / f"{prop}.csv", trg_lang, src_lang)
             except Exception as e:
                 print(str(e))
+                if failed is not None:
+                    failed.add(prop)
                 continue
 
-    return prop_dict
+            yield prop, trg_entities
 
 
-def _find_entity_matches(src_props: list, trg_lang_props: dict, src_lang: str, pid: int, suffix: Optional[str] = None) -> list:
-    """find an entity with a given property in one language that also exists in another language"""
+def get_translated_properties(prop_list: list, trg_lang: str, src_lang: str, prop_path: Path, force: Optional[bool] = False, failed: Optional[set] = None,
+                              skip: Optional[Callable] = None) -> Iterator[Tuple[str, list]]:
+    """
+    translates target properties like translate_properties and keeps the translations in the cache,
+    so matching the same properties again does not need to translate them again. Properties for which skip returns True are left out.
+    The translations of a run that stopped early are kept and read instead of being translated again, they are only
+    cached once every property was translated. Properties that could not be translated are added to failed
+    """
+    key = cache.get_key("translated", trg=prop_path.name, src_lang=src_lang,
+                        props=cache.get_set_hash(set(prop_list)), matcher=MATCHER_VERSION)
 
-    matched_props = []
-    size = len(src_props)
-    desc = f"#{pid}"
+    trans_path = cache.get_artifact(key) if not force else None
 
-    def compare_entities(src_ents, trg_ents):
-        # TODO: figure out how to handle multiple matching properties
-        max_matches = 0.5 * min(len(src_ents), len(trg_ents))
-        matches = 0
+    if trans_path is not None:
+        for prop in prop_list:
+            if skip is None or not skip(prop):
+                yield prop, _read_translated(trans_path / f"{prop}.csv")
+        return
+
+    trans_path = cache.new_artifact("translated", key) if force else cache.resume_artifact("translated", key)
+    done = {prop for prop in prop_list if (trans_path / f"{prop}.csv").exists()}
+    not_translated = set()
+
+    # the translations of an earlier run belong to the largest properties, since they are translated first
+    for prop in prop_list:
+        if prop in done and (skip is None or not skip(prop)):
+            yield prop, _read_translated(trans_path / f"{prop}.csv")
+
+    for prop, trg_entities in translate_properties(prop_list, trg_lang, src_lang, prop_path,
+                                                   lambda prop: prop in done or (skip is not None and skip(prop)), not_translated):
+        # the file is renamed once it is complete, so an interrupted write is not read by the next run
+        tmp_file = trans_path / f"{prop}.csv.tmp"
+        with open(tmp_file, "w", encoding="utf-8", newline="") as out:
+            out_writer = csv.writer(out)
+            out_writer.writerow(PROPERTY_HEADER)
+            out_writer.writerows(trg_entities)
+        tmp_file.replace(trans_path / f"{prop}.csv")
 
-        for trg_ent in trg_ents:
-            for src_ent in src_ents:
-                if src_ent[0] == trg_ent[0] and src_ent[1] == trg_ent[1]:
-                    matches += 1
+        yield prop, trg_entities
 
-                    if matches >= max_matches:
-                        return True
+    if failed is not None:
+        failed.update(not_translated)
 
-        return False
+    # the cached translations have to cover the whole list, otherwise the missing properties would never be translated
+    if any(not (trans_path / f"{prop}.csv").exists() for prop in prop_list):
+        return
 
-    src_path_name = src_lang
+    cache.commit_artifact("translated", key, {
+                          "trg": prop_path.name, "trg_lang": trg_lang, "src_lang": src_lang})
 
-    if suffix is not None:
-        src_path_name = src_path_name + "_" + suffix
 
-    with tqdm(total=size, desc=desc, position=pid) as pbar:
-        for src_property in src_props:
-            src_path = DATA_FOLDER / src_path_name / f"{src_property}.csv"
+def _read_translated(prop_file: Path) -> list:
+    with open(prop_file, "r", newline="", encoding="utf-8") as csvfile:
+        csvreader = csv.reader(csvfile)
+        next(csvreader, None)
+        return list(csvreader)
 
-            src_entities = []
-            pbar.update(1)
 
-            try:
-                with open(src_path, "r", newline="", encoding="utf-8") as csv_src_file:
-                    csv_src_reader = csv.reader(csv_src_file)
+def _translate_property(prop_file: Path, trg_lang: str, src_lang: str) -> list:
+    """reads the entities of a single property and translates them in batches"""
+    trg_entities = []
 
-                    # skip first row with headers
-                    next(csv_src_reader, None)
-                    for row in csv_src_reader:
-                        src_entities.append(row)
+    with open(prop_file, "r", newline="", encoding="utf-8") as csv_trg_file:
+        csv_trg_reader = csv.reader(csv_trg_file)
 
-                for prop, entities in trg_lang_props.items():
+        # skip first row with headers
+        next(csv_trg_reader, None)
+        val_list = []
+        subj_list = []
+        form_list = []
+        typed_list = []
+        for row in csv_trg_reader:
+            subj_list.append(row[0])
+            val_list.append(row[1])
+            form_list.append(row[2])
+            typed_list.append(row[3] if len(row) > 3 else "")
 
-                    if compare_entities(src_entities, entities):
-                        matched_props.append((src_property, prop))
-                        break
+            if len(subj_list) == 40:
+                trg_entities.extend(_translate_batch(
+                    subj_list, val_list, form_list, typed_list, trg_lang, src_lang))
 
-            except Exception as e:
-                print(str(e))
-                continue
+                val_list = []
+                subj_list = []
+                form_list = []
+                typed_list = []
+
+        if len(subj_list) > 0:
+            trg_entities.extend(_translate_batch(
+                subj_list, val_list, form_list, typed_list, trg_lang, src_lang))
+
+    return trg_entities
+
+
+def _translate_batch(subj_list: list, val_list: list, form_list: list, typed_list: list, trg_lang: str, src_lang: str) -> list:
+    """translates the subjects and instance values of a batch of entities"""
+    subj_trans = translate_entity(
+        subj_list, trg_lang, [src_lang])
+
+    for idx, subj in enumerate(subj_trans):
+        trans = subj.get(src_lang)
+        if trans is not None:
+            subj_list[idx] = trans
+
+    val_trans_src = []
+    val_trans_ids = []
+    for idx, val in enumerate(val_list):
+        if form_list[idx] == "instance":
+            val_trans_src.append(val)
+            val_trans_ids.append(idx)
+
+    if len(val_trans_src) > 0:
+        val_trans = translate_entity(
+            val_trans_src, trg_lang, [src_lang])
+
+        for idx, idy in enumerate(val_trans_ids):
+            val_list[idy] = val_trans[idx].get(
+                src_lang, val_list[idy])
+
+    return [[subj, val_list[idx], form_list[idx], typed_list[idx]] for idx, subj in enumerate(subj_list)]
+
+
+@metrics.worker("match")
+def _find_entity_overlap(src_props: list, trg_lang_props: dict, src_dir: Path, tolerance: float = 0.0) -> list:
+    """
+    counts the entities of every source property that also exist in every target property and returns
+    (source, target, count) rows of all pairs with equal entities.
+    Numbers are equal if they differ by at most tolerance relative to the larger one
+    """
+
+    overlap_rows = []
+    num_comparisons = 0
+
+    for src_property in src_props:
+        src_path = src_dir / f"{src_property}.csv"
+
+        src_entities = []
+
+        try:
+            with open(src_path, "r", newline="", encoding="utf-8") as csv_src_file:
+                csv_src_reader = csv.reader(csv_src_file)
+
+                # skip first row with headers
+                next(csv_src_reader, None)
+                for row in csv_src_reader:
+                    src_entities.append(row)
+
+            src_index = _index_entities(src_entities)
+
+            # every target property is counted, so that the best match of both directions is known
+            for prop, entities in trg_lang_props.items():
 
-    return matched_props
+                num_comparisons += 1
+                count = _count_equal_entities(src_index, entities, tolerance)
+                if count > 0:
+                    overlap_rows.append((src_property, prop, count))
+
+        except Exception as e:
+            print(str(e))
+            continue
+
+    metrics.count("comparisons", num_comparisons)
+
+    return overlap_rows
+
+
+def _index_entities(entities: list) -> tuple:
+    """
+    returns the counts of the untyped entities by subject, type class and value, and the sorted typed values
+    of every subject and type class, so that every target entity is looked up instead of compared with all source entities
+    """
+    untyped = Counter()
+    typed = {}
+
+    for entity in entities:
+        type_class = catalog.get_type_class(entity[2])
+        if len(entity) > 3 and entity[3] != "":
+            typed.setdefault((entity[0], type_class), []).append(float(entity[3]))
+        else:
+            untyped[(entity[0], type_class, entity[1])] += 1
+
+    for values in typed.values():
+        values.sort()
+
+    return untyped, typed
+
+
+def _count_equal_entities(src_index: tuple, trg_ents: list, tolerance: float) -> int:
+    """
+    returns the number of equal pairs of the indexed source entities and the target entities.
+    Only values of the same type class are equal, like the type signatures and the external sort assume
+    """
+    untyped, typed = src_index
+    matches = 0
+
+    for trg_ent in trg_ents:
+        type_class = catalog.get_type_class(trg_ent[2])
+
+        if len(trg_ent) > 3 and trg_ent[3] != "":
+            values = typed.get((trg_ent[0], type_class))
+            if values is not None:
+                # dates are compared by their day, the tolerance only applies to numbers
+                matches += _count_close(values, float(trg_ent[3]),
+                                        tolerance if type_class == "number" else 0.0)
+        else:
+            matches += untyped[(trg_ent[0], type_class, trg_ent[1])]
+
+    return matches
+
+
+def _count_close(values: list, value: float, tolerance: float) -> int:
+    """counts the values of a sorted list that differ from value by at most tolerance relative to the larger of both"""
+    if tolerance == 0:
+        return bisect.bisect_right(values, value) - bisect.bisect_left(values, value)
+
+    # the widest range a value within the relative tolerance can be in
+    slack = tolerance * abs(value) / (1 - tolerance)
+    start = bisect.bisect_left(values, value - slack)
+    end = bisect.bisect_right(values, value + slack)
+
+    return sum(1 for other in values[start:end] if abs(other - value) <= tolerance * max(abs(other), abs(value)))
 
 
 def clean_prop_list(props: set) -> set:
@@ -307,6 +981,22 @@ def _is_in_2d_list(l: list, val: Any, trg_col: int = None) -> bool:
     return False
 
 
+def _split_items_by_size(items: list, s: int) -> list:
+    """splits a list of (key, list) pairs into s consecutive parts with a similar total length of the lists"""
+    total = sum(len(val) for _, val in items)
+    parts = [[]]
+    size = 0
+
+    for idx, item in enumerate(items):
+        # start a new part once the current one has its share, as long as every remaining part still gets an item
+        if size >= total * len(parts) / s and len(parts) < s and len(items) - idx >= s - len(parts):
+            parts.append([])
+        parts[-1].append(item)
+        size += len(item[1])
+
+    return parts
+
+
 def _split_list_equal(l: list, s: int) -> list:
     c = len(l) // s
     r = len(l) % s
@@ -0,0 +1,399 @@
+import csv
+import json
+import threading
+from array import array
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from pathlib import Path
+from typing import Iterator, Optional, Tuple
+from urllib.parse import urlparse, parse_qs
+from tqdm.auto import tqdm
+from data import cache
+from .property_extractor import PROPERTIES_FILE, PROPERTY_HEADER
+from .string_array import StringArray, write_string_array
+from .subject_index import _map_uint64
+from . import sort_merge
+
+INDEX_VERSION = "1"
+
+# memory in bytes used to sort the rows of an extraction by subject while the index is built
+INDEX_MEMORY = 256 * 1024 ** 2
+
+SUBJECTS_FILE = "subjects.bin"
+
+# for every property the position of its first row in ROWS_FILE, followed by the total number of rows
+PROPERTY_POINTERS_FILE = "property_pointers.bin"
+
+# byte offset of every row in the file of its property, in the order of the property array
+ROWS_FILE = "rows.bin"
+
+# for every subject the position of its first posting in POSTINGS_FILE, followed by the total number of postings
+SUBJECT_POINTERS_FILE = "subject_pointers.bin"
+
+# property index and byte offset of every row, ordered by subject
+POSTINGS_FILE = "postings.bin"
+
+DEFAULT_LIMIT = 100
+
+MAX_LIMIT = 10000
+
+
+class ExtractionIndex:
+    """
+    memory mapped index of the property files of an extraction. The rows of a property and the rows of a subject are
+    found with a binary search and read with one seek per property file, so lookups take the same time for any dump size
+    """
+
+    def __init__(self, prop_dir: Path, folder: Path):
+        self.prop_dir = prop_dir
+        self.folder = folder
+        self.properties = StringArray(prop_dir / PROPERTIES_FILE)
+        self.subjects = StringArray(folder / SUBJECTS_FILE)
+        self.property_pointers = _map_uint64(folder / PROPERTY_POINTERS_FILE)
+        self.rows = _map_uint64(folder / ROWS_FILE)
+        self.subject_pointers = _map_uint64(folder / SUBJECT_POINTERS_FILE)
+        self.postings = _map_uint64(folder / POSTINGS_FILE)
+
+    def get_properties(self, prefix: str = "", offset: int = 0, limit: int = DEFAULT_LIMIT) -> dict:
+        """returns a page of the property names that start with prefix together with their number of rows"""
+        if prefix == "":
+            items = [{"property": self.properties[idx], "rows": self.property_pointers[idx + 1] - self.property_pointers[idx]}
+                     for idx in range(offset, min(offset + limit, len(self.properties)))]
+            return _page(items, len(self.properties), offset, limit)
+
+        items = []
+        total = 0
+
+        for prop in self.properties.prefix(prefix):
+            if offset <= total < offset + limit:
+                idx = self.properties.index(prop)
+                items.append({"property": prop, "rows": self.property_pointers[idx + 1] - self.property_pointers[idx]})
+            total += 1
+
+        return _page(items, total, offset, limit)
+
+    def get_values(self, prop: str, offset: int = 0, limit: int = DEFAULT_LIMIT) -> Optional[dict]:
+        """returns a page of the rows of a property, None if the extraction does not have it"""
+        idx = self.properties.index(prop)
+
+        if idx < 0:
+            return None
+
+        start = self.property_pointers[idx]
+        total = self.property_pointers[idx + 1] - start
+
+        items = []
+        if offset < total:
+            with open(self.prop_dir / f"{prop}.csv", "rb") as f:
+                f.seek(self.rows[start + offset])
+                for _ in range(min(limit, total - offset)):
+                    items.append(_to_item(_parse_row(f.readline())))
+
+        return _page(items, total, offset, limit)
+
+    def get_entity(self, subject: str, offset: int = 0, limit: int = DEFAULT_LIMIT) -> Optional[dict]:
+        """returns a page of the rows of all properties of a subject, None if the extraction does not have it"""
+        idx = self.subjects.index(subject)
+
+        if idx < 0:
+            return None
+
+        start = self.subject_pointers[idx]
+        total = self.subject_pointers[idx + 1] - start
+
+        items = []
+        prop_idx = None
+        f = None
+        try:
+            for pos in range(start + offset, start + min(total, offset + limit)):
+                # the postings of a subject are ordered by property, so every property file is opened once
+                if self.postings[2 * pos] != prop_idx:
+                    if f is not None:
+                        f.close()
+                    prop_idx = self.postings[2 * pos]
+                    f = open(self.prop_dir / f"{self.properties[prop_idx]}.csv", "rb")
+
+                f.seek(self.postings[2 * pos + 1])
+                row = _parse_row(f.readline())
+                items.append({"property": self.properties[prop_idx], **_to_item(row)})
+        finally:
+            if f is not None:
+                f.close()
+
+        return _page(items, total, offset, limit)
+
+
+class MatchTable:
+    """the matched property pairs of two languages, read from a matches file and its best matches of both directions"""
+
+    def __init__(self, matches_file: Optional[Path] = None, best_file: Optional[Path] = None):
+        self.pairs = []
+        self.scores = {}
+
+        if matches_file is not None and matches_file.exists():
+            with open(matches_file, "r", newline="", encoding="utf-8") as csvfile:
+                csvreader = csv.reader(csvfile)
+                next(csvreader, None)
+                self.pairs = sorted({(row[0], row[1]) for row in csvreader if row[0] != "" and row[1] != ""})
+
+        if best_file is not None and best_file.exists():
+            with open(best_file, "r", newline="", encoding="utf-8") as csvfile:
+                for row in csv.DictReader(csvfile):
+                    self.scores[(row["source"], row["target"])] = (int(row["overlap"]), float(row["score"]))
+
+        self.by_source = {}
+        self.by_target = {}
+        for src_prop, trg_prop in self.pairs:
+            self.by_source.setdefault(src_prop, []).append(trg_prop)
+            self.by_target.setdefault(trg_prop, []).append(src_prop)
+
+    def get_matches(self, prop: Optional[str] = None, direction: str = "source", offset: int = 0, limit: int = DEFAULT_LIMIT) -> dict:
+        """returns a page of all matches, or of the matches of a source or with direction "target" a target property"""
+        if prop is None:
+            pairs = self.pairs
+        elif direction == "source":
+            pairs = [(prop, trg_prop) for trg_prop in self.by_source.get(prop, [])]
+        else:
+            pairs = [(src_prop, prop) for src_prop in self.by_target.get(prop, [])]
+
+        items = []
+        for src_prop, trg_prop in pairs[offset:offset + limit]:
+            overlap, score = self.scores.get((src_prop, trg_prop), (None, None))
+            items.append({"source": src_prop, "target": trg_prop, "overlap": overlap, "score": score})
+
+        return _page(items, len(pairs), offset, limit)
+
+
+class QueryService:
+    """read-only lookups in the extractions of two languages and their matches"""
+
+    def __init__(self, indexes: dict, matches: MatchTable, src_lang: str, trg_lang: str):
+        self.indexes = indexes
+        self.matches = matches
+        self.src_lang = src_lang
+        self.trg_lang = trg_lang
+
+    def get_index(self, lang: str) -> ExtractionIndex:
+        if lang not in self.indexes:
+            raise KeyError(f"no extraction of language {lang}, available are {', '.join(self.indexes)}")
+        return self.indexes[lang]
+
+    def get_properties(self, lang: str, prefix: str = "", offset: int = 0, limit: int = DEFAULT_LIMIT) -> dict:
+        return self.get_index(lang).get_properties(prefix, offset, _check_limit(limit))
+
+    def get_values(self, lang: str, prop: str, offset: int = 0, limit: int = DEFAULT_LIMIT) -> Optional[dict]:
+        return self.get_index(lang).get_values(prop, offset, _check_limit(limit))
+
+    def get_entity(self, lang: str, subject: str, offset: int = 0, limit: int = DEFAULT_LIMIT) -> Optional[dict]:
+        return self.get_index(lang).get_entity(subject, offset, _check_limit(limit))
+
+    def get_matches(self, prop: Optional[str] = None, direction: str = "source", offset: int = 0, limit: int = DEFAULT_LIMIT) -> dict:
+        if direction not in ["source", "target"]:
+            raise ValueError(f"direction {direction} has to be source or target")
+        return self.matches.get_matches(prop, direction, offset, _check_limit(limit))
+
+    def compare_entity(self, src_subject: str, trg_subject: Optional[str] = None) -> dict:
+        """
+        returns the values of a subject in both languages side by side, grouped by matched property pairs.
+        Subjects are not translated, without trg_subject the same name is looked up in the target language
+        """
+        trg_subject = trg_subject or src_subject
+        src_values = _group_values(self.get_index(self.src_lang), src_subject)
+        trg_values = _group_values(self.get_index(self.trg_lang), trg_subject)
+
+        pairs = []
+        for src_prop in sorted(src_values):
+            for trg_prop in self.matches.by_source.get(src_prop, []):
+                pairs.append({"source": src_prop, "target": trg_prop, "source_values": src_values[src_prop],
+                              "target_values": trg_values.get(trg_prop, [])})
+
+        return {self.src_lang: {"subject": src_subject, "properties": src_values},
+                self.trg_lang: {"subject": trg_subject, "properties": trg_values},
+                "matches": pairs}
+
+
+def get_extraction_index(prop_dir: Path, force: Optional[bool] = False) -> ExtractionIndex:
+    """
+    returns the query index of an extraction folder. It is built with one pass over all property files, the rows are
+    sorted by subject on disk, and cached by the extraction, so later services open it without reading the files
+    """
+    key = cache.get_key("query_index", props=prop_dir.name, index=INDEX_VERSION)
+
+    out_path = cache.get_artifact(key) if not force else None
+
+    if out_path is not None:
+        return ExtractionIndex(prop_dir, out_path)
+
+    out_path = cache.new_artifact("query_index", key)
+
+    properties = StringArray(prop_dir / PROPERTIES_FILE)
+    property_pointers = array("Q", [0])
+    postings = sort_merge.RunWriter(out_path, INDEX_MEMORY, "postings")
+    num_rows = 0
+
+    with open(out_path / ROWS_FILE, "wb") as rows_out:
+        for prop_idx, prop in enumerate(tqdm(properties, total=len(properties), desc=f"indexing {prop_dir.name}")):
+            offsets = array("Q")
+            for offset, subject in _iter_row_offsets(prop_dir / f"{prop}.csv"):
+                offsets.append(offset)
+                # fixed width numbers sort like the numbers, so the postings of a subject stay in the order of the files
+                postings.add((subject, f"{prop_idx:010d}", f"{offset:020d}"))
+
+            offsets.tofile(rows_out)
+            num_rows += len(offsets)
+            property_pointers.append(num_rows)
+
+    with open(out_path / PROPERTY_POINTERS_FILE, "wb") as out:
+        property_pointers.tofile(out)
+
+    subjects = []
+    subject_pointers = array("Q", [0])
+    num_postings = 0
+
+    with open(out_path / POSTINGS_FILE, "wb") as postings_out:
+        for (subject,), rows in sort_merge.group_rows(postings.merged(), 1):
+            subject_postings = array("Q")
+            for _, prop_idx, offset in rows:
+                subject_postings.append(int(prop_idx))
+                subject_postings.append(int(offset))
+
+            subject_postings.tofile(postings_out)
+            num_postings += len(subject_postings) // 2
+            subjects.append(subject)
+            subject_pointers.append(num_postings)
+
+    with open(out_path / SUBJECT_POINTERS_FILE, "wb") as out:
+        subject_pointers.tofile(out)
+    write_string_array(out_path / SUBJECTS_FILE, subjects)
+
+    for run in out_path.glob("postings_*.csv"):
+        run.unlink()
+
+    out_path = cache.commit_artifact("query_index", key, {"props": prop_dir.name})
+
+    return ExtractionIndex(prop_dir, out_path)
+
+
+def get_query_service(src_lang: str, trg_lang: str, src_dir: Path, trg_dir: Path, matches_file: Optional[Path] = None, best_file: Optional[Path] = None, force: Optional[bool] = False) -> QueryService:
+    """returns a query service over the extractions of two languages, the matches are read from the files if they exist"""
+    indexes = {src_lang: get_extraction_index(src_dir, force), trg_lang: get_extraction_index(trg_dir, force)}
+
+    return QueryService(indexes, MatchTable(matches_file, best_file), src_lang, trg_lang)
+
+
+def create_server(service: QueryService, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    """returns the http endpoint of a query service, which answers every request in its own thread"""
+    handler = type("Handler", (QueryRequestHandler,), {"service": service})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+
+    return server
+
+
+def start_server(service: QueryService, host: str = "127.0.0.1", port: int = 0) -> Tuple[ThreadingHTTPServer, str]:
+    """starts the http endpoint of a query service in a background thread and returns it together with its base url"""
+    server = create_server(service, host, port)
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    host, port = server.server_address[:2]
+    return server, f"http://{host}:{port}"
+
+
+class QueryRequestHandler(BaseHTTPRequestHandler):
+    """
+    answers GET requests with json:
+    /properties?lang=&prefix=, /values?lang=&property=, /entity?lang=&subject=, /compare?source=&target=
+    and /matches?property=&direction=. Lists are paginated with offset and limit
+    """
+
+    service: QueryService = None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+
+        try:
+            offset = int(params.get("offset", 0))
+            limit = int(params.get("limit", DEFAULT_LIMIT))
+            if offset < 0:
+                raise ValueError(f"offset {offset} has to be at least 0")
+
+            if url.path == "/properties":
+                result = self.service.get_properties(_require(params, "lang"), params.get("prefix", ""), offset, limit)
+            elif url.path == "/values":
+                result = self.service.get_values(_require(params, "lang"), _require(params, "property"), offset, limit)
+            elif url.path == "/entity":
+                result = self.service.get_entity(_require(params, "lang"), _require(params, "subject"), offset, limit)
+            elif url.path == "/compare":
+                result = self.service.compare_entity(_require(params, "source"), params.get("target"))
+            elif url.path == "/matches":
+                result = self.service.get_matches(params.get("property"), params.get("direction", "source"), offset, limit)
+            else:
+                return self._send(404, {"error": f"unknown path {url.path}"})
+        except (KeyError, ValueError) as e:
+            return self._send(400, {"error": str(e).strip("'\"")})
+
+        if result is None:
+            return self._send(404, {"error": "not found"})
+
+        self._send(200, result)
+
+    def _send(self, status: int, content: dict) -> None:
+        body = json.dumps(content, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _require(params: dict, name: str) -> str:
+    if name not in params:
+        raise KeyError(f"missing parameter {name}")
+    return params[name]
+
+
+def _check_limit(limit: int) -> int:
+    if not 0 < limit <= MAX_LIMIT:
+        raise ValueError(f"limit {limit} has to be between 1 and {MAX_LIMIT}")
+    return limit
+
+
+def _page(items: list, total: int, offset: int, limit: int) -> dict:
+    return {"total": total, "offset": offset, "limit": limit, "items": items}
+
+
+def _group_values(index: ExtractionIndex, subject: str) -> dict:
+    values = {}
+    offset = 0
+
+    while True:
+        page = index.get_entity(subject, offset, MAX_LIMIT)
+        if page is None:
+            return values
+        for item in page["items"]:
+            values.setdefault(item["property"], []).append(item["value"])
+        offset += MAX_LIMIT
+        if offset >= page["total"]:
+            return values
+
+
+def _to_item(row: list) -> dict:
+    return dict(zip(PROPERTY_HEADER, row))
+
+
+def _parse_row(line: bytes) -> list:
+    return next(csv.reader([line.decode("utf-8")]))
+
+
+def _iter_row_offsets(prop_file: Path) -> Iterator[Tuple[int, str]]:
+    """yields the byte offset and subject of every row of a property file, values never span several lines"""
+    with open(prop_file, "rb") as f:
+        offset = len(f.readline())
+        for line in f:
+            yield offset, _parse_row(line)[0]
+            offset += len(line)
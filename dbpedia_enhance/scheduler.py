@@ -0,0 +1,123 @@
+import queue
+import threading
+from typing import Any, Callable, Iterable, Optional
+from . import metrics
+
+_CLOSED = object()
+
+
+class StageQueue:
+    """
+    a bounded queue that streams items from one stage to another.
+    The producer blocks when the consumer falls behind, which keeps the memory usage between two stages bounded.
+    """
+
+    def __init__(self, maxsize: int):
+        self._queue = queue.Queue(maxsize=maxsize)
+        self.cancelled = threading.Event()
+
+    def put(self, item: Any) -> None:
+        """adds an item to the queue. Items added after the queue was cancelled are dropped"""
+        while not self.cancelled.is_set():
+            try:
+                self._queue.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def close(self) -> None:
+        """signals the consumer that no more items will follow"""
+        self.put(_CLOSED)
+
+    def cancel(self) -> None:
+        """tells the producer that its items are not needed anymore"""
+        self.cancelled.set()
+
+    def __iter__(self) -> Iterable:
+        while True:
+            try:
+                item = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                if self.cancelled.is_set():
+                    return
+                continue
+            if item is _CLOSED:
+                return
+            yield item
+
+
+class Pipeline:
+    """
+    runs the stages of a pipeline as a DAG.
+    Every stage runs in its own thread as soon as the stages it depends on are finished and is called with their results.
+    Stages can additionally stream data to each other over bounded queues, so a consumer does not have to wait for its producer to finish.
+    """
+
+    def __init__(self):
+        self._stages = {}
+        self._queues = []
+        self._results = {}
+        self._errors = {}
+        self._done = {}
+
+    def add_stage(self, name: str, func: Callable, deps: Optional[list] = None) -> None:
+        """adds a stage that calls func with the results of all dependencies in the given order"""
+        deps = deps or []
+        for dep in deps:
+            if dep not in self._stages:
+                raise ValueError(
+                    f"stage {name} depends on unknown stage {dep}")
+
+        self._stages[name] = (func, deps)
+        self._done[name] = threading.Event()
+
+    def add_queue(self, maxsize: int) -> StageQueue:
+        """creates a bounded queue between two stages"""
+        stage_queue = StageQueue(maxsize)
+        self._queues.append(stage_queue)
+        return stage_queue
+
+    def get_result(self, name: str, default: Any = None) -> Any:
+        """returns the result of a stage if it is already finished, otherwise the default value"""
+        if self._done[name].is_set() and name in self._results:
+            return self._results[name]
+        return default
+
+    def run(self) -> dict:
+        """runs all stages and returns their results. The first error of a stage is raised after all threads have stopped"""
+        threads = [threading.Thread(target=self._run_stage, args=(name,), name=name, daemon=True)
+                   for name in self._stages]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        for name in self._stages:
+            if name in self._errors:
+                raise RuntimeError(
+                    f"stage {name} failed") from self._errors[name]
+
+        return self._results
+
+    def _run_stage(self, name: str) -> None:
+        func, deps = self._stages[name]
+
+        try:
+            for dep in deps:
+                self._done[dep].wait()
+                if dep not in self._results:
+                    # a dependency failed, so this stage can not run either
+                    return
+
+            with metrics.stage(name):
+                self._results[name] = func(
+                    *[self._results[dep] for dep in deps])
+        except Exception as e:
+            self._errors[name] = e
+            # unblock all producers and consumers, so that the other stages can stop
+            for stage_queue in self._queues:
+                stage_queue.cancel()
+        finally:
+            self._done[name].set()
@@ -0,0 +1,90 @@
+import csv
+import heapq
+import itertools
+from pathlib import Path
+from typing import Iterable, Iterator
+from . import metrics
+
+# estimated memory of a buffered row in addition to the length of its fields
+ROW_OVERHEAD = 120
+
+# maximum number of runs that are merged at once, more runs are merged in several passes
+MERGE_FAN_IN = 64
+
+
+class RunWriter:
+    """
+    collects rows in memory and writes them as sorted runs to a folder whenever the memory budget is used up.
+    All fields of a row have to be strings
+    """
+
+    def __init__(self, folder: Path, max_memory: int, name: str = "run"):
+        self.folder = folder
+        self.max_memory = max_memory
+        self.name = name
+        self.runs = []
+        self.rows = []
+        self.memory = 0
+        self.num_files = 0
+
+    def add(self, row: tuple) -> None:
+        self.rows.append(row)
+        self.memory += ROW_OVERHEAD + sum(len(field) for field in row)
+
+        if self.memory >= self.max_memory:
+            self.flush()
+
+    def flush(self) -> None:
+        if len(self.rows) == 0:
+            return
+
+        self.rows.sort()
+        self.runs.append(_write_run(self.rows, self._next_file()))
+        metrics.count("spilled_runs")
+
+        self.rows = []
+        self.memory = 0
+
+    def merged(self) -> Iterator[tuple]:
+        """returns all added rows in sorted order"""
+        if len(self.runs) == 0:
+            self.rows.sort()
+            return iter(self.rows)
+
+        self.flush()
+
+        runs = self.runs
+        while len(runs) > MERGE_FAN_IN:
+            runs = [_write_run(merge_runs(runs[idx:idx + MERGE_FAN_IN]), self._next_file())
+                    for idx in range(0, len(runs), MERGE_FAN_IN)]
+
+        return merge_runs(runs)
+
+    def _next_file(self) -> Path:
+        self.num_files += 1
+        return self.folder / f"{self.name}_{self.num_files}.csv"
+
+
+def merge_runs(runs: list) -> Iterator[tuple]:
+    """merges sorted run files into one sorted stream of rows"""
+    files = [open(run, "r", newline="", encoding="utf-8") for run in runs]
+
+    try:
+        yield from heapq.merge(*(map(tuple, csv.reader(f)) for f in files))
+    finally:
+        for f in files:
+            f.close()
+
+
+def group_rows(rows: Iterable[tuple], key_len: int) -> Iterator[tuple]:
+    """groups a sorted stream of rows by their first key_len fields and yields (key, rows) pairs"""
+    for key, group in itertools.groupby(rows, key=lambda row: row[:key_len]):
+        yield key, group
+
+
+def _write_run(rows: Iterable[tuple], out_file: Path) -> Path:
+    with open(out_file, "w", encoding="utf-8", newline="") as out:
+        out_writer = csv.writer(out)
+        out_writer.writerows(rows)
+
+    return out_file
@@ -0,0 +1,195 @@
+import mmap
+import bisect
+import struct
+from pathlib import Path
+from typing import Iterable, Iterator
+
+# every block starts with a complete string, the following strings only store what differs from their predecessor
+BLOCK_SIZE = 16
+
+MAGIC = b"SARR1\n"
+
+# number of strings and number of blocks
+HEADER = struct.Struct("<QQ")
+
+OFFSET = struct.Struct("<Q")
+
+
+class StringArray:
+    """
+    sorted set of strings in a front-coded file that is memory mapped, so opening it takes the same time for any size.
+    Strings are ordered by their utf-8 bytes, which is the same order as sorted() on the python strings
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+
+        with open(self.path, "rb") as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self.data[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{self.path} is not a string array")
+
+        self.size, self.num_blocks = HEADER.unpack_from(self.data, len(MAGIC))
+        self.offsets_start = len(MAGIC) + HEADER.size
+        self.data_start = self.offsets_start + self.num_blocks * OFFSET.size
+        self.firsts = _BlockFirsts(self)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __iter__(self) -> Iterator[str]:
+        for block in range(self.num_blocks):
+            for item in self._decode_block(block):
+                yield item.decode("utf-8")
+
+    def __contains__(self, item: str) -> bool:
+        return self.index(item) >= 0
+
+    def __getitem__(self, idx: int) -> str:
+        if idx < 0:
+            idx += self.size
+        if idx < 0 or idx >= self.size:
+            raise IndexError("string array index out of range")
+
+        return self._decode_block(idx // BLOCK_SIZE)[idx % BLOCK_SIZE].decode("utf-8")
+
+    def index(self, item: str) -> int:
+        """returns the position of a string in the array or -1 if it is not contained"""
+        key = item.encode("utf-8")
+        block = bisect.bisect_right(self.firsts, key) - 1
+
+        if block < 0:
+            return -1
+
+        items = self._decode_block(block)
+        pos = bisect.bisect_left(items, key)
+
+        if pos < len(items) and items[pos] == key:
+            return block * BLOCK_SIZE + pos
+        return -1
+
+    def __reduce__(self):
+        # workers open the file themselves instead of receiving all strings
+        return StringArray, (self.path,)
+
+    def prefix(self, prefix: str) -> Iterator[str]:
+        """returns all strings that start with prefix in sorted order"""
+        key = prefix.encode("utf-8")
+        block = max(bisect.bisect_left(self.firsts, key) - 1, 0)
+
+        for cur in range(block, self.num_blocks):
+            for item in self._decode_block(cur):
+                if item.startswith(key):
+                    yield item.decode("utf-8")
+                elif item > key:
+                    return
+
+    def _block_start(self, block: int) -> int:
+        return self.data_start + OFFSET.unpack_from(self.data, self.offsets_start + block * OFFSET.size)[0]
+
+    def _decode_block(self, block: int) -> list:
+        pos = self._block_start(block)
+        count = min(BLOCK_SIZE, self.size - block * BLOCK_SIZE)
+
+        length, pos = _read_varint(self.data, pos)
+        prev = self.data[pos:pos + length]
+        pos += length
+        items = [prev]
+
+        for _ in range(count - 1):
+            shared, pos = _read_varint(self.data, pos)
+            length, pos = _read_varint(self.data, pos)
+            prev = prev[:shared] + self.data[pos:pos + length]
+            pos += length
+            items.append(prev)
+
+        return items
+
+    def _decode_first(self, block: int) -> bytes:
+        length, pos = _read_varint(self.data, self._block_start(block))
+        return self.data[pos:pos + length]
+
+
+class _BlockFirsts:
+    """sequence of the first string of every block, so that bisect can search the blocks without decoding all of them"""
+
+    def __init__(self, array: StringArray):
+        self.array = array
+
+    def __len__(self) -> int:
+        return self.array.num_blocks
+
+    def __getitem__(self, block: int) -> bytes:
+        return self.array._decode_first(block)
+
+
+def write_string_array(out_file: Path, strings: Iterable[str]) -> Path:
+    """writes the distinct strings sorted and front-coded to out_file"""
+    items = sorted({item.encode("utf-8") for item in strings})
+    blocks = bytearray()
+    offsets = []
+
+    for idx, item in enumerate(items):
+        if idx % BLOCK_SIZE == 0:
+            offsets.append(len(blocks))
+            blocks += _encode_varint(len(item))
+            blocks += item
+        else:
+            prev = items[idx - 1]
+            shared = 0
+            max_shared = min(len(prev), len(item))
+            while shared < max_shared and prev[shared] == item[shared]:
+                shared += 1
+            blocks += _encode_varint(shared)
+            blocks += _encode_varint(len(item) - shared)
+            blocks += item[shared:]
+
+    with open(out_file, "wb") as out:
+        out.write(MAGIC)
+        out.write(HEADER.pack(len(items), len(offsets)))
+        for offset in offsets:
+            out.write(OFFSET.pack(offset))
+        out.write(blocks)
+
+    return out_file
+
+
+def intersect(first: Iterable[str], second: Iterable[str]) -> Iterator[str]:
+    """returns the strings contained in two sorted iterables, e.g. string arrays, by merging them"""
+    first = iter(first)
+    second = iter(second)
+
+    a = next(first, None)
+    b = next(second, None)
+
+    while a is not None and b is not None:
+        if a == b:
+            yield a
+            a = next(first, None)
+            b = next(second, None)
+        elif a < b:
+            a = next(first, None)
+        else:
+            b = next(second, None)
+
+
+def _encode_varint(value: int) -> bytes:
+    out = bytearray()
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _read_varint(data, pos: int) -> tuple:
+    value = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
@@ -0,0 +1,200 @@
+import mmap
+from array import array
+from pathlib import Path
+from typing import Iterable, Optional
+from data.utils import DATA_FOLDER
+from data import cache
+from . import metrics, executor, diagnostics
+from .string_array import StringArray, write_string_array
+from .utils import extract_prop_name, extract_subj_name, extract_value, get_lang_code, get_chunks, CHUNK_SIZE, PROGRESS_STEP, PARSER_VERSION
+
+SUBJECTS_FILE = "subjects.bin"
+
+# for every subject the position of its first range in RANGES_FILE, followed by the total number of ranges
+POINTERS_FILE = "pointers.bin"
+
+# start and end byte of every range of lines of a subject
+RANGES_FILE = "ranges.bin"
+
+# ranges of the dump that are less than this many bytes apart are read together instead of seeking
+MAX_GAP = 1024 * 1024
+
+
+class SubjectIndex:
+    """
+    byte ranges of the triples of every subject in a dump. DBpedia dumps list the triples of a subject one after another,
+    so most subjects have a single range
+    """
+
+    def __init__(self, file: Path, folder: Path):
+        self.file = file
+        self.folder = folder
+        self.subjects = StringArray(folder / SUBJECTS_FILE)
+        self.pointers = _map_uint64(folder / POINTERS_FILE)
+        self.ranges = _map_uint64(folder / RANGES_FILE)
+
+    def __len__(self) -> int:
+        return len(self.subjects)
+
+    def __reduce__(self):
+        return SubjectIndex, (self.file, self.folder)
+
+    def get_ranges(self, subject: str) -> list:
+        """returns the (start, end) byte ranges of all triples of a subject, an empty list if it is not in the dump"""
+        idx = self.subjects.index(subject)
+
+        if idx < 0:
+            return []
+
+        return [(self.ranges[2 * pos], self.ranges[2 * pos + 1]) for pos in range(self.pointers[idx], self.pointers[idx + 1])]
+
+    def get_triples(self, subject: str) -> list:
+        """returns the [property, value, format] rows of a subject, read with one seek per range"""
+        rows = []
+
+        with open(self.file, "rb") as f:
+            for start, end in self.get_ranges(subject):
+                f.seek(start)
+                for line in f.read(end - start).decode("utf-8").splitlines():
+                    content = line.split("> ", 2)
+                    value, form = extract_value(content[2])
+                    rows.append([extract_prop_name(content[1]), value, form])
+
+        return rows
+
+    def get_chunks(self, subjects: Iterable[str], max_gap: int = MAX_GAP, chunk_size: int = CHUNK_SIZE) -> list:
+        """
+        returns the byte ranges that contain all triples of the given subjects, sorted by their position in the dump.
+        Ranges that are close to each other are joined, so they are read at once
+        """
+        return join_ranges([rng for subject in subjects for rng in self.get_ranges(subject)], max_gap, chunk_size)
+
+
+def get_subject_index(file: str, force: Optional[bool] = False) -> SubjectIndex:
+    """
+    returns the index of the byte ranges of every subject in a dump. The index is built with one pass over the dump
+    and cached by the dump checksum, so later runs can read the triples of single subjects without scanning the dump
+    """
+    lang_code = get_lang_code(file)
+
+    key = cache.get_extraction_key(
+        "subject_index", file, lang_code, None, PARSER_VERSION)
+
+    out_path = cache.get_artifact(key) if not force else None
+
+    if out_path is not None:
+        return SubjectIndex(DATA_FOLDER / file, out_path)
+
+    out_path = cache.new_artifact("subject_index", key)
+
+    chunks = get_chunks(DATA_FOLDER / file, executor.get_num_tasks())
+
+    pool_args = []
+    for chunk_start, chunk_end in chunks:
+        pool_args.append((DATA_FOLDER / file, chunk_start, chunk_end))
+
+    chunk_ranges = executor.run(_index_subjects, pool_args, f"indexing subjects of {lang_code}",
+                                [end - start for start, end in chunks], "B")
+
+    subject_ranges = {}
+    last = None
+
+    for ranges in chunk_ranges:
+        for subject, start, end in ranges:
+            # a subject can continue in the next chunk
+            if last is not None and last[0] == subject and last[2] == start:
+                subject_ranges[subject][-1] = (subject_ranges[subject][-1][0], end)
+            else:
+                subject_ranges.setdefault(subject, []).append((start, end))
+            last = (subject, start, end)
+
+    subjects = sorted(subject_ranges.keys())
+    pointers = array("Q", [0])
+    positions = array("Q")
+
+    for subject in subjects:
+        for start, end in subject_ranges[subject]:
+            positions.append(start)
+            positions.append(end)
+        pointers.append(len(positions) // 2)
+
+    write_string_array(out_path / SUBJECTS_FILE, subjects)
+    with open(out_path / POINTERS_FILE, "wb") as out:
+        pointers.tofile(out)
+    with open(out_path / RANGES_FILE, "wb") as out:
+        positions.tofile(out)
+
+    out_path = cache.commit_artifact(
+        "subject_index", key, {"lang": lang_code, "file": file})
+
+    return SubjectIndex(DATA_FOLDER / file, out_path)
+
+
+def join_ranges(ranges: Iterable[tuple], max_gap: int = MAX_GAP, chunk_size: int = CHUNK_SIZE) -> list:
+    """returns byte ranges sorted by their position, ranges that are close to each other are joined, so they are read at once"""
+    chunks = []
+    for start, end in sorted(ranges):
+        if len(chunks) > 0 and start - chunks[-1][1] <= max_gap and end - chunks[-1][0] <= chunk_size:
+            chunks[-1] = (chunks[-1][0], max(end, chunks[-1][1]))
+        else:
+            chunks.append((start, end))
+
+    return chunks
+
+
+def get_extraction_chunks(file: str, filtr: Optional[set]) -> list:
+    """
+    returns the byte ranges an extraction has to read. Without a filter these are equal parts of the whole dump,
+    with a filter only the ranges of its subjects are read
+    """
+    if filtr is None:
+        return get_chunks(DATA_FOLDER / file, executor.get_num_tasks())
+
+    return get_subject_index(file).get_chunks(filtr)
+
+
+@metrics.worker("index_subjects")
+def _index_subjects(file: Path, chunk_start: int, chunk_end: int) -> list:
+    """returns (subject, start, end) for every run of consecutive lines of the same subject in a chunk"""
+    ranges = []
+    subject = None
+    start = chunk_start
+    pos = chunk_start
+    reported = chunk_start
+
+    with open(file, "rb") as f:
+        f.seek(chunk_start)
+
+        while pos < chunk_end:
+            line = f.readline()
+            if not line:
+                break
+
+            line_subject = extract_subj_name(line.split(b"> ", 1)[0].decode("utf-8"))
+
+            if line_subject != subject:
+                if subject is not None:
+                    ranges.append((subject, start, pos))
+                subject = line_subject
+                start = pos
+
+            pos += len(line)
+
+            if pos - reported >= PROGRESS_STEP:
+                diagnostics.progress(pos - reported)
+                reported = pos
+
+    if subject is not None:
+        ranges.append((subject, start, pos))
+
+    metrics.count("bytes_read", chunk_end - chunk_start)
+
+    return ranges
+
+
+def _map_uint64(path: Path):
+    if path.stat().st_size == 0:
+        return memoryview(array("Q"))
+
+    with open(path, "rb") as f:
+        return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)).cast("Q")
@@ -1,12 +1,12 @@
 import requests
 import csv
 from tqdm.auto import tqdm
-import multiprocessing as mp
 import time
 import random
 from typing import Union, Optional, Tuple
-from . import utils, entity_extractor_new
+from . import utils, entity_extractor_new, metrics, executor
 from data.utils import DATA_FOLDER
+from data import cache
 
 
 def translate_entities(entities: set, src_lang: str, langcodes: list) -> list:
@@ -61,6 +61,7 @@ def translate_entity(entity_list: Union[list, str], src_lang: str, langcodes: li
     cont_req = True
 
     while cont_req:
+        metrics.count("api_calls")
         with requests.get(base_url, params=params, timeout=5) as res:
             if res.status_code != 200:
                 # catch rate limiting errors and try to distribute load a bit better
@@ -120,27 +121,26 @@ def get_translations_from_file(fname: str) -> Tuple[list, set]:
     return lang_codes, all_subj
 
 
-def get_translations(filelist: list, suffix: Optional[str] = None, force: Optional[bool] = False) -> Tuple[list, set]:
+def get_translations(filelist: list, force: Optional[bool] = False) -> Tuple[list, set]:
     """
     create a file containing all translations between two languages for further use.
-    Also returns the translations and language ordering for further use
+    Also returns the translations and language ordering for further use.
+    The translations are cached by the dumps they were created from.
     """
     lang_codes = []
-    file_name = "subj"
     for fname in filelist:
         lang_code = utils.get_lang_code(fname)
         lang_codes.append(lang_code)
-        file_name = file_name + "_" + lang_code
 
-    if suffix is not None:
-        file_name = file_name + "_" + suffix
-
-    trans_file = DATA_FOLDER / f"{file_name}_translations.csv"
+    key = cache.get_key("translations", dumps=[cache.get_dump_checksum(
+        fname) for fname in filelist], langs=lang_codes, parser=utils.PARSER_VERSION)
 
     all_subj = set()
 
-    if trans_file.exists() and not force:
-        with open(trans_file, "r", newline="", encoding="utf-8") as csvfile:
+    trans_path = cache.get_artifact(key) if not force else None
+
+    if trans_path is not None:
+        with open(trans_path / "translations.csv", "r", newline="", encoding="utf-8") as csvfile:
             csvreader = csv.reader(csvfile)
             lang_codes = next(csvreader, None)
             for row in csvreader:
@@ -148,7 +148,7 @@ def get_translations(filelist: list, suffix: Optional[str] = None, force: Option
 
         return lang_codes, all_subj
 
-    num_splits = mp.cpu_count()
+    num_splits = executor.get_num_tasks()
 
     for fname in filelist:
         lang = utils.get_lang_code(fname)
@@ -159,51 +159,40 @@ def get_translations(filelist: list, suffix: Optional[str] = None, force: Option
 
         split_args = []
 
-        for idx, split in enumerate(subj_split):
-            split_args.append((split, lang, trg_langs, lang_codes, idx+1))
+        for split in subj_split:
+            split_args.append((split, lang, trg_langs, lang_codes))
 
-        tqdm.set_lock(mp.RLock())
-        with mp.Pool(processes=mp.cpu_count(), initializer=tqdm.set_lock, initargs=(tqdm.get_lock(),)) as pool:
-            trans_list = pool.starmap(_run_translate, split_args)
+        trans_list = executor.run(_run_translate, split_args, f"translating {lang}",
+                                  [len(split) for split in subj_split])
 
         for trans in trans_list:
             all_subj.update(trans)
 
+    trans_path = cache.new_artifact("translations", key)
+
     with tqdm(total=len(all_subj)) as pbar:
-        with open(trans_file, "w", encoding="utf-8", newline="") as out:
+        with open(trans_path / "translations.csv", "w", encoding="utf-8", newline="") as out:
             out_writer = csv.writer(out)
             out_writer.writerow(lang_codes)
             for sub in all_subj:
                 out_writer.writerow(list(sub))
                 pbar.update(1)
 
+    cache.commit_artifact("translations", key, {"langs": lang_codes})
+
     return lang_codes, all_subj
 
 
-def _run_translate(subj: set, lang: str, trg_langs: list, lang_codes: list, pid: int):
+@metrics.worker("translate")
+def _run_translate(subj: set, lang: str, trg_langs: list, lang_codes: list):
 
     trans_subj = set()
-    desc = f"#{pid}"
-    with tqdm(total=len(subj), desc=desc, position=pid) as pbar:
-        ent_list = []
-        for ent in subj:
-            ent_list.append(ent)
-            if len(ent_list) == 40:
-                trans_ents = translate_entity(
-                    ent_list, lang, trg_langs)
-                for trans_ent in trans_ents:
-                    items = []
-
-                    # ensure that all added tuples have the same ordering and we do not add duplicate ones
-                    for l in lang_codes:
-                        items.append(trans_ent.get(l, ""))
-
-                    trans_subj.add(tuple(items))
-                ent_list = []
-                pbar.update(40)
-
-        if len(ent_list) > 0:
-            trans_ents = translate_entity(ent_list, lang, trg_langs)
+    ent_list = []
+    for ent in subj:
+        ent_list.append(ent)
+        if len(ent_list) == 40:
+            trans_ents = translate_entity(
+                ent_list, lang, trg_langs)
             for trans_ent in trans_ents:
                 items = []
 
@@ -212,7 +201,18 @@ def _run_translate(subj: set, lang: str, trg_langs: list, lang_codes: list, pid:
                     items.append(trans_ent.get(l, ""))
 
                 trans_subj.add(tuple(items))
-            pbar.update(len(ent_list))
+            ent_list = []
+
+    if len(ent_list) > 0:
+        trans_ents = translate_entity(ent_list, lang, trg_langs)
+        for trans_ent in trans_ents:
+            items = []
+
+            # ensure that all added tuples have the same ordering and we do not add duplicate ones
+            for l in lang_codes:
+                items.append(trans_ent.get(l, ""))
+
+            trans_subj.add(tuple(items))
 
     return trans_subj
 
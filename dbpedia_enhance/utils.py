@@ -1,7 +1,121 @@
-from typing import Tuple, Optional
+from typing import Iterator, Tuple, Optional
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 import requests
 import time
 import random
+import csv
+import os
+import re
+import math
+import threading
+from datetime import date
+from data.utils import DATA_FOLDER
+from . import metrics, diagnostics
+from .catalog import get_type_class
+
+CATEGORY_FOLDER = DATA_FOLDER / "categories"
+
+# a line and all following lines that start with the same subject, the search for the end of a block runs in the regex engine
+SUBJECT_BLOCK = re.compile(rb"(<[^>\n]*> )[^\n]*(?:\n|\Z)(?:\1[^\n]*(?:\n|\Z))*")
+
+# increase this whenever the parsing of triples or the layout of the extracted files changes, so that cached extraction results are regenerated
+PARSER_VERSION = "5"
+
+# namespace id of category pages in the MediaWiki api
+CATEGORY_NAMESPACE = 14
+
+# number of categories that are requested from the api at the same time
+CATEGORY_WORKERS = 8
+
+# resolved category members of the current run, shared between all extractors
+_category_cache = {}
+_category_locks = {}
+_category_locks_lock = threading.Lock()
+
+# maximum size of a part of a dump file that is processed as a single task
+CHUNK_SIZE = 16 * 1024 * 1024
+
+# number of bytes after which the iterators over a chunk report their progress
+PROGRESS_STEP = 1024 * 1024
+
+
+def get_chunks(file: Path, num_chunks: int, chunk_size: int = CHUNK_SIZE) -> list:
+    """
+    splits a file into byte ranges of whole lines that can be processed independently.
+    The file is split into at least num_chunks parts, but no part is larger than chunk_size
+    """
+    fsize = os.path.getsize(file)
+    chunk_size = max(1, min(chunk_size, fsize // num_chunks))
+
+    chunks = []
+
+    with open(file, "rb") as f:
+        chunk_start = 0
+
+        while chunk_start < fsize:
+            chunk_end = chunk_start + chunk_size
+
+            if chunk_end >= fsize:
+                chunk_end = fsize
+            else:
+                # move the end of the chunk to the start of the next line
+                f.seek(chunk_end)
+                f.readline()
+                chunk_end = f.tell()
+
+            chunks.append((chunk_start, chunk_end))
+            chunk_start = chunk_end
+
+    return chunks
+
+
+def iter_subject_blocks(file: Path, chunk_start: int, chunk_end: int, filtr: Optional[set] = None) -> Iterator[Tuple[str, bytes]]:
+    """
+    yields (subject, lines) for every block of consecutive lines of the same subject in a chunk of a file.
+    DBpedia dumps list all triples of a subject together, so the subject is only parsed and filtered once per block.
+    Blocks of subjects that are not in filtr are skipped without decoding them, get_block_lines decodes the others
+    """
+    with open(file, "rb") as f:
+        f.seek(chunk_start)
+        data = f.read(chunk_end - chunk_start)
+
+    size = len(data)
+    pos = 0
+    reported = 0
+
+    while pos < size:
+        block = SUBJECT_BLOCK.match(data, pos)
+
+        if block is not None:
+            subject = extract_subj_name(block.group(1)[:-2].decode("utf-8"))
+            block_end = block.end()
+        else:
+            # lines without a subject are passed on alone, so that the extractors can report them
+            block_end = data.find(b"\n", pos)
+            block_end = size if block_end < 0 else block_end + 1
+            subject = extract_subj_name(data[pos:block_end].split(b"> ", 1)[0].decode("utf-8"))
+
+        if filtr is None or subject in filtr:
+            yield subject, data[pos:block_end]
+
+        pos = block_end
+
+        if pos - reported >= PROGRESS_STEP:
+            diagnostics.progress(pos - reported)
+            reported = pos
+
+    diagnostics.progress(size - reported)
+
+
+def get_block_lines(block: bytes) -> list:
+    """returns the lines of a block of iter_subject_blocks without their line breaks"""
+    lines = block.decode("utf-8").split("\n")
+
+    if lines[-1] == "":
+        lines.pop()
+
+    return lines
 
 
 def get_lang_code(fname: str) -> str:
@@ -51,6 +165,27 @@ def extract_value(value: str) -> Tuple[str, str]:
         return value, "string"
 
 
+def parse_typed_value(value: str, form: str) -> Optional[float]:
+    """
+    parses numeric values into a number and dates into their day number, so that differently written values can be compared.
+    Returns None for other values or values that can not be parsed
+    """
+    type_class = get_type_class(form)
+
+    try:
+        if type_class == "number":
+            number = float(value)
+            return number if math.isfinite(number) else None
+        if type_class == "date":
+            # years and months stand for their first day
+            parts = (value.split("T")[0] + "-01-01").split("-")
+            return float(date(int(parts[0]), int(parts[1] or 1), int(parts[2] or 1)).toordinal())
+    except ValueError:
+        return None
+
+    return None
+
+
 def create_rdf_subj(subject: str, lang: str) -> str:
     """creates and rdf conforming dbpedia subject from the raw data"""
     return f"<http://{lang}.dbpedia.org/resource/{subject}>"
@@ -62,50 +197,125 @@ def create_rdf_prop(prop: str, lang: str) -> str:
 
 
 def create_rdf_value(val: str, typ: str, lang: str = None) -> str:
-    """Creates an rdf-conform dbpedia value form the raw data"""
-    if type == "instance":
+    """Creates an rdf-conform dbpedia value form the raw data, typ is the format returned by extract_value"""
+    if typ == "instance":
         return f"<http://{lang}.dbpedia.org/resource/{val}>"
-    elif type == "string":
+    elif typ == "string":
         return f"\"{val}\"@{lang}"
-    elif type == "other":
+    elif typ == "other":
         return val
+    elif typ.startswith("<"):
+        # datatypes outside of XMLSchema, e.g. the units of dbpedia, keep their full uri without the closing bracket
+        return f"\"{val}\"^^{typ}>"
     else:
         return f"\"{val}\"^^<http://www.w3.org/2001/XMLSchema#{typ}>"
 
 
-def get_category_members(category: str, lang: str, continue_val: Optional[str] = None, part_results: Optional[list] = None) -> list:
-    """returns a list of entity names that are members of a given category."""
+def get_category_members(category: str, lang: str, version: Optional[str] = None, depth: int = 0, force: Optional[bool] = False) -> set:
+    """
+    returns a set of entity names that are members of a given category.
+    Subcategories are followed recursively up to the given depth. The resolved members are cached in memory
+    for the current run and on disk per language, category, dump version and depth.
+    With force the on-disk cache is ignored and the category is resolved again once per run.
+    """
+    key = (lang, category, version, depth)
+
+    # extractors running at the same time wait for the first one to resolve a category instead of resolving it again
+    with _category_locks_lock:
+        lock = _category_locks.setdefault(key, threading.Lock())
+
+    with lock:
+        if key in _category_cache:
+            return _category_cache[key]
+
+        cache_file = _get_category_file(category, lang, version, depth)
+
+        members = set()
+
+        if cache_file.exists() and not force:
+            with open(cache_file, "r", newline="", encoding="utf-8") as csvfile:
+                csvreader = csv.reader(csvfile)
+                for row in csvreader:
+                    members.update(row)
+        else:
+            members = _resolve_category(category, lang, depth)
+
+            CATEGORY_FOLDER.mkdir(parents=True, exist_ok=True)
+            tmp_file = cache_file.with_suffix(f".{os.getpid()}.tmp")
+            with open(tmp_file, "w", encoding="utf-8", newline="") as out:
+                out_writer = csv.writer(out)
+                for member in members:
+                    out_writer.writerow([member])
+            tmp_file.replace(cache_file)
+
+        _category_cache[key] = members
+
+    return members
+
+
+def _get_category_file(category: str, lang: str, version: Optional[str], depth: int) -> Path:
+    """returns the path of the on-disk cache file for a resolved category"""
+    cat_name = re.sub(r"[^\w\-]", "_", category)
+    return CATEGORY_FOLDER / f"{lang}_{version or 'latest'}_{cat_name}_{depth}.csv"
+
+
+def _resolve_category(category: str, lang: str, depth: int) -> set:
+    """
+    resolves the members of a category level by level. All subcategories of one level are fetched concurrently,
+    already visited categories are skipped to avoid cycles in the category graph.
+    """
+    members = set()
+    visited = {category}
+    level = [category]
+
+    with ThreadPoolExecutor(max_workers=CATEGORY_WORKERS) as executor:
+        for cur_depth in range(depth + 1):
+            follow = cur_depth < depth
+            next_level = []
+
+            for pages, subcats in executor.map(lambda cat: _fetch_category(cat, lang, follow), level):
+                members.update(pages)
+                for subcat in subcats:
+                    if subcat not in visited:
+                        visited.add(subcat)
+                        next_level.append(subcat)
+
+            if len(next_level) == 0:
+                break
+
+            level = next_level
+
+    return members
+
+
+def _fetch_category(category: str, lang: str, subcats: bool = False) -> Tuple[set, set]:
+    """returns the pages and (optionally) the subcategories that are direct members of a single category"""
 
     base_url = f"https://{lang}.wikipedia.org/w/api.php"
 
-    results = set()
+    pages = set()
+    categories = set()
 
     params = {
         "action": "query",
         "cmtitle": category,
         "list": "categorymembers",
         "cmlimit": "max",
-        "cmtype": "page",
+        "cmtype": "page|subcat" if subcats else "page",
         "formatversion": "2",
         "format": "json"
     }
 
-    # handle recursion
-    if continue_val is not None:
-        params["cmcontinue"] = continue_val
-
-    if part_results is not None:
-        results = part_results
-
     cont_req = True
 
     while cont_req:
+        metrics.count("api_calls")
         with requests.get(base_url, params=params, timeout=5) as res:
             if res.status_code != 200:
                 # catch rate limiting errors and try to distribute load a bit better
                 if res.status_code == 429:
                     time.sleep(random.randint(1, 10))
-                    return get_category_members(category, lang, continue_val, results)
+                    continue
                 res.raise_for_status()
                 raise RuntimeError(
                     f"{base_url} returned {res.status_code} status")
@@ -116,10 +326,13 @@ def get_category_members(category: str, lang: str, continue_val: Optional[str] =
                 cont_req = False
 
             for item in data["query"]["categorymembers"]:
-                results.add(item["title"].replace(" ", "_"))
-            
+                title = item["title"].replace(" ", "_")
+                if item.get("ns") == CATEGORY_NAMESPACE:
+                    categories.add(title)
+                else:
+                    pages.add(title)
+
             if cont_req:
-                continue_val = data["continue"]["cmcontinue"]
-                params["cmcontinue"] = continue_val
+                params["cmcontinue"] = data["continue"]["cmcontinue"]
 
-    return list(results)
+    return pages, categories
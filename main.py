@@ -1,28 +1,89 @@
+import sys
 import argparse
-import re
-import data.utils as dat_util
-from dbpedia_enhance import property_extractor, entity_extractor_new, property_matcher, translate_entity, type_extractor
-from analysis import analysis
+from pathlib import Path
+from dbpedia_enhance import executor
 
-parser = argparse.ArgumentParser(prog="DBpedia Property Enhancer",
-                                 description="This program will enhance dbpedia coverage by bidirectionally matching missing properties between two languages.")
+# the other modules are imported by the commands that need them, so that short commands start quickly
+
+COMMANDS = ["run", "download", "extract", "translate", "match", "expand", "analyze", "serve"]
 
-parser.add_argument("--src_lang", type=str, default="en",
+common = argparse.ArgumentParser(add_help=False)
+
+common.add_argument("--src_lang", type=str, default="en",
                     help="The source language from where properties should be extracted")
 
-parser.add_argument("--trg_lang", type=str, required=True,
+common.add_argument("--trg_lang", type=str, required=True,
                     help="The target language from where properties should be extracted")
 
-parser.add_argument("--version", type=str, default="2022.03.01",
+common.add_argument("--version", type=str, default="2022.03.01",
                     help="The version of the DBpedia infobox dump to use for analysis")
-parser.add_argument("--force_new", type=bool, default=False,
+common.add_argument("--force_new", type=bool, default=False,
                     help="Force a regeneration of all extracted properties")
-parser.add_argument("--src_cat", type=str, default=None,
+common.add_argument("--src_cat", type=str, default=None,
                     help="Limit the extraction of properties on the source file to members of this category.")
-parser.add_argument("--trg_cat", type=str, default=None,
+common.add_argument("--trg_cat", type=str, default=None,
                     help="Limit the extraction of properties on the target file to members of this category.")
-parser.add_argument("--out_suffix", type=str, default=None,
-                    help="Add this as suffix to the names of the extracted files")
+common.add_argument("--cat_depth", type=int, default=0,
+                    help="Also include members of subcategories of src_cat and trg_cat up to this depth.")
+common.add_argument("--out_suffix", type=str, default=None,
+                    help="Add this as suffix to the name of the matches file")
+common.add_argument("--max_memory", type=float, default=None,
+                    help="Match the entities with an external sort that keeps at most this many MB in memory")
+common.add_argument("--value_tolerance", type=float, default=0.0,
+                    help="Count numbers as equal if they differ by at most this fraction of the larger one, e.g. 0.01 for 1%%")
+common.add_argument("--time_budget", type=float, default=None,
+                    help="Stop the matching after this many minutes, the largest properties are matched first and a later run continues with the others")
+common.add_argument("--workers", type=int, default=None,
+                    help="Number of workers used by all stages, defaults to the number of cpus")
+common.add_argument("--backend", type=str, default="process", choices=executor.BACKENDS,
+                    help="Run the workers as processes, threads, serially in the main process or distributed over several hosts")
+common.add_argument("--coordinator", type=str, default=None,
+                    help="host:port the coordinator of the distributed backend listens on, only local workers can connect by default")
+common.add_argument("--local_workers", type=int, default=None,
+                    help="Number of workers of the distributed backend started on this host, defaults to workers")
+common.add_argument("--profile", action="store_true",
+                    help="Record time, memory and throughput of every stage and worker and write a report")
+common.add_argument("--profile_stages", type=str, nargs="+", default=None,
+                    help="Capture a cProfile profile of these stages or worker functions (requires --profile)")
+common.add_argument("--sample_stages", type=str, nargs="+", default=None,
+                    help="Capture a sampling profile of these stages (requires --profile)")
+common.add_argument("--cache_max_size", type=float, default=None,
+                    help="Remove the least recently used cached results until the cache is smaller than this size in GB")
+common.add_argument("--cache_max_age", type=float, default=None,
+                    help="Remove cached results that have not been used for this number of days")
+
+parser = argparse.ArgumentParser(prog="DBpedia Property Enhancer",
+                                 description="This program will enhance dbpedia coverage by bidirectionally matching missing properties between two languages.")
+
+subparsers = parser.add_subparsers(dest="command", metavar="command")
+run_parser = subparsers.add_parser("run", parents=[common],
+                                   help="Download, extract, translate and match both languages (default)")
+run_parser.add_argument("--expand", action="store_true",
+                        help="Also generate the triples that are missing in the target language from the matches")
+run_parser.add_argument("--preview", action="store_true",
+                        help="Only estimate the number of matches from a sample of the source subjects")
+run_parser.add_argument("--preview_subjects", type=int, default=1000,
+                        help="Number of source subjects the preview samples")
+subparsers.add_parser("download", parents=[common],
+                      help="Download the dumps of both languages")
+subparsers.add_parser("extract", parents=[common],
+                      help="Extract the properties of both languages")
+subparsers.add_parser("translate", parents=[common],
+                      help="Translate the target properties into the source language")
+subparsers.add_parser("match", parents=[common],
+                      help="Match the properties of both languages, reusing the cached extractions and translations")
+subparsers.add_parser("expand", parents=[common],
+                      help="Generate the triples that are missing in the target language from the matches as compressed N-Triples shards")
+analyze_parser = subparsers.add_parser("analyze", parents=[common],
+                                       help="Print the statistics of both extractions and plot the property distribution of the target language")
+analyze_parser.add_argument("--overlap", action="store_true",
+                            help="Also count the subjects present in every combination of both languages")
+serve_parser = subparsers.add_parser("serve", parents=[common],
+                                     help="Answer read-only queries on the extractions and matches of both languages over http")
+serve_parser.add_argument("--host", type=str, default="127.0.0.1",
+                          help="Address the query service listens on, only local clients can connect by default")
+serve_parser.add_argument("--port", type=int, default=8080,
+                          help="Port the query service listens on")
 
 ALL_LANG_FILES = [
     "https://databus.dbpedia.org/dbpedia/generic/infobox-properties/2022.03.01/infobox-properties_lang=de.ttl.bz2",
@@ -30,43 +91,218 @@ ALL_LANG_FILES = [
     "https://databus.dbpedia.org/dbpedia/generic/infobox-properties/2022.03.01/infobox-properties_lang=nl.ttl.bz2"
 ]
 
-if __name__ == "__main__":
 
-    options = parser.parse_args()
-
-    src_lang_link = f"https://databus.dbpedia.org/dbpedia/generic/infobox-properties/{options.version}/infobox-properties_lang={options.src_lang}.ttl.bz2"
-    trg_lang_link = f"https://databus.dbpedia.org/dbpedia/generic/infobox-properties/{options.version}/infobox-properties_lang={options.trg_lang}.ttl.bz2"
-
-    lang_files = [src_lang_link, trg_lang_link]
-
-    # replace this with ALL_LANG_FILES to run download for all considered languages
-    filenames = dat_util.get_data(lang_files, options.force_new)
-
-    #subj_translations = translate_entity.get_translations(
-    #    filenames, options.out_suffix)
-
-    # TODO: write this in a better way
-    src_props = set()
-    src_entities = set()
-    trg_props = set()
-    trg_entities = set()
-    for fname in filenames:
-        if re.search(f"{options.src_lang}.ttl", fname):
-            src_props = property_extractor.extract_properties(
-                fname, options.out_suffix, options.src_cat, options.force_new)
-            src_entities = entity_extractor_new.extract_subjects(
-                fname, options.out_suffix, options.src_cat, options.force_new)
-        else:
-            trg_props = property_extractor.extract_properties(
-                fname, options.out_suffix, options.trg_cat, options.force_new)
-            trg_entities = entity_extractor_new.extract_subjects(
-                fname, options.out_suffix, options.trg_cat, options.force_new)
-
-    matches = property_matcher.find_matches(
-        src_props, trg_props, options.src_lang, options.trg_lang, options.out_suffix)
-    
+def parse_args(args: list) -> argparse.Namespace:
+    """parses the command line, calls without a command run the whole pipeline like before the commands existed"""
+    if len(args) == 0 or (args[0] not in COMMANDS and args[0] not in ["-h", "--help"]):
+        args = ["run"] + args
+
+    return parser.parse_args(args)
+
+
+def run(options: argparse.Namespace) -> None:
+    from dbpedia_enhance import pipeline
+
+    if options.preview:
+        return run_preview(options)
+
+    matches, src_props, trg_props = pipeline.run_pipeline(options)
+
+    print_matches(matches, trg_props)
+
+
+def run_preview(options: argparse.Namespace) -> None:
+    from dbpedia_enhance import pipeline, preview
+
+    src_file = pipeline.get_dump_file(options.version, options.src_lang)
+    trg_file = pipeline.get_dump_file(options.version, options.trg_lang)
+
+    estimate = preview.run_preview(src_file, trg_file, options.src_lang, options.trg_lang, options.preview_subjects, options.src_cat,
+                                   options.trg_cat, options.version, options.cat_depth, options.out_suffix, options.value_tolerance)
+
+    print("")
+    print("#############")
+    print(f"about {estimate['matches']} matches expected (95% interval {estimate['low']} - {estimate['high']}), "
+          f"{estimate['direct_matches']} of them direct matches")
+    print(f"estimated from {estimate['sampled_subjects']} of about {estimate['estimated_subjects']} subjects in {estimate['seconds']}s, "
+          f"written to {preview.get_preview_file(options.src_lang, options.trg_lang, options.out_suffix)}")
+
+
+def download(options: argparse.Namespace) -> None:
+    import data.utils as dat_util
+    from dbpedia_enhance import pipeline
+
+    fnames = dat_util.get_data([pipeline.get_dump_url(options.version, lang) for lang in [options.src_lang, options.trg_lang]],
+                               options.force_new)
+    print(f"### downloaded {', '.join(fnames)}")
+
+
+def extract(options: argparse.Namespace) -> tuple:
+    from dbpedia_enhance import pipeline, property_extractor
+
+    results = []
+    for lang, category in [(options.src_lang, options.src_cat), (options.trg_lang, options.trg_cat)]:
+        fname = pipeline.get_dump_file(options.version, lang)
+        props, prop_dir = property_extractor.extract_properties(
+            fname, category, options.force_new, options.version, options.cat_depth)
+        print(f"### {len(props)} properties of {lang} in {prop_dir}")
+        results.append((props, prop_dir))
+
+    return tuple(results)
+
+
+def translate(options: argparse.Namespace) -> None:
+    from dbpedia_enhance import property_matcher
+
+    (src_props, _), (trg_props, trg_dir) = extract(options)
+    _, trg_clean, _ = property_matcher.prepare_matching(src_props, trg_props)
+
+    num_translated = 0
+    failed = set()
+    for _ in property_matcher.get_translated_properties(sorted(trg_clean), options.trg_lang, options.src_lang, trg_dir, options.force_new, failed):
+        num_translated += 1
+    print(f"### {num_translated} properties of {options.trg_lang} translated")
+    if len(failed) > 0:
+        print(f"### {len(failed)} properties could not be translated, the translations are not cached")
+
+
+def match(options: argparse.Namespace) -> tuple:
+    from dbpedia_enhance import property_extractor, property_matcher
+
+    # the budget counts from the start of the command, so the extraction is part of it
+    budget = property_matcher.TimeBudget(
+        options.time_budget * 60) if options.time_budget is not None else None
+
+    (src_props, src_dir), (trg_props, trg_dir) = extract(options)
+
+    out_file = property_matcher.get_matches_file(
+        options.src_lang, options.trg_lang, options.out_suffix)
+
+    max_memory = options.max_memory
+    if max_memory is not None:
+        max_memory = int(max_memory * 1024 ** 2)
+    mode = property_matcher.get_match_mode(max_memory, options.value_tolerance)
+
+    matches = property_matcher.get_cached_matches(
+        src_dir, trg_dir, out_file, mode) if not options.force_new else None
+
+    if matches is None:
+        src_clean, trg_clean, matches = property_matcher.prepare_matching(
+            src_props, trg_props)
+
+        checkpoint = property_matcher.get_checkpoint(
+            src_dir, trg_dir, mode, options.force_new) if max_memory is None else None
+        # properties an interrupted run already compared are neither translated nor counted against the time budget
+        finished = property_matcher.get_checkpointed_properties(checkpoint) if checkpoint is not None else set()
+
+        # the translations of an earlier translate or match command are read from the cache
+        failed = set()
+        trg_items = property_matcher.get_translated_properties(
+            property_matcher.order_by_size(trg_clean, property_extractor.get_property_sizes(trg_dir)),
+            options.trg_lang, options.src_lang, trg_dir, options.force_new, failed, lambda prop: prop in finished)
+        overlap = property_matcher.find_entity_matches_translated(
+            list(src_clean), trg_items, src_dir, max_memory, options.value_tolerance, checkpoint, budget)
+        matches.extend(overlap.get_matches())
+        property_matcher.save_matches(matches, src_clean, trg_clean, options.src_lang,
+                                      options.trg_lang, src_dir, trg_dir, out_file, mode, overlap, budget, failed)
+
+    print_matches(matches, trg_props)
+
+    return matches, src_dir, trg_dir
+
+
+def expand(options: argparse.Namespace) -> None:
+    from dbpedia_enhance import infobox_expander
+
+    matches, src_dir, trg_dir = match(options)
+
+    max_memory = options.max_memory
+    if max_memory is not None:
+        max_memory = int(max_memory * 1024 ** 2)
+
+    infobox_expander.expand_infoboxes(matches, options.src_lang, options.trg_lang, src_dir, trg_dir,
+                                      options.out_suffix, max_memory, options.force_new)
+
+
+def analyze(options: argparse.Namespace) -> None:
+    from dbpedia_enhance import catalog
+    from analysis import analysis
+
+    (_, src_dir), (trg_props, trg_dir) = extract(options)
+
+    for lang, prop_dir in [(options.src_lang, src_dir), (options.trg_lang, trg_dir)]:
+        print(f"### {lang}: {catalog.get_catalog(prop_dir)['totals']}")
+
+    analysis.get_prop_distribution(trg_props, trg_dir)
+
+    if options.overlap:
+        from dbpedia_enhance import pipeline, translate_entity
+
+        lang_codes, translations = translate_entity.get_translations(
+            [pipeline.get_dump_file(options.version, lang) for lang in [options.src_lang, options.trg_lang]])
+        print(f"### overlap: {analysis.get_lang_overlap(translations, lang_codes)}")
+
+
+def serve(options: argparse.Namespace) -> None:
+    from dbpedia_enhance import property_matcher, query_service
+
+    (_, src_dir), (_, trg_dir) = extract(options)
+
+    # the matches of an earlier run are served if they exist, the service does not compute them
+    out_file = property_matcher.get_matches_file(
+        options.src_lang, options.trg_lang, options.out_suffix)
+    service = query_service.get_query_service(options.src_lang, options.trg_lang, src_dir, trg_dir,
+                                              out_file, property_matcher.get_best_matches_file(out_file), options.force_new)
+
+    server = query_service.create_server(service, options.host, options.port)
+    print(f"### answering queries at http://{options.host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+def print_matches(matches: list, trg_props: set) -> None:
     print("")
     print("#############")
     print(f"{len(matches)} matches found, {round(len(matches)/len(trg_props),4) * 100} percent of target properties matched")
     print("matches:")
-    print(matches)
\ No newline at end of file
+    print(matches)
+
+
+if __name__ == "__main__":
+
+    options = parse_args(sys.argv[1:])
+
+    from data import cache
+    from data.utils import DATA_FOLDER
+    from dbpedia_enhance import metrics, coordinator
+
+    profile_folder = Path(DATA_FOLDER) / "profile"
+
+    if options.profile:
+        metrics.enable(profile_folder, options.profile_stages,
+                       options.sample_stages, executor.MP_CONTEXT)
+
+    # the workers are configured after the metrics, so that they are started with the profiling settings
+    address = coordinator.parse_address(
+        options.coordinator) if options.coordinator is not None else None
+    executor.configure(options.workers, options.backend,
+                       address, options.local_workers)
+
+    COMMAND_FUNCTIONS = {"run": run, "download": download, "extract": extract,
+                         "translate": translate, "match": match, "expand": expand, "analyze": analyze, "serve": serve}
+    COMMAND_FUNCTIONS[options.command](options)
+
+    if options.cache_max_size is not None or options.cache_max_age is not None:
+        max_size = int(options.cache_max_size * 1024 ** 3) if options.cache_max_size is not None else None
+        max_age = options.cache_max_age * 24 * 60 * 60 if options.cache_max_age is not None else None
+        removed = cache.collect_garbage(max_size, max_age)
+        print(f"{len(removed)} cached results removed")
+
+    if options.profile:
+        out_name = f"{options.src_lang}_{options.trg_lang}"
+        if options.out_suffix is not None:
+            out_name = out_name + "_" + options.out_suffix
+        profile_folder.mkdir(parents=True, exist_ok=True)
+        metrics.write_report(profile_folder / f"{out_name}_profile.json")
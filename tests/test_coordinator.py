@@ -0,0 +1,68 @@
+import os
+import time
+import pickle
+
+from dbpedia_enhance import executor
+from dbpedia_enhance.coordinator import TaskBoard
+
+
+def _square(x):
+    return x * x
+
+
+def _fail_once(marker):
+    # fails on the first attempt only, like a worker that crashes on a node
+    if not os.path.exists(marker):
+        open(marker, "w").close()
+        raise RuntimeError("worker crashed")
+    return "done"
+
+
+def test_failed_task_is_retried():
+    board = TaskBoard(max_attempts=2)
+    task_id = board.submit(pickle.dumps((_square, (3,))))
+
+    claimed = board.claim("a", timeout=0)
+    board.fail("a", claimed[0], "boom")
+    claimed = board.claim("b", timeout=0)
+    func, args = pickle.loads(claimed[1])
+    board.complete("b", claimed[0], func(*args))
+
+    assert board.wait_any([task_id], timeout=0) == (task_id, True, 9)
+
+
+def test_task_fails_after_max_attempts():
+    board = TaskBoard(max_attempts=2)
+    task_id = board.submit(pickle.dumps((_square, (3,))))
+
+    for worker in ["a", "b"]:
+        claimed = board.claim(worker, timeout=0)
+        board.fail(worker, claimed[0], "boom")
+
+    assert board.wait_any([task_id], timeout=0) == (task_id, False, "boom")
+    assert board.claim("c", timeout=0) is None
+
+
+def test_expired_lease_is_handed_out_again():
+    board = TaskBoard(lease_timeout=0.05)
+    task_id = board.submit(pickle.dumps((_square, (4,))))
+
+    first = board.claim("lost", timeout=0)
+    time.sleep(0.1)
+    second = board.claim("b", timeout=0)
+    assert second[0] == first[0]
+
+    board.complete("b", second[0], 16)
+    # the lost worker finishing late does not change the result
+    board.complete("lost", first[0], -1)
+
+    assert board.wait_any([task_id], timeout=0) == (task_id, True, 16)
+
+
+def test_local_nodes_run_tasks(tmp_path):
+    executor.configure(2, "distributed")
+    try:
+        assert executor.run(_square, [(x,) for x in range(10)]) == [x * x for x in range(10)]
+        assert executor.apply_async(_fail_once, (str(tmp_path / "marker"),)).get() == "done"
+    finally:
+        executor.configure()
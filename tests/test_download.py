@@ -0,0 +1,100 @@
+import hashlib
+import json
+import os
+
+import pytest
+
+import data.utils as dat_util
+from benchmark.http_server import start_server
+
+FILE_NAME = "dump.ttl"
+FILE_SIZE = 1024 * 1024
+
+
+@pytest.fixture
+def served(tmp_path, monkeypatch):
+    """a random file in a served folder and an empty data folder to download it to"""
+    served_dir = tmp_path / "served"
+    data_dir = tmp_path / "data"
+    served_dir.mkdir()
+    data_dir.mkdir()
+
+    content = os.urandom(FILE_SIZE)
+    with open(served_dir / FILE_NAME, "wb") as out:
+        out.write(content)
+
+    monkeypatch.setattr(dat_util, "DATA_FOLDER", data_dir)
+    monkeypatch.setattr(dat_util, "MIN_SEGMENT_SIZE", 64 * 1024)
+    monkeypatch.setattr(dat_util, "DOWNLOAD_CHUNK_SIZE", 16 * 1024)
+
+    return served_dir, data_dir, content, hashlib.sha256(content).hexdigest()
+
+
+def _download(served_dir, restart=True, checksum=None, connections=4, **server_args):
+    server, base_url = start_server(served_dir, **server_args)
+    try:
+        dat_util._download_file(
+            f"{base_url}/{FILE_NAME}", FILE_NAME, None, connections, checksum, restart)
+    finally:
+        server.shutdown()
+
+
+def test_segmented_download_equals_source(served):
+    served_dir, data_dir, content, checksum = served
+
+    _download(served_dir, checksum=checksum)
+
+    assert (data_dir / FILE_NAME).read_bytes() == content
+    assert (data_dir / f"{FILE_NAME}.sha256").read_text() == checksum
+    assert not (data_dir / f"{FILE_NAME}.part").exists()
+    assert not (data_dir / f"{FILE_NAME}.part.json").exists()
+
+
+def test_resume_after_interruption(served):
+    served_dir, data_dir, content, checksum = served
+
+    with pytest.raises(Exception):
+        _download(served_dir, checksum=checksum, fail_after=FILE_SIZE // 16)
+
+    with open(data_dir / f"{FILE_NAME}.part.json", "r", encoding="utf-8") as f:
+        state = json.load(f)
+    done = sum(seg[2] for seg in state["segments"])
+    assert 0 < done < FILE_SIZE
+
+    _download(served_dir, restart=False, checksum=checksum)
+
+    assert (data_dir / FILE_NAME).read_bytes() == content
+
+
+def test_short_segment_fails_and_resumes(served):
+    served_dir, data_dir, content, checksum = served
+
+    # the server ends every segment early without an error, the download has to fail instead of waiting for the rest
+    with pytest.raises(ConnectionError, match="ended after"):
+        _download(served_dir, checksum=checksum, max_range=FILE_SIZE // 16)
+
+    assert (data_dir / f"{FILE_NAME}.part.json").exists()
+
+    _download(served_dir, restart=False, checksum=checksum)
+
+    assert (data_dir / FILE_NAME).read_bytes() == content
+
+
+def test_checksum_mismatch_removes_partial_files(served):
+    served_dir, data_dir, _, _ = served
+
+    with pytest.raises(RuntimeError, match="checksum mismatch"):
+        _download(served_dir, checksum="0" * 64)
+
+    assert not (data_dir / FILE_NAME).exists()
+    assert not (data_dir / f"{FILE_NAME}.part").exists()
+    assert not (data_dir / f"{FILE_NAME}.part.json").exists()
+
+
+def test_fallback_without_range_support(served):
+    served_dir, data_dir, content, checksum = served
+
+    _download(served_dir, checksum=checksum, ranges=False)
+
+    assert (data_dir / FILE_NAME).read_bytes() == content
+    assert not (data_dir / f"{FILE_NAME}.part.json").exists()